@@ -51,6 +51,7 @@ def interaction_loop(agent=None, environment=None, options={}):
 
         # Determine best exploitive action, or explore.
         explored = False
+        simulations = 0
         if explore and (random.random() < explore_rate):
             # Yes, we're still exploring.
             # Generate a random action to explore.
@@ -60,6 +61,7 @@ def interaction_loop(agent=None, environment=None, options={}):
         # end if
         else:
             action = agent.search()  # TODO: implement
+            simulations = agent.search_simulations
         # end else
 
         # Send the action to the environment.
@@ -72,11 +74,11 @@ def interaction_loop(agent=None, environment=None, options={}):
         time_taken = datetime.datetime.now() - cycle_start
 
         # Log this cycle.
-        message = "%d, %s, %s, %s, %s, %f, %d, %f, %s, %d" % \
+        message = "%d, %s, %s, %s, %s, %f, %d, %f, %s, %d, %d" % \
                   (cycle, str(observation), str(reward),
                    str(action), str(explored), explore_rate,
                    agent.total_reward, agent.average_reward(),
-                   str(time_taken), agent.model_size())
+                   str(time_taken), agent.model_size(), simulations)
         print(message)
 
         # Update exploration rate.
@@ -100,13 +102,13 @@ def interaction_loop(agent=None, environment=None, options={}):
 def main():
     # Define some default configuration values.
 
-    default_options = {"agent": "mc_aixi_ctw", "agent-horizon": 5, "ct-depth": 50, "environment": "extended_tiger",
+    default_options = {"agent": "mc_aixi_ctw", "agent-horizon": 5, "ct-depth": 50, "ctw-engine": "object", "environment": "extended_tiger",
                        "exploration": 0.99, "explore-decay": 0.99, "learning-period": 0, "mc-simulations": 200,
                        "profile": False, "terminate-age": 0, "verbose": False}
 
     # Print an initial message header.
     message = "cycle, observation, reward, action, explored, " + \
-              "explore_rate, total reward, average reward, time, model size"
+              "explore_rate, total reward, average reward, time, model size, simulations"
     print(message)
 
     options = {}
@@ -0,0 +1,654 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the context tree and the MC-AIXI-CTW agent.
+
+Run `python benchmark.py --help` for the list of benchmarks and their options.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import math
+import os
+import random
+import resource
+import timeit
+import tracemalloc
+
+import ctw_context_tree
+import ctw_factored
+import ctw_mapped
+import ctw_serialization
+import mc_aixi_ctw
+import util
+
+from environments.cheese_maze import CheeseMaze
+from environments.extended_tiger import ExtendedTiger
+from environments.tic_tac_toe import Tic_Tac_Toe
+
+# The environments that the factored model benchmark can draw its percepts from.
+environments = {'cheese-maze': CheeseMaze,
+                'extended-tiger': ExtendedTiger,
+                'tic-tac-toe': Tic_Tac_Toe}
+
+
+def history_latency(depth=50, age=1000000, interval=100000, cycle_bits=8, horizon=5, engine=None):
+    """ Measures how the cost of a simulated cycle changes as the agent ages.
+
+        A context tree is fed `age` random symbols. Every `interval` symbols, the time taken to
+        update and revert a simulation of `horizon` cycles of `cycle_bits` symbols is printed.
+        With a constant time history, the latency should stay flat as the age grows.
+    """
+
+    engine = engine or ctw_context_tree.CTWContextTree
+    tree = engine(depth, history_window=horizon * cycle_bits)
+    simulation = [random.randint(0, 1) for i in range(horizon * cycle_bits)]
+
+    def simulate():
+        tree.update(simulation)
+        tree.revert(len(simulation))
+    # end def
+
+    print("age, microseconds per simulated symbol")
+
+    while len(tree.history) < age:
+        tree.update([random.randint(0, 1) for i in range(interval)])
+
+        seconds = min(timeit.repeat(simulate, number=10, repeat=3)) / 10
+        print("%d, %f" % (len(tree.history), 1e6 * seconds / len(simulation)))
+    # end while
+
+# end def
+
+
+def sampling_rate(depth=50, age=10000, percept_bits=8, seconds=2.0, engine=None):
+    """ Measures how many percepts per second a context tree can sample during simulations.
+
+        A context tree is fed `age` random symbols, then percepts of `percept_bits` symbols are
+        repeatedly sampled (and committed) from the tree, and reverted, as the search does.
+    """
+
+    engine = engine or ctw_context_tree.CTWContextTree
+    tree = engine(depth)
+    tree.update([random.randint(0, 1) for i in range(age)])
+
+    percepts = 0
+    timer = timeit.default_timer
+    start = timer()
+
+    while timer() - start < seconds:
+        tree.generate_random_symbols_and_update(percept_bits)
+        tree.revert(percept_bits)
+        percepts += 1
+    # end while
+
+    print("%f percepts per second" % (percepts / (timer() - start)))
+
+# end def
+
+
+def factored_model(depth=50, cycles=2000, environment="tic-tac-toe", seconds=2.0, engine=None):
+    """ Compares the per-step cost and predictive log-loss of the single tree and factored models.
+
+        An environment is played for `cycles` cycles with actions chosen uniformly at random. Each
+        model predicts every percept before it is added, and the mean log-loss of those predictions
+        is printed, in bits per percept, for the last half of the cycles. The models then sample
+        (and revert) percepts, as the search does, for `seconds` seconds each.
+    """
+
+    engine = engine or ctw_context_tree.CTWContextTree
+    environment = environments[environment]({})
+
+    action_bits = environment.action_bits()
+    observation_bits = environment.observation_bits()
+    reward_bits = environment.reward_bits()
+    percept_bits = observation_bits + reward_bits
+
+    models = [("single", engine(depth)),
+              ("factored", ctw_factored.FactoredCTWContextTree(depth, action_bits + percept_bits, engine=engine))]
+
+    # Play the environment, in the order the agent sees it: a percept, then an action.
+    cycle_symbols = []
+
+    for cycle in range(cycles):
+        percept = util.encode(environment.reward, reward_bits) + util.encode(environment.observation, observation_bits)
+        action = random.choice(environment.valid_actions)
+        environment.perform_action(action)
+        cycle_symbols.append((percept, util.encode(action, action_bits)))
+    # end for
+
+    print("model, bits per percept, microseconds per cycle update, percepts sampled per second, nodes")
+
+    timer = timeit.default_timer
+
+    for name, tree in models:
+        log_loss = 0.0
+        update_seconds = 0.0
+
+        for cycle, (percept, action) in enumerate(cycle_symbols):
+            if cycle >= cycles // 2:
+                log_loss -= tree.log_predict(percept)
+
+            start = timer()
+            tree.update(percept)
+            tree.update(action)
+            update_seconds += timer() - start
+        # end for
+
+        percepts = 0
+        start = timer()
+
+        while timer() - start < seconds:
+            tree.generate_random_symbols_and_update(percept_bits)
+            tree.revert(percept_bits)
+            percepts += 1
+        # end while
+
+        print("%s, %f, %f, %f, %d" % (name, log_loss / math.log(2) / (cycles - cycles // 2),
+                                      1e6 * update_seconds / cycles, percepts / (timer() - start), tree.size()))
+    # end for
+
+# end def
+
+
+def compact_storage(depth=50, cycles=2000, environment="tic-tac-toe", simulations=4, engines=None):
+    """ Compares the memory use and predictive accuracy of the compact context trees with a double precision one.
+
+        An environment is played for `cycles` cycles with actions chosen uniformly at random, and each
+        tree predicts every percept before it is added. After each cycle, `simulations` percepts are
+        sampled from each tree and reverted without an undo journal, as a search would. The log-loss
+        of each tree, in bits per percept, and the mean and largest absolute difference between its
+        log predictions and those of the double precision tree are printed, with its bytes per node.
+    """
+
+    engines = engines or ["pool", "compact", "compact16"]
+    environment = environments[environment]({})
+
+    action_bits = environment.action_bits()
+    observation_bits = environment.observation_bits()
+    reward_bits = environment.reward_bits()
+    percept_bits = observation_bits + reward_bits
+
+    trees = [(name, mc_aixi_ctw.ctw_engines[name](depth)) for name in engines]
+    reference = ctw_context_tree.CTWContextTree(depth)
+
+    log_losses = dict([(name, 0.0) for name in engines])
+    differences = dict([(name, []) for name in engines])
+
+    for cycle in range(cycles):
+        percept = util.encode(environment.reward, reward_bits) + util.encode(environment.observation, observation_bits)
+        action = random.choice(environment.valid_actions)
+        environment.perform_action(action)
+        action = util.encode(action, action_bits)
+
+        reference_log_probability = reference.log_predict(percept)
+        reference.update(percept + action)
+
+        for name, tree in trees:
+            log_probability = tree.log_predict(percept)
+            log_losses[name] -= log_probability
+            differences[name].append(abs(log_probability - reference_log_probability))
+
+            tree.update(percept + action)
+
+            for simulation in range(simulations):
+                tree.generate_random_symbols_and_update(percept_bits)
+                tree.revert(percept_bits)
+            # end for
+
+            tree.enforce_node_budget()
+        # end for
+    # end for
+
+    print("engine, bits per percept, mean absolute log difference, largest absolute log difference, "
+          "bytes per node, nodes")
+
+    for name, tree in trees:
+        print("%s, %f, %g, %g, %d, %d" % (name, log_losses[name] / math.log(2) / cycles,
+                                          sum(differences[name]) / cycles, max(differences[name]),
+                                          tree.bytes_per_node(), tree.size()))
+    # end for
+
+# end def
+
+
+def frozen_search(depth=16, cycles=1000, environment="cheese-maze", simulations=50, searches=10, engine="object"):
+    """ Compares the search speed of an agent's learned context tree with that of the tree frozen.
+
+        An agent learns from `cycles` cycles of the environment, played with actions chosen uniformly
+        at random. It then searches for an action `searches` times with `simulations` simulations
+        each, before and after its model is frozen (see `MC_AIXI_CTW_Agent.freeze`), and the
+        simulations per second of each are printed.
+    """
+
+    environment = environments[environment]({})
+
+    options = {"action-bits": environment.action_bits(), "observation-bits": environment.observation_bits(),
+               "percept-bits": environment.percept_bits(), "reward-bits": environment.reward_bits(),
+               "max-action": environment.maximum_action(), "max-observation": environment.maximum_observation(),
+               "max-reward": environment.maximum_reward()}
+    environment.set_options(options)
+
+    agent = mc_aixi_ctw.MC_AIXI_CTW_Agent(environment, {"agent-horizon": 5, "ct-depth": depth, "ctw-engine": engine,
+                                                        "learning-period": cycles, "mc-simulations": simulations})
+
+    for cycle in range(cycles):
+        agent.model_update_percept(environment.observation, environment.reward)
+        action = agent.generate_random_action()
+        environment.perform_action(action)
+        agent.model_update_action(action)
+    # end for
+
+    agent.model_update_percept(environment.observation, environment.reward)
+
+    print("model, simulations per second, nodes")
+
+    timer = timeit.default_timer
+
+    for name in ("learned", "frozen"):
+        if name == "frozen":
+            agent.freeze()
+
+        start = timer()
+
+        for search in range(searches):
+            agent.search()
+
+        print("%s, %f, %d" % (name, searches * simulations / (timer() - start), agent.model_size()))
+    # end for
+
+# end def
+
+
+def mapped_growth(depth=48, age=2000000, interval=200000, path=None):
+    """ Measures the update throughput of a memory-mapped context tree as it grows, and how long it takes to reopen.
+
+        A memory-mapped context tree (see `ctw_mapped.MappedCTWContextTree`), kept in the file at `path`,
+        is fed `age` random symbols. Every `interval` symbols, the number of nodes, the size of the file,
+        the largest resident set of the process and the symbols added per second over the interval
+        are printed. Once the tree has outgrown physical memory, the throughput is that of paging its
+        deeper nodes in from the file. The tree is then closed, and the time taken to reopen it printed.
+    """
+
+    if path is None:
+        path = "ctw-benchmark.nodes"
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    tree = ctw_mapped.MappedCTWContextTree(depth, path=path)
+
+    print("symbols, nodes, file megabytes, peak resident megabytes, symbols per second")
+
+    timer = timeit.default_timer
+
+    while len(tree.history) < age:
+        symbols = [random.randint(0, 1) for i in range(interval)]
+
+        start = timer()
+        tree.update(symbols)
+        tree.enforce_node_budget()
+        seconds = timer() - start
+
+        print("%d, %d, %f, %f, %f" % (len(tree.history), tree.size(), os.path.getsize(path) / 2 ** 20,
+                                      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+                                      interval / seconds))
+    # end while
+
+    tree.close()
+
+    start = timer()
+    tree = ctw_mapped.MappedCTWContextTree(depth, path=path)
+    print("reopened %d nodes in %f seconds" % (tree.size(), timer() - start))
+    tree.close()
+
+# end def
+
+
+def root_parallel_search(depth=16, cycles=1000, environment="cheese-maze", simulations=200, searches=10, workers=None):
+    """ Compares the search speed of an agent with different numbers of search worker processes.
+
+        For each number of workers (see the 'mc-workers' option of `MC_AIXI_CTW_Agent`), an agent learns
+        from `cycles` cycles of the environment, played with actions chosen uniformly at random, then
+        plays `searches` cycles with actions found by searches of `simulations` simulations each.
+        The simulations per second of those cycles are printed, including the time taken to send the
+        workers the actions and percepts of each cycle, but not to start them.
+    """
+
+    if workers is None:
+        workers = [0, 2, 4]
+
+    print("workers, simulations per second")
+
+    timer = timeit.default_timer
+
+    for worker_count in workers:
+        world = environments[environment]({})
+
+        options = {"action-bits": world.action_bits(), "observation-bits": world.observation_bits(),
+                   "percept-bits": world.percept_bits(), "reward-bits": world.reward_bits(),
+                   "max-action": world.maximum_action(), "max-observation": world.maximum_observation(),
+                   "max-reward": world.maximum_reward()}
+        world.set_options(options)
+
+        agent = mc_aixi_ctw.MC_AIXI_CTW_Agent(world, {"agent-horizon": 5, "ct-depth": depth,
+                                                      "mc-simulations": simulations, "mc-workers": worker_count})
+
+        for cycle in range(cycles):
+            agent.model_update_percept(world.observation, world.reward)
+            action = agent.generate_random_action()
+            world.perform_action(action)
+            agent.model_update_action(action)
+        # end for
+
+        # Start the workers, if any, with a first search.
+        agent.model_update_percept(world.observation, world.reward)
+        action = agent.search()
+
+        start = timer()
+
+        for search in range(searches):
+            world.perform_action(action)
+            agent.model_update_action(action)
+            agent.model_update_percept(world.observation, world.reward)
+            action = agent.search()
+        # end for
+
+        print("%d, %f" % (worker_count, searches * simulations / (timer() - start)))
+
+        agent.stop_search_workers()
+    # end for
+
+# end def
+
+
+def search_tree_reuse(depth=16, cycles=200, environment="extended-tiger", simulations=None, seeds=3, discount=1.0):
+    """ Compares the rewards of agents that reuse their search trees with those of agents that do not.
+
+        For each number of simulations, an agent that starts each search with a new search tree, and one
+        that reuses its search tree (see the 'mc-reuse-tree' option of `MC_AIXI_CTW_Agent`), with its visits
+        discounted by `discount` each cycle, play `cycles` cycles of the environment, with actions found by
+        searches of that many simulations, once for each of `seeds` random seeds. The average reward per
+        cycle, and the seconds per cycle, of each are printed.
+    """
+
+    if simulations is None:
+        simulations = [25, 50, 100]
+
+    print("reuse, simulations, average reward, seconds per cycle")
+
+    timer = timeit.default_timer
+
+    for simulation_count in simulations:
+        for reuse in (False, True):
+            total_reward = 0.0
+            seconds = 0.0
+
+            for seed in range(seeds):
+                random.seed(seed)
+
+                world = environments[environment]({})
+
+                options = {"action-bits": world.action_bits(), "observation-bits": world.observation_bits(),
+                           "percept-bits": world.percept_bits(), "reward-bits": world.reward_bits(),
+                           "max-action": world.maximum_action(), "max-observation": world.maximum_observation(),
+                           "max-reward": world.maximum_reward()}
+                world.set_options(options)
+
+                agent = mc_aixi_ctw.MC_AIXI_CTW_Agent(world, {"agent-horizon": 4, "ct-depth": depth,
+                                                              "mc-simulations": simulation_count,
+                                                              "mc-reuse-tree": reuse, "mc-reuse-discount": discount})
+
+                start = timer()
+
+                for cycle in range(cycles):
+                    agent.model_update_percept(world.observation, world.reward)
+                    action = agent.search()
+                    world.perform_action(action)
+                    agent.model_update_action(action)
+                # end for
+
+                seconds += timer() - start
+                total_reward += agent.total_reward
+            # end for
+
+            print("%s, %d, %f, %f" % (reuse, simulation_count, total_reward / (seeds * cycles),
+                                      seconds / (seeds * cycles)))
+        # end for
+    # end for
+
+# end def
+
+
+def search_store(depth=16, cycles=300, environment="cheese-maze", simulations=2000, searches=3, stores=None):
+    """ Compares the speed and memory of search trees of node objects with those of search pools.
+
+        For each way of storing the nodes of the search tree (see the 'mc-search-store' option of
+        `MC_AIXI_CTW_Agent`), an agent learns from `cycles` cycles of the environment, played with
+        actions chosen uniformly at random, with the same random seed. Its model is then frozen, and
+        its search tree caches percepts, so that the model takes as little of the search time as it
+        can. It searches `searches` times with `simulations` simulations each, and the simulations
+        and search tree nodes per second are printed. The searches are then run again while memory
+        allocations are traced, with a new search pool, and the peak memory allocated during them
+        is printed.
+    """
+
+    if stores is None:
+        stores = ["object", "pool"]
+
+    print("store, simulations per second, nodes per second, nodes, peak kilobytes")
+
+    timer = timeit.default_timer
+
+    for store in stores:
+        random.seed(0)
+
+        world = environments[environment]({})
+
+        options = {"action-bits": world.action_bits(), "observation-bits": world.observation_bits(),
+                   "percept-bits": world.percept_bits(), "reward-bits": world.reward_bits(),
+                   "max-action": world.maximum_action(), "max-observation": world.maximum_observation(),
+                   "max-reward": world.maximum_reward()}
+        world.set_options(options)
+
+        agent = mc_aixi_ctw.MC_AIXI_CTW_Agent(world, {"agent-horizon": 5, "ct-depth": depth,
+                                                      "mc-simulations": simulations, "mc-search-store": store,
+                                                      "mc-percept-cache": True})
+
+        for cycle in range(cycles):
+            agent.model_update_percept(world.observation, world.reward)
+            action = agent.generate_random_action()
+            world.perform_action(action)
+            agent.model_update_action(action)
+        # end for
+
+        agent.model_update_percept(world.observation, world.reward)
+        agent.freeze()
+
+        nodes = 0
+        start = timer()
+
+        for search in range(searches):
+            nodes += agent.sample_search_tree(simulations).size()
+
+        seconds = timer() - start
+
+        # Trace the searches again, with the search pool allocated while they are traced.
+        agent.search_pool = None
+
+        tracemalloc.start()
+        traced, peak = tracemalloc.get_traced_memory()
+
+        for search in range(searches):
+            agent.sample_search_tree(simulations)
+
+        peak = tracemalloc.get_traced_memory()[1] - traced
+        tracemalloc.stop()
+
+        print("%s, %f, %f, %d, %d" % (store, searches * simulations / seconds, nodes / seconds, nodes, peak // 1024))
+    # end for
+
+# end def
+
+
+def serialized_model(depth=48, age=500000, engine="pool", path=None):
+    """ Measures how long it takes to save a context tree to a file, and to load it back, and its size.
+
+        A context tree of the given engine is fed `age` random symbols, saved to the file at `path`
+        (see `ctw_serialization.save_tree`), and loaded into a new tree of the same engine. The number
+        of nodes, the size of the file, the bytes it takes for each node, and the seconds taken to
+        save and to load the tree are printed.
+    """
+
+    if path is None:
+        path = "ctw-benchmark.model"
+
+    tree = mc_aixi_ctw.ctw_engines[engine](depth)
+    tree.update([random.randint(0, 1) for i in range(age)])
+
+    timer = timeit.default_timer
+
+    start = timer()
+    with open(path, 'wb') as stream:
+        ctw_serialization.save_tree(tree, stream)
+    save_seconds = timer() - start
+
+    loaded = mc_aixi_ctw.ctw_engines[engine](depth)
+
+    start = timer()
+    with open(path, 'rb') as stream:
+        ctw_serialization.load_tree(stream, loaded)
+    load_seconds = timer() - start
+
+    assert loaded.size_by_depth() == tree.size_by_depth(), "The loaded context tree differs from the saved one."
+
+    size = os.path.getsize(path)
+
+    print("nodes, file bytes, bytes per node, save seconds, load seconds")
+    print("%d, %d, %f, %f, %f" % (tree.size(), size, size / tree.size(), save_seconds, load_seconds))
+
+    os.remove(path)
+
+# end def
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark")
+
+    history_parser = subparsers.add_parser("history", help=history_latency.__doc__.splitlines()[0].strip())
+    history_parser.add_argument("--depth", type=int, default=50)
+    history_parser.add_argument("--age", type=int, default=1000000)
+    history_parser.add_argument("--interval", type=int, default=100000)
+    history_parser.add_argument("--engine", choices=sorted(mc_aixi_ctw.ctw_engines), default="object")
+
+    sampling_parser = subparsers.add_parser("sampling", help=sampling_rate.__doc__.splitlines()[0].strip())
+    sampling_parser.add_argument("--depth", type=int, default=50)
+    sampling_parser.add_argument("--age", type=int, default=10000)
+    sampling_parser.add_argument("--percept-bits", type=int, default=8)
+    sampling_parser.add_argument("--engine", choices=sorted(mc_aixi_ctw.ctw_engines), default="object")
+
+    factored_parser = subparsers.add_parser("factored", help=factored_model.__doc__.splitlines()[0].strip())
+    factored_parser.add_argument("--depth", type=int, default=50)
+    factored_parser.add_argument("--cycles", type=int, default=2000)
+    factored_parser.add_argument("--environment", choices=sorted(environments), default="tic-tac-toe")
+    factored_parser.add_argument("--engine", choices=sorted(mc_aixi_ctw.ctw_engines), default="object")
+
+    compact_parser = subparsers.add_parser("compact", help=compact_storage.__doc__.splitlines()[0].strip())
+    compact_parser.add_argument("--depth", type=int, default=50)
+    compact_parser.add_argument("--cycles", type=int, default=2000)
+    compact_parser.add_argument("--environment", choices=sorted(environments), default="tic-tac-toe")
+    compact_parser.add_argument("--simulations", type=int, default=4)
+    compact_parser.add_argument("--engines", nargs="+", choices=sorted(mc_aixi_ctw.ctw_engines),
+                                default=["pool", "compact", "compact16"])
+
+    frozen_parser = subparsers.add_parser("frozen", help=frozen_search.__doc__.splitlines()[0].strip())
+    frozen_parser.add_argument("--depth", type=int, default=16)
+    frozen_parser.add_argument("--cycles", type=int, default=1000)
+    frozen_parser.add_argument("--environment", choices=sorted(environments), default="cheese-maze")
+    frozen_parser.add_argument("--simulations", type=int, default=50)
+    frozen_parser.add_argument("--searches", type=int, default=10)
+    frozen_parser.add_argument("--engine", choices=sorted(mc_aixi_ctw.ctw_engines), default="object")
+
+    mapped_parser = subparsers.add_parser("mapped", help=mapped_growth.__doc__.splitlines()[0].strip())
+    mapped_parser.add_argument("--depth", type=int, default=48)
+    mapped_parser.add_argument("--age", type=int, default=2000000)
+    mapped_parser.add_argument("--interval", type=int, default=200000)
+    mapped_parser.add_argument("--path", default=None)
+
+    parallel_parser = subparsers.add_parser("parallel", help=root_parallel_search.__doc__.splitlines()[0].strip())
+    parallel_parser.add_argument("--depth", type=int, default=16)
+    parallel_parser.add_argument("--cycles", type=int, default=1000)
+    parallel_parser.add_argument("--environment", choices=sorted(environments), default="cheese-maze")
+    parallel_parser.add_argument("--simulations", type=int, default=200)
+    parallel_parser.add_argument("--searches", type=int, default=10)
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+
+    reuse_parser = subparsers.add_parser("reuse", help=search_tree_reuse.__doc__.splitlines()[0].strip())
+    reuse_parser.add_argument("--depth", type=int, default=16)
+    reuse_parser.add_argument("--cycles", type=int, default=200)
+    reuse_parser.add_argument("--environment", choices=sorted(environments), default="extended-tiger")
+    reuse_parser.add_argument("--simulations", type=int, nargs="+", default=[25, 50, 100])
+    reuse_parser.add_argument("--seeds", type=int, default=3)
+    reuse_parser.add_argument("--discount", type=float, default=1.0)
+
+    store_parser = subparsers.add_parser("store", help=search_store.__doc__.splitlines()[0].strip())
+    store_parser.add_argument("--depth", type=int, default=16)
+    store_parser.add_argument("--cycles", type=int, default=300)
+    store_parser.add_argument("--environment", choices=sorted(environments), default="cheese-maze")
+    store_parser.add_argument("--simulations", type=int, default=2000)
+    store_parser.add_argument("--searches", type=int, default=3)
+    store_parser.add_argument("--stores", nargs="+", choices=["object", "pool"], default=["object", "pool"])
+
+    serialize_parser = subparsers.add_parser("serialize", help=serialized_model.__doc__.splitlines()[0].strip())
+    serialize_parser.add_argument("--depth", type=int, default=48)
+    serialize_parser.add_argument("--age", type=int, default=500000)
+    serialize_parser.add_argument("--engine", choices=sorted(mc_aixi_ctw.ctw_engines), default="pool")
+    serialize_parser.add_argument("--path", default=None)
+
+    arguments = parser.parse_args()
+
+    random.seed(0)
+
+    if arguments.benchmark == "history":
+        history_latency(depth=arguments.depth, age=arguments.age, interval=arguments.interval,
+                        engine=mc_aixi_ctw.ctw_engines[arguments.engine])
+    elif arguments.benchmark == "sampling":
+        sampling_rate(depth=arguments.depth, age=arguments.age, percept_bits=arguments.percept_bits,
+                      engine=mc_aixi_ctw.ctw_engines[arguments.engine])
+    elif arguments.benchmark == "factored":
+        factored_model(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                       engine=mc_aixi_ctw.ctw_engines[arguments.engine])
+    elif arguments.benchmark == "compact":
+        compact_storage(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                        simulations=arguments.simulations, engines=arguments.engines)
+    elif arguments.benchmark == "frozen":
+        frozen_search(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                      simulations=arguments.simulations, searches=arguments.searches, engine=arguments.engine)
+    elif arguments.benchmark == "mapped":
+        mapped_growth(depth=arguments.depth, age=arguments.age, interval=arguments.interval, path=arguments.path)
+    elif arguments.benchmark == "parallel":
+        root_parallel_search(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                             simulations=arguments.simulations, searches=arguments.searches, workers=arguments.workers)
+    elif arguments.benchmark == "reuse":
+        search_tree_reuse(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                          simulations=arguments.simulations, seeds=arguments.seeds, discount=arguments.discount)
+    elif arguments.benchmark == "store":
+        search_store(depth=arguments.depth, cycles=arguments.cycles, environment=arguments.environment,
+                     simulations=arguments.simulations, searches=arguments.searches, stores=arguments.stores)
+    elif arguments.benchmark == "serialize":
+        serialized_model(depth=arguments.depth, age=arguments.age, engine=arguments.engine, path=arguments.path)
+    else:
+        parser.print_help()
+    # end if
+
+# end def
+
+
+# Start the main function if this file has been executed, and not just imported.
+if __name__ == "__main__":
+    main()
+# end def
@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a context tree that keeps its nodes in a compact, low precision pool of typed arrays.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+from array import array
+
+import ctw_context_tree
+import ctw_node_pool
+from ctw_node_pool import no_node
+from ctw_numeric import log_add, log_half, log_kt_estimate, log_kt_multiplier
+
+
+class CompactCTWContextTree(ctw_node_pool.PooledCTWContextTree):
+    """ A context tree that stores its nodes in a pool of parallel typed arrays, as
+        `PooledCTWContextTree` does, but in a fraction of the memory.
+
+        Node `i` of the tree is described by the `i`-th entry of each of the arrays:
+
+         - `count0`, `count1`: the number of zeros and ones seen in the node's context, as unsigned
+                               integers of `count_typecode`.
+         - `log_ratio`: the log of the ratio of the node's KT estimate to the product of its children's
+                        weighted probabilities, as a single precision float.
+         - `child0`, `child1`: the indices of the node's children, or `no_node`, as 32-bit integers.
+
+        The weighted log probabilities of the nodes grow without bound as the history grows, and
+        would soon lose all of their precision in single precision floats. The ratio `b` of a node's
+        two estimates, though, is all that is needed to mix the conditional probabilities of the
+        next symbol along the context path, from the leaf up:
+
+          Pr_w(x | h) = (b Pr_kt(x | h) + Pr_children(x | h)) / (b + 1),  b = Pr_kt(h) / Pr_children(h)
+
+        So only the ratios are kept, along with the weighted log probability of the root, in
+        `root_log_probability`. The KT estimates are recomputed from the counts when needed, and
+        the ratios of leaves are not used.
+
+        Once the root has seen `count_limit` of either symbol, `enforce_node_budget` halves every
+        count in the tree, so that the counts never overflow and old statistics slowly decay. As
+        halved counts can not be reverted, they are only halved outside simulations.
+
+        The tree offers the same interface as `CTWContextTree`, but `node_state` only knows the
+        weighted log probability of the root exactly. The ratios are only reverted exactly from the undo
+        journal: without it, each simulated update and revert may move them by a rounding error.
+    """
+
+    # The array type codes used for the symbol counts, log ratios and child indices.
+    count_typecode = 'I'
+    probability_typecode = 'f'
+    index_typecode = 'i'
+
+    # Instance methods.
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # The count at which every count of the tree is halved, leaving room for a full history window
+        # of simulated symbols to be added before the counts could overflow.
+        self.count_limit = (1 << (8 * array(self.count_typecode).itemsize)) - 1 - self.history_window
+        assert self.count_limit > 1, "The history window is too large for the symbol counts."
+
+        # Empty the node pool, and allocate a new root node.
+        self.count0 = array(self.count_typecode)
+        self.count1 = array(self.count_typecode)
+        self.log_ratio = array(self.probability_typecode)
+        self.child0 = array(self.index_typecode)
+        self.child1 = array(self.index_typecode)
+        self.free_list = no_node
+
+        # The nodes that children have been evicted from, which are never leaves again.
+        # (See `CTWContextTree.collapse_node`.)
+        self.evicted = set()
+
+        self.root = self.allocate_node()
+        self.root_log_probability = 0.0
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # Reset the context.
+        self.context = []
+
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def allocate_node(self):
+        """ Returns the index of a fresh node, taken from the free list if possible.
+        """
+
+        node = self.free_list
+
+        if node == no_node:
+            # Grow each of the arrays by one entry.
+            node = len(self.count0)
+            self.count0.append(0)
+            self.count1.append(0)
+            self.log_ratio.append(0.0)
+            self.child0.append(no_node)
+            self.child1.append(no_node)
+        else:
+            # Reuse a released node.
+            self.free_list = self.child0[node]
+            self.count0[node] = 0
+            self.count1[node] = 0
+            self.log_ratio[node] = 0.0
+            self.child0[node] = no_node
+            self.child1[node] = no_node
+        # end if
+
+        return node
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns the number of bytes each node takes in the arrays of the pool.
+        """
+
+        return sum([column.itemsize for column in (self.count0, self.count1, self.log_ratio, self.child0, self.child1)])
+
+    # end def
+
+    def delete_children(self, node, descendants):
+        """ Removes the children of the given node from the tree, returning its descendants to the free list.
+            The node's ratio still accounts for the evicted children, so the node is marked as no
+            longer being a leaf. (See `CTWContextTree.delete_children`.)
+        """
+
+        self.evicted.add(node)
+        self.child0[node] = self.child1[node] = no_node
+
+        for descendant in descendants:
+            self.child0[descendant] = self.free_list
+            self.child1[descendant] = no_node
+            self.free_list = descendant
+
+            self.evicted.discard(descendant)
+        # end for
+
+    # end def
+
+    def enforce_node_budget(self):
+        """ Halves every count in the tree if the root has seen `count_limit` of either symbol, then
+            evicts nodes if the tree has grown beyond its node budget.
+            (See `CTWContextTree.enforce_node_budget`.)
+        """
+
+        if max(self.count0[self.root], self.count1[self.root]) >= self.count_limit:
+            self.halve_counts()
+
+        return ctw_node_pool.PooledCTWContextTree.enforce_node_budget(self)
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to
+            the context tree statistics and update the context tree with the newly
+            generated symbols. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        count0, log_ratio = self.count0, self.log_ratio
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Find (or create) the nodes of the current context.
+            tree_size = self.tree_size
+            self.update_context()
+
+            # From the leaf to the root, compute the conditional probability of a zero at each node,
+            # and the ratio each node would have after seeing it.
+            zero_updates = self.mix_context(self.context, self.history.recent(self.depth), 0)
+            log_probability = zero_updates[-1][1]
+
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(log_probability)
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            # Commit the chosen symbol to the context nodes.
+            if symbol == 0:
+                for node, log_probability, ratio in zero_updates:
+                    count0[node] += 1
+                    log_ratio[node] = ratio
+                # end for
+
+                self.root_log_probability += log_probability
+            else:
+                self.update_context_nodes(symbol)
+            # end if
+
+            symbol_list.append(symbol)
+            self.history.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def halve_counts(self):
+        """ Halves the symbol counts of every node, rounding up so that every symbol a node has seen
+            is still counted at least once.
+        """
+
+        self.count0 = array(self.count_typecode, [(count + 1) >> 1 for count in self.count0])
+        self.count1 = array(self.count_typecode, [(count + 1) >> 1 for count in self.count1])
+
+    # end def
+
+    def journal_record(self, symbol, created):
+        """ Returns an undo journal record of the current context, before it is updated with the given symbol.
+            (See `CTWContextTree.journal_record`.)
+        """
+
+        log_ratio = self.log_ratio
+
+        return symbol, self.context, (self.root_log_probability, [log_ratio[node] for node in self.context]), created
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, computing the log ratio of
+            each node from its log KT estimate and the weighted log probabilities of its children.
+            A tree whose counts were halved is loaded as the tree its halved counts describe.
+            (See `CTWContextTree.load_nodes`.)
+        """
+
+        count0, count1, log_kt, log_probability, child0, child1 = columns
+
+        assert max(count0[0], count1[0]) <= self.count_limit, "The saved symbol counts are too large for the tree."
+
+        # The ratios of leaves are not used.
+        log_ratio = array(self.probability_typecode, [0.0]) * len(count0)
+
+        for node in range(len(count0)):
+            zero, one = child0[node], child1[node]
+            evicted = evicted_log_probability.get(node)
+
+            if zero == no_node and one == no_node and evicted is None:
+                continue
+
+            # Sum the children first, then the evicted children, as `ctw_serialization.read_nodes` does.
+            child_sum = (0.0 if zero == no_node else log_probability[zero]) + \
+                        (0.0 if one == no_node else log_probability[one])
+            if evicted is not None:
+                child_sum += evicted
+
+            log_ratio[node] = log_kt[node] - child_sum
+        # end for
+
+        self.count0 = array(self.count_typecode, count0)
+        self.count1 = array(self.count_typecode, count1)
+        self.log_ratio = log_ratio
+        self.child0 = array(self.index_typecode, child0)
+        self.child1 = array(self.index_typecode, child1)
+        self.free_list = no_node
+        self.evicted = set(evicted_log_probability)
+
+        self.root = 0
+        self.root_log_probability = log_probability[0]
+        self.tree_size = len(count0)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def log_history_probability(self):
+        """ Returns the log of the weighted probability `rho(h)` that the tree assigns to its history.
+        """
+
+        return self.root_log_probability
+
+    # end def
+
+    def log_predict(self, symbol_list):
+        """ Returns the log of `rho(symbol_list | h)`, by temporarily adding the symbols to the tree, and
+            reverting them from the undo journal. The tree is left unchanged.
+            (See `CTWContextTree.log_predict`.)
+        """
+
+        if len(symbol_list) == 1:
+            return self.log_predict_symbol(symbol_list[0])
+
+        journal = self.journal
+        self.begin_journal()
+
+        root_log_probability = self.root_log_probability
+
+        self.update(symbol_list)
+        log_probability = self.root_log_probability - root_log_probability
+        self.revert(len(symbol_list))
+
+        if journal is None:
+            self.end_journal()
+
+        return log_probability
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing context path
+            once without changing or allocating any node. (See `CTWContextTree.log_predict_symbol`.)
+        """
+
+        child0, child1 = self.child0, self.child1
+
+        # Collect the existing nodes on the context path.
+        context = self.history.recent(self.depth)
+        path = [self.root]
+        node = self.root
+
+        for context_symbol in context:
+            node = (child1 if context_symbol else child0)[node]
+            if node == no_node:
+                break
+            path.append(node)
+        # end for
+
+        # A missing child, and every node below it, is a fresh node, whose conditional probability
+        # of its first symbol is one half.
+        if len(path) <= len(context):
+            return self.mix_context(path, context, symbol, log_half)[-1][1]
+
+        return self.mix_context(path, context, symbol)[-1][1]
+
+    # end def
+
+    def mix_context(self, path, context, symbol, fresh_log_probability=None):
+        """ Returns a list of the nodes of the given context path, from the leaf to the root, each with the
+            log of its conditional probability of the given symbol and the log ratio it would have after
+            seeing the symbol, as (node, log probability, log ratio) tuples. No node is changed.
+            - `path`: the nodes of the context path, from the root down.
+            - `context`: the context symbols leading from each node of the path to the next.
+            - `symbol`: the symbol to compute the conditional probabilities of.
+            - `fresh_log_probability`: the log conditional probability of a child missing from the
+                                       end of the path, if there is one.
+        """
+
+        count0, count1, log_ratio = self.count0, self.count1, self.log_ratio
+        child0, child1 = self.child0, self.child1
+        evicted = self.evicted
+
+        updates = []
+        child_log_probability = fresh_log_probability
+        child_created = fresh_log_probability is not None
+
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            zeros, ones = count0[node], count1[node]
+            kt_log_probability = log_kt_multiplier(ones if symbol else zeros, zeros + ones)
+            ratio = log_ratio[node]
+
+            if child_log_probability is None:
+                # The last node of the path, whose children (if any) do not see the symbol.
+                if child0[node] == no_node and child1[node] == no_node and node not in evicted:
+                    log_probability = kt_log_probability
+                else:
+                    log_probability = log_add(ratio + kt_log_probability, 0.0) - log_add(ratio, 0.0)
+                    ratio += kt_log_probability
+                # end if
+            elif child_created and (child0 if context[depth] else child1)[node] == no_node and node not in evicted:
+                # The node is gaining its first child: until now it was a leaf, whose weighted
+                # probability was its KT estimate.
+                log_kt = log_kt_estimate(zeros, ones)
+                log_probability = log_half + log_add(log_kt + kt_log_probability, child_log_probability) - log_kt
+                ratio = log_kt + kt_log_probability - child_log_probability
+            else:
+                log_probability = log_add(ratio + kt_log_probability, child_log_probability) - log_add(ratio, 0.0)
+                ratio += kt_log_probability - child_log_probability
+            # end if
+
+            updates.append((node, log_probability, ratio))
+
+            child_log_probability = log_probability
+            child_created = zeros + ones == 0
+        # end for
+
+        return updates
+
+    # end def
+
+    def node_log_probability(self, node, log_kt=None):
+        """ Returns the weighted log probability of the given node, computed from its KT estimate
+            (or the given `log_kt`) and its log ratio. (See `PooledCTWContextTree.node_log_probability`.)
+        """
+
+        kt = log_kt_estimate(self.count0[node], self.count1[node]) if log_kt is None else log_kt
+
+        if self.child0[node] == no_node and self.child1[node] == no_node and node not in self.evicted:
+            return kt
+
+        # The weighted probability is the mean of the KT estimate and the children's probability,
+        # which is the KT estimate divided by the ratio.
+        return log_half + log_add(kt, kt - self.log_ratio[node])
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability of the given node. Only the weighted log probability of the
+            root is kept: those of the other nodes, and the evicted log probability, which is folded
+            into the log ratio of the node, are recovered from the log ratios, in single precision.
+        """
+
+        zeros, ones = self.count0[node], self.count1[node]
+        log_kt = log_kt_estimate(zeros, ones)
+
+        if node == self.root:
+            log_probability = self.root_log_probability
+        else:
+            log_probability = self.node_log_probability(node, log_kt)
+        # end if
+
+        evicted_log_probability = None
+
+        if node in self.evicted:
+            evicted_log_probability = log_kt - self.log_ratio[node] - \
+                sum([self.node_log_probability(child) for symbol, child in self.node_children(node)])
+        # end if
+
+        return [zeros, ones, log_kt, log_probability, evicted_log_probability]
+
+    # end def
+
+    def predict_distribution(self, symbol_lists):
+        """ Returns a list of the conditional probabilities `rho(y | h)` of each of the given symbol lists,
+            reverting the prefixes the lists share from the undo journal.
+            (See `CTWContextTree.predict_distribution`.)
+        """
+
+        journal = self.journal
+        self.begin_journal()
+
+        probabilities = ctw_node_pool.PooledCTWContextTree.predict_distribution(self, symbol_lists)
+
+        if journal is None:
+            self.end_journal()
+
+        return probabilities
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the context tree to its state prior to a specified number of updates.
+
+            - `symbol_count`: the number of updates (symbols) to revert. (Default of 1.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        count0, count1, log_ratio = self.count0, self.count1, self.log_ratio
+        child0, child1 = self.child0, self.child1
+        evicted = self.evicted
+
+        for i in range(symbol_count):
+            if self.journal:
+                self.undo_journal_record()
+                continue
+            # end if
+
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
+
+            self.update_context()
+            context = self.context
+            context_symbols = self.history.recent(self.depth)
+
+            counts = count1 if symbol else count0
+            child_log_probability = None
+            child_created = False
+
+            for depth in range(len(context) - 1, -1, -1):
+                node = context[depth]
+
+                assert counts[node] > 0, "Symbol count should be non-negative"
+                counts[node] -= 1
+
+                zeros, ones = count0[node], count1[node]
+                kt_log_probability = log_kt_multiplier(ones if symbol else zeros, zeros + ones)
+
+                # Release the child on the path if it is no longer visited. Nodes are reverted from the
+                # leaf up, so it has already released its own children, and is a leaf.
+                if child_created:
+                    children = child1 if context_symbols[depth] else child0
+                    self.tree_size -= self.release_node(children[node])
+                    self.depth_sizes[depth + 1] -= 1
+                    children[node] = no_node
+                # end if
+
+                # Undo the mixing of `mix_context`, from the restored counts and children.
+                if child_log_probability is None:
+                    if child0[node] == no_node and child1[node] == no_node and node not in evicted:
+                        log_probability = kt_log_probability
+                    else:
+                        ratio = log_ratio[node] - kt_log_probability
+                        log_ratio[node] = ratio
+                        log_probability = log_add(ratio + kt_log_probability, 0.0) - log_add(ratio, 0.0)
+                    # end if
+                elif child_created and child0[node] == no_node and child1[node] == no_node and node not in evicted:
+                    log_kt = log_kt_estimate(zeros, ones)
+                    log_probability = log_half + log_add(log_kt + kt_log_probability, child_log_probability) - log_kt
+                    log_ratio[node] = 0.0
+                else:
+                    ratio = log_ratio[node] - kt_log_probability + child_log_probability
+                    log_ratio[node] = ratio
+                    log_probability = log_add(ratio + kt_log_probability, child_log_probability) - log_add(ratio, 0.0)
+                # end if
+
+                child_log_probability = log_probability
+                child_created = zeros + ones == 0
+            # end for
+
+            self.root_log_probability -= child_log_probability
+        # end for
+
+    # end def
+
+    def undo_journal_record(self):
+        """ Restores the context tree to its state prior to the last update recorded in the journal.
+            (See `CTWContextTree.undo_journal_record`.)
+        """
+
+        symbol, context, values, created = self.journal.pop()
+
+        self.history.pop()
+
+        # Nothing but the history changed for symbols added by `update_history`.
+        if not context:
+            return
+
+        self.root_log_probability, ratios = values
+
+        counts = self.count1 if symbol else self.count0
+        log_ratio = self.log_ratio
+
+        for node, ratio in zip(context, ratios):
+            counts[node] -= 1
+            log_ratio[node] = ratio
+        # end for
+
+        if created:
+            self.release_created_nodes(context, created)
+
+    # end def
+
+    def update_context_nodes(self, symbol):
+        """ Updates the nodes of the current context (see `update_context`) after having observed
+            a new symbol, from the leaf to the root.
+        """
+
+        counts = self.count1 if symbol else self.count0
+        log_ratio = self.log_ratio
+
+        updates = self.mix_context(self.context, self.history.recent(self.depth), symbol)
+
+        for node, log_probability, ratio in updates:
+            counts[node] += 1
+            log_ratio[node] = ratio
+        # end for
+
+        self.root_log_probability += updates[-1][1]
+
+    # end def
+# end class
+
+
+class Compact16CTWContextTree(CompactCTWContextTree):
+    """ A `CompactCTWContextTree` with 16-bit symbol counts, which are halved more often.
+    """
+
+    count_typecode = 'H'
+
+# end class
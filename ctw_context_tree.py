@@ -8,19 +8,168 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import copy
 import math
 import random
+import sys
 
 # Ensure xrange is defined on Python 3.
 from six.moves import xrange
 
-# The value ln(0.5).
-# This value is used often in computations and so is made a constant for efficiency reasons.
-log_half = math.log(0.5)
+from ctw_numeric import log_half, log_kt_estimate, log_kt_multiplier, weighted_log_probability
+
+
+# The default number of symbols, beyond the tree depth, that a context tree keeps in its history
+# so that they can be reverted.
+default_history_window = 1024
+
+# The fraction of its node budget that a context tree frees whenever it outgrows the budget,
+# so that the cost of finding nodes to evict is shared between many updates.
+eviction_headroom = 0.1
+
+
+class CTWHistory:
+    """ A bounded circular buffer holding the most recent symbols seen by a context tree.
+
+        Only the last `capacity` symbols are retained, which must cover the depth of the tree
+        plus the largest number of symbols that will ever be reverted at once.
+        Symbols are indexed from the most recent one, so `history[0]` is the last symbol added,
+        while `len(history)` is the number of symbols added over the lifetime of the history.
+
+        Appending and popping a symbol both take constant time, however long the history is.
+        When `log` is set, every symbol is also kept in an append-only list, `log`, in the
+        order it was seen.
+
+        Symbols that were only added to the history, as context for later symbols, rather than
+        also being modelled by the tree (see `CTWContextTree.update_history`), are flagged so
+        that reverting them leaves the nodes of the tree untouched.
+    """
+
+    def __init__(self, capacity, log=False):
+        """ Create an empty history retaining at most `capacity` symbols.
+        """
+
+        assert capacity > 0, "The history capacity must be greater than zero."
+        self.capacity = capacity
+
+        # Each symbol is stored twice, `capacity` bytes apart, so that the most recent symbols
+        # can always be read as one contiguous slice starting at `head`.
+        self.buffer = bytearray(2 * capacity)
+        self.head = 0
+
+        # Whether the symbol at each position of the buffer was only added as context.
+        self.context_only = bytearray(capacity)
+
+        # The number of symbols currently held in the buffer.
+        self.retained = 0
+
+        # The number of symbols in the history, including those no longer retained.
+        self.size = 0
+
+        # The optional log of every symbol in the history, oldest first.
+        self.log = [] if log else None
+
+    # end def
+
+    def __getitem__(self, index):
+        """ Returns the symbol added `index` symbols before the most recent one.
+        """
+
+        assert 0 <= index < self.retained, "The requested symbol is not retained by the history."
+
+        return self.buffer[self.head + index]
+
+    # end def
+
+    def __len__(self):
+        """ Returns the number of symbols in the history.
+        """
+
+        return self.size
+
+    # end def
+
+    def append(self, symbol, context_only=False):
+        """ Adds a symbol to the history, discarding the oldest retained symbol if the buffer is full.
+            - `symbol`: the symbol to add.
+            - `context_only`: whether the symbol is only context, and is not modelled by the tree.
+        """
+
+        head = (self.head - 1) % self.capacity
+        self.buffer[head] = self.buffer[head + self.capacity] = symbol
+        self.context_only[head] = context_only
+        self.head = head
+
+        if self.retained < self.capacity:
+            self.retained += 1
+
+        self.size += 1
+
+        if self.log is not None:
+            self.log.append(symbol)
+
+    # end def
+
+    def copy(self):
+        """ Returns a copy of the history, retaining the same symbols, which can be extended and reverted
+            independently of this one. The copy does not keep a log of its symbols.
+        """
+
+        history = CTWHistory(self.capacity)
+        history.buffer[:] = self.buffer
+        history.context_only[:] = self.context_only
+        history.head = self.head
+        history.retained = self.retained
+        history.size = self.size
+
+        return history
+
+    # end def
+
+    def is_context_only(self):
+        """ Returns whether the most recent symbol was only added to the history as context.
+        """
+
+        assert self.retained > 0, "The history does not retain enough symbols to revert further."
+
+        return self.context_only[self.head]
+
+    # end def
+
+    def pop(self):
+        """ Removes the most recent symbol from the history and returns it.
+        """
+
+        assert self.retained > 0, "The history does not retain enough symbols to revert further."
+
+        symbol = self.buffer[self.head]
+        self.head = (self.head + 1) % self.capacity
+        self.retained -= 1
+        self.size -= 1
+
+        if self.log is not None:
+            self.log.pop()
+
+        return symbol
+
+    # end def
+
+    def recent(self, count):
+        """ Returns (at most) the last `count` symbols, most recent first.
+        """
+
+        return self.buffer[self.head:self.head + min(count, self.retained)]
+
+    # end def
+# end class
 
 
 class CTWContextTreeNode:
 
+    # The sum of the weighted log probabilities that the children evicted from a node assigned to the
+    # symbols seen before they were evicted, or None if no children have been evicted from the node.
+    evicted_log_probability = None
+
     def __init__(self, tree=None):
         """ Construct a node of the context tree.
         """
@@ -45,6 +194,23 @@ class CTWContextTreeNode:
 
     # end def
 
+    def child_log_probability_sum(self):
+        """ Returns the sum of the weighted log probabilities of the children of this node, including
+            those evicted from it, or None if the node is a leaf.
+        """
+
+        if not self.children:
+            return self.evicted_log_probability
+
+        child_sum = sum([child.log_probability for child in self.children.values()])
+
+        if self.evicted_log_probability is not None:
+            child_sum += self.evicted_log_probability
+
+        return child_sum
+
+    # end def
+
     def is_leaf_node(self):
         """ Return True if the node is a leaf node, False otherwise.
         """
@@ -67,7 +233,7 @@ class CTWContextTreeNode:
              1 corresponds to calculating `log(Pr_kt(1 | 0^a 1^b)`.
         """
 
-        return math.log((self.symbol_count[symbol] + 0.5) / (self.visits() + 1))
+        return log_kt_multiplier(self.symbol_count[symbol], self.visits())
 
     # end def
 
@@ -75,20 +241,25 @@ class CTWContextTreeNode:
         """ Reverts the node to its state immediately prior to the last update.
             This involves updating the symbol counts, recalculating the cached
             probabilities, and deleting unnecessary child nodes.
+            Returns the number of child nodes deleted.
             - `symbol`: the symbol used in the previous update.
         """
-        self.symbol_count[symbol] -= 1
+        counts = self.symbol_count
+        counts[symbol] -= 1
 
-        assert self.symbol_count[symbol] >= 0, "Symbol count should be non-negative"
+        assert counts[symbol] >= 0, "Symbol count should be non-negative"
+
+        # The log KT estimate is recomputed from the counts, so reverting never accumulates rounding error.
+        self.log_kt = log_kt_estimate(counts[0], counts[1])
 
-        self.log_kt -= self.log_kt_multiplier(symbol)
-        
         del_list = []
 
-        #Update ctw tree size if new node is added
+        # Find the children that are no longer visited.
+        # Nodes are reverted from the leaf up, so an unvisited child has already deleted its
+        # own (unvisited) children, and is a leaf.
         for child in self.children.keys():
             if self.children[child].visits() == 0:
-                self.tree.tree_size -= self.children[child].size()
+                assert self.children[child].is_leaf_node(), "An unvisited child should be a leaf node"
                 del_list.append(child)
 
         #Delete empty child
@@ -96,6 +267,8 @@ class CTWContextTreeNode:
             del self.children[child]
 
         self.update_log_probability()
+
+        return len(del_list)
     # end def
 
     def size(self):
@@ -112,22 +285,19 @@ class CTWContextTreeNode:
             This involves updating the symbol counts and recalculating the cached probabilities.
             - `symbol`: the symbol that was observed.
         """
-        self.log_kt += self.log_kt_multiplier(symbol)
+        counts = self.symbol_count
+        counts[symbol] += 1
+
+        self.log_kt = log_kt_estimate(counts[0], counts[1])
         self.update_log_probability()
-        self.symbol_count[symbol] += 1
     # end def
 
     def update_log_probability(self):
 
-        if not self.children:
+        if not self.children and self.evicted_log_probability is None:
             self.log_probability = self.log_kt
         else:
-            child_sum = sum([child.log_probability for child in self.children.values()])
-            
-            if child_sum <= self.log_kt:
-                self.log_probability = log_half + self.log_kt + math.log(1 + math.exp(child_sum - self.log_kt))
-            else:
-                self.log_probability = log_half + child_sum + math.log(1 + math.exp(self.log_kt - child_sum))
+            self.log_probability = weighted_log_probability(self.log_kt, self.child_log_probability_sum())
 
     # end def
 
@@ -155,31 +325,51 @@ class CTWContextTreeNode:
 
 class CTWContextTree:
 
-    def __init__(self, depth):
+    # Class attributes.
+
+    # Whether the tree keeps the symbol counts and probabilities of its nodes, and so offers
+    # `node_state` and `log_history_probability`. A tree that does not (such as a frozen tree)
+    # only offers its predictions, and is saved and loaded in a format of its own.
+    supports_node_state = True
+
+    # Instance methods.
+
+    def __init__(self, depth, history_window=None, history_log=False, max_nodes=None):
         """ Create a context tree of specified maximum depth.
             Nodes are created as needed.
             - `depth`: the maximum depth of the context tree.
+            - `history_window`: the largest number of symbols that may be reverted at once.
+                                (Defaults to `default_history_window`.)
+            - `history_log`: whether to keep a log of every symbol seen in `history.log`.
+            - `max_nodes`: the number of nodes beyond which `enforce_node_budget` evicts nodes.
+                           (Defaults to None, for no limit.)
         """
 
-        # An list used to hold the nodes in the context tree that correspond to the current context.
-        # It is important to ensure that `update_context()` is called before accessing the contents
-        # of this list as they may otherwise be inaccurate.
-        self.context = []
-
         # The maximum depth of the context tree.
         assert depth >= 0, "The given tree depth must be greater than zero."
         self.depth = depth
 
-        # The history (a list) of symbols seen by the tree.
-        self.history = []
+        # The number of symbols, beyond the depth, that the history retains for reverting.
+        self.history_window = default_history_window if history_window is None else history_window
 
-        # The root node of the context tree.
-        self.root = CTWContextTreeNode(tree=self)
+        # Whether the history also logs every symbol seen.
+        self.history_log = history_log
 
-        # The size of this tree.
-        self.tree_size = 1
+        # The node budget of the tree, if any.
+        assert max_nodes is None or max_nodes > 0, "The node budget must be greater than zero."
+        self.max_nodes = max_nodes
+
+        # The number of times nodes have been evicted from the tree, and the number of subtrees
+        # and nodes evicted, over the lifetime of the tree.
+        self.evictions = 0
+        self.evicted_subtrees = 0
+        self.evicted_nodes = 0
+
+        # The root node of the context tree.
+        self.root = None
 
-        self.history_size = 0
+        # Set up the (empty) history, context and nodes of the tree.
+        self.clear()
 
     # end def
 
@@ -188,23 +378,286 @@ class CTWContextTree:
         """
 
         # Reset the history.
-        self.history = []
+        # The history of symbols seen by the tree, retaining those needed for its context.
+        self.history = CTWHistory(self.depth + self.history_window, log=self.history_log)
 
         # Set a new root object, and reset the tree size.
-        self.root.tree = None
-        del self.root
+        if self.root is not None:
+            self.root.tree = None
         self.root = CTWContextTreeNode(tree=self)
         self.tree_size = 1
 
+        # The number of nodes at each depth of the tree, from the root (depth 0) down.
+        self.depth_sizes = [1] + [0] * self.depth
+
         # Reset the context.
+        # An list used to hold the nodes in the context tree that correspond to the current context.
+        # It is important to ensure that `update_context()` is called before accessing the contents
+        # of this list as they may otherwise be inaccurate.
         self.context = []
 
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns an estimate of the number of bytes each node of the tree takes, from the size of
+            the root node object and of the objects it holds.
+        """
+
+        fields = [value for name, value in vars(self.root).items() if name != 'tree']
+
+        return sys.getsizeof(self.root) + sys.getsizeof(vars(self.root)) + sum([sys.getsizeof(value) for value in fields])
+
+    # end def
+
+    def begin_journal(self):
+        """ Starts (or continues) recording an undo journal of every update to the tree.
+
+            While the journal is active, each update records the prior log KT estimate and
+            weighted log probability of every node it changes, and how many nodes it created.
+            `revert` then restores those values exactly, rather than recomputing them.
+
+            Returns the number of updates already in the journal.
+        """
+
+        if self.journal is None:
+            self.journal = []
+
+        return len(self.journal)
+
+    # end def
+
+    def end_journal(self):
+        """ Stops recording the undo journal, and discards it.
+        """
+
+        self.journal = None
+
+    # end def
+
+    def journal_record(self, symbol, created):
+        """ Returns an undo journal record of the current context, before it is updated with the given symbol.
+            - `symbol`: the symbol the context is being updated with.
+            - `created`: the number of nodes that were created for the context, which are always the
+                         deepest nodes of the context.
+        """
+
+        return symbol, self.context, [(node.log_kt, node.log_probability) for node in self.context], created
+
+    # end def
+
+    def undo_journal_record(self):
+        """ Restores the context tree to its state prior to the last update recorded in the journal.
+        """
+
+        symbol, context, values, created = self.journal.pop()
+
+        self.history.pop()
+
+        for node, (log_kt, log_probability) in zip(context, values):
+            node.symbol_count[symbol] -= 1
+            node.log_kt = log_kt
+            node.log_probability = log_probability
+        # end for
+
+        if created:
+            # Remove the (now unvisited) nodes that were created by the update.
+            parent, child = context[-created - 1], context[-created]
+            for child_symbol in list(parent.children.keys()):
+                if parent.children[child_symbol] is child:
+                    del parent.children[child_symbol]
+
+            self.tree_size -= created
+            for depth in range(len(context) - created, len(context)):
+                self.depth_sizes[depth] -= 1
+        # end if
+
+    # end def
+
+    def collapse_node(self, node, depth):
+        """ Deletes every descendant of the given node.
+
+            The weighted probability that the children of the node assigned to the symbols seen so far
+            is kept by the node, as its evicted log probability, and stands in for them as a child
+            that predicts nothing more. New children then model only the symbols seen after the
+            eviction, so that the weighted probabilities of the node, and of its ancestors, are
+            unchanged and remain consistent, sequential estimates.
+
+            Returns the number of nodes deleted.
+            - `node`: the node to collapse.
+            - `depth`: the depth of the node in the tree.
+        """
+
+        descendants = []
+        stack = [(child, depth + 1) for symbol, child in self.node_children(node)]
+
+        while stack:
+            descendant, descendant_depth = stack.pop()
+            descendants.append(descendant)
+            self.depth_sizes[descendant_depth] -= 1
+
+            stack.extend([(child, descendant_depth + 1) for symbol, child in self.node_children(descendant)])
+        # end while
+
+        self.delete_children(node, descendants)
+        self.tree_size -= len(descendants)
+
+        return len(descendants)
+
     # end def
 
-    def generate_random_symbols(self, symbol_count):
+    def delete_children(self, node, descendants):
+        """ Removes the children of the given node from the tree, adding their weighted log
+            probabilities to the node's evicted log probability.
+            - `node`: the node to remove the children of.
+            - `descendants`: every descendant of the node.
+        """
+
+        node.evicted_log_probability = node.child_log_probability_sum()
+        node.children = {}
+
+    # end def
+
+    def enforce_node_budget(self):
+        """ Evicts nodes from the tree if it has grown beyond its node budget, `max_nodes`, freeing
+            a further `eviction_headroom` of the budget so that evictions are infrequent.
+
+            Evicted nodes can not be reverted, so the tree must not be part way through updates
+            that will later be reverted, such as those of a simulation.
+
+            Returns the number of nodes evicted.
+        """
+
+        if self.max_nodes is None or self.tree_size <= self.max_nodes:
+            return 0
+
+        return self.evict(int(self.max_nodes * (1 - eviction_headroom)))
+
+    # end def
+
+    def evict(self, node_count):
+        """ Collapses the subtrees of the least visited nodes, until the tree has at most `node_count`
+            nodes (or only the root is left). (See `collapse_node`.)
+
+            Among nodes with the same number of visits, the deepest are collapsed first. Every
+            node is visited more often than its descendants, so each subtree is collapsed before
+            any subtree containing it.
+
+            Returns the number of nodes evicted.
+            - `node_count`: the number of nodes to reduce the tree to.
+        """
+
+        assert not self.journal, "Nodes can not be evicted while journaled updates may still be reverted."
+
+        if self.tree_size <= node_count:
+            return 0
+
+        # Find every internal node of the tree, and its depth.
+        candidates = []
+        stack = [(self.root, 0)]
+
+        while stack:
+            node, depth = stack.pop()
+            # (Children are visited in symbol order, so that every engine evicts the same nodes.)
+            children = sorted(self.node_children(node))
+
+            if children:
+                counts = self.node_state(node)
+                candidates.append((counts[0] + counts[1], -depth, len(candidates), node))
+
+                stack.extend([(child, depth + 1) for symbol, child in children])
+            # end if
+        # end while
+
+        candidates.sort()
+
+        # Collapse the least visited subtrees.
+        tree_size = self.tree_size
+        collapsed = 0
+
+        for visits, negative_depth, index, node in candidates:
+            if self.tree_size <= node_count:
+                break
+
+            if self.node_children(node):
+                self.collapse_node(node, -negative_depth)
+                collapsed += 1
+            # end if
+        # end for
+
+        evicted = tree_size - self.tree_size
+
+        self.evictions += 1
+        self.evicted_subtrees += collapsed
+        self.evicted_nodes += evicted
+
+        return evicted
+
+    # end def
+
+    def generate_cached_symbols(self, symbol_count, probability_cache, update=True):
+        """ Returns a specified number of random symbols distributed according to the context tree
+            statistics, sampled from a cache of those statistics where possible, and (optionally)
+            update the context tree with the newly generated symbols.
+            - `symbol_count`: the number of symbols to generate.
+            - `probability_cache`: a dictionary caching the probability of a zero after each prefix
+                                   of the generated symbols, keyed by the prefix as an integer with
+                                   a leading one bit. Cached probabilities are sampled from without
+                                   touching the tree, and missing ones are computed and added to the
+                                   cache. The cache is only valid for as long as the tree is in the
+                                   state it was in when the cache was filled.
+            - `update`: whether to update the context tree with the generated symbols.
+        """
+
+        symbol_list = []
+        prefix = 1
+
+        for i in range(symbol_count):
+            threshold = probability_cache.get(prefix)
+
+            if threshold is None:
+                # Sample the remaining symbols from the tree (after the sampled prefix), and cache
+                # the probabilities they were sampled with.
+                thresholds = []
+                self.update(symbol_list)
+                remaining_symbols = self.generate_random_symbols_and_update(symbol_count - i, thresholds)
+
+                for symbol, threshold in zip(remaining_symbols, thresholds):
+                    probability_cache[prefix] = threshold
+                    prefix = 2 * prefix + symbol
+                # end for
+
+                if not update:
+                    self.revert(symbol_count)
+
+                return symbol_list + remaining_symbols
+            # end if
+
+            symbol = 0 if random.random() < threshold else 1
+
+            symbol_list.append(symbol)
+            prefix = 2 * prefix + symbol
+        # end for
+
+        if update:
+            self.update(symbol_list)
+
+        return symbol_list
+
+    # end def
+
+    def generate_random_symbols(self, symbol_count, probability_cache=None):
         """ Returns a symbol string of a specified length by sampling from the context tree.
             - `symbol_count`: the number of symbols to generate.
+            - `probability_cache`: an optional cache of the tree's statistics to sample from.
+                                   (See `generate_cached_symbols`.)
         """
+
+        if probability_cache is not None:
+            return self.generate_cached_symbols(symbol_count, probability_cache, update=False)
+
         symbol_list = self.generate_random_symbols_and_update(symbol_count)
 
         self.revert(symbol_count)
@@ -213,24 +666,81 @@ class CTWContextTree:
 
     # end def
 
-    def generate_random_symbols_and_update(self, symbol_count):
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
         """ Returns a specified number of random symbols distributed according to
             the context tree statistics and update the context tree with the newly
             generated symbols.
+            Each symbol is sampled from the probability of a zero computed over the context
+            nodes, and then committed to those same nodes, without a separate predict and update.
             - `symbol_count`: the number of symbols to generate.
+            - `thresholds`: an optional list to append the probability of a zero that each symbol
+                            was sampled with to.
         """
 
         symbol_list = []
 
         for i in range(symbol_count):
-            # assert 0.99 <= self.predict([0])+self.predict([1]) <= 1.01, "Pro sum should be equal to 1"
+            # Find (or create) the nodes of the current context.
+            tree_size = self.tree_size
+            self.update_context()
+            context = self.context
+
+            # From the leaf to the root, compute the log KT estimate and weighted log probability
+            # each context node would have after seeing a zero.
+            zero_updates = []
+            log_probability = 0.0
+
+            path_child = None
+
+            for node in reversed(context):
+                counts = node.symbol_count
+                log_kt = log_kt_estimate(counts[0] + 1, counts[1])
+
+                if not node.children and node.evicted_log_probability is None:
+                    log_probability = log_kt
+                else:
+                    child_sum = 0.0
+                    for child in node.children.values():
+                        child_sum += log_probability if child is path_child else child.log_probability
+                    if node.evicted_log_probability is not None:
+                        child_sum += node.evicted_log_probability
+                    log_probability = weighted_log_probability(log_kt, child_sum)
+                # end if
+
+                path_child = node
+
+                zero_updates.append((log_kt, log_probability))
+            # end for
+
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(log_probability - self.root.log_probability)
 
-            threshold = self.predict([0])
+            if thresholds is not None:
+                thresholds.append(threshold)
 
             symbol = 0 if random.random() < threshold else 1
 
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            # Commit the chosen symbol to the context nodes.
+            if symbol == 0:
+                for node, (log_kt, log_probability) in zip(reversed(context), zero_updates):
+                    node.log_kt = log_kt
+                    node.log_probability = log_probability
+                    node.symbol_count[0] += 1
+                # end for
+            else:
+                for node in reversed(context):
+                    node.update(symbol)
+            # end if
+
             symbol_list.append(symbol)
-            self.update([symbol])
+            self.history.append(symbol)
+        # end for
 
         return symbol_list
 
@@ -242,6 +752,7 @@ class CTWContextTree:
               rho(y | h) = rho(hy)/rho(h)
             where `rho(h) = P_w^epsilon(h)` is the weighted probability estimate of observing `h`
             evaluated at the root node `epsilon` of the context tree.
+            The tree itself is left unchanged. (See `log_predict`.)
             - `symbol_list` The symbol (or list of symbols) to estimate the conditional probability of.
                             0 corresponds to `rho(0 | h)` and 1 to `rho(1 | h)`.
         """
@@ -249,43 +760,320 @@ class CTWContextTree:
         if len(self.history) + len(symbol_list) <= self.depth:
             return 0.5 ** len(symbol_list)
 
-        rho_h = self.root.log_probability
-        self.update(symbol_list)
-        rho_hy = self.root.log_probability
+        return math.exp(self.log_predict(symbol_list))
+    # end def
+
+    def log_history_probability(self):
+        """ Returns the log of the weighted probability `rho(h)` that the tree assigns to its history,
+            which is that of its root node. (Only if the tree `supports_node_state`.)
+        """
+
+        return self.node_state(self.root)[3]
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, as read by `ctw_serialization`.
+            - `columns`: the arrays of the zero counts, one counts, log KT estimates, weighted log
+                         probabilities and indices of the children after a zero and after a one
+                         (or -1) of the nodes, numbered breadth first from the root (node 0).
+            - `evicted_log_probability`: the evicted log probabilities of the nodes that have one, by index.
+            - `depth_sizes`: the number of nodes at each depth of the tree.
+        """
+
+        count0, count1, log_kt, log_probability, child0, child1 = columns
+
+        self.root.tree = None
+        nodes = [CTWContextTreeNode(tree=self) for index in range(len(count0))]
+
+        for index, node in enumerate(nodes):
+            node.symbol_count[0] = count0[index]
+            node.symbol_count[1] = count1[index]
+            node.log_kt = log_kt[index]
+            node.log_probability = log_probability[index]
+
+            if child0[index] >= 0:
+                node.children[0] = nodes[child0[index]]
+            if child1[index] >= 0:
+                node.children[1] = nodes[child1[index]]
+            if index in evicted_log_probability:
+                node.evicted_log_probability = evicted_log_probability[index]
+        # end for
+
+        self.root = nodes[0]
+        self.tree_size = len(nodes)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def log_predict(self, symbol_list):
+        """ Returns the log of `rho(symbol_list | h)`, without changing or allocating any node of the tree.
+            (See `predict`.)
+
+            The weighted probabilities of the nodes on each context path are recomputed from the leaf to
+            the root as if the symbols had been added. Missing nodes are treated as fresh KT nodes, which
+            have a weighted probability of one half once they have seen a single symbol.
 
-        probability = rho_hy - rho_h
+            - `symbol_list`: the symbol (or list of symbols) to estimate the conditional probability of.
+        """
+
+        if len(symbol_list) == 1:
+            return self.log_predict_symbol(symbol_list[0])
+
+        # The updated state of each node touched by the symbols, as a list of its zero count, one count,
+        # log KT estimate, weighted log probability, evicted log probability and a dictionary of its children.
+        # Nodes that are missing from the tree are keyed by their parent's key and their symbol.
+        overlay = {}
+
+        def node_entry(key):
+            entry = overlay.get(key)
+            if entry is None:
+                entry = overlay[key] = self.node_state(key) + [dict(self.node_children(key))]
+            return entry
+        # end def
+
+        def node_log_probability(key):
+            entry = overlay.get(key)
+            return self.node_state(key)[3] if entry is None else entry[3]
+        # end def
+
+        root_log_probability = self.node_state(self.root)[3]
+        added = []
+
+        for symbol in symbol_list:
+            # Find (or imagine) the nodes on the context path, with the added symbols most recent.
+            context = (added[::-1] + list(self.history.recent(self.depth)))[:self.depth]
+            path = [self.root]
+
+            for context_symbol in context:
+                entry = node_entry(path[-1])
+                child = entry[5].get(context_symbol)
+                if child is None:
+                    child = entry[5][context_symbol] = (path[-1], context_symbol)
+                    overlay[child] = [0, 0, 0.0, 0.0, None, {}]
+                path.append(child)
+            # end for
+
+            for key in reversed(path):
+                entry = node_entry(key)
+                entry[symbol] += 1
+                entry[2] = log_kt_estimate(entry[0], entry[1])
+
+                if not entry[5] and entry[4] is None:
+                    entry[3] = entry[2]
+                else:
+                    child_sum = sum([node_log_probability(child) for child in entry[5].values()]) + (entry[4] or 0.0)
+                    entry[3] = weighted_log_probability(entry[2], child_sum)
+                # end if
+            # end for
+
+            added.append(symbol)
+        # end for
+
+        return overlay[self.root][3] - root_log_probability
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing context path
+            once without changing or allocating any node of the tree. (See `log_predict`.)
+
+            - `symbol`: the symbol to estimate the conditional probability of.
+        """
+
+        # Collect the existing nodes on the context path.
+        context = self.history.recent(self.depth)
+        path = [self.root]
+        node = self.root
+
+        for context_symbol in context:
+            node = node.children.get(context_symbol)
+            if node is None:
+                break
+            path.append(node)
+        # end for
+
+        # The updated weighted log probability of the child on the path below the current node.
+        # A missing child, and every node below it, is a fresh node that has seen one symbol.
+        log_probability = log_half if len(path) <= len(context) else None
+
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            counts = node.symbol_count
+            log_kt = log_kt_estimate(counts[0] + 1 - symbol, counts[1] + symbol)
+
+            if log_probability is None:
+                # The deepest node of a full context path.
+                child_sum = node.child_log_probability_sum()
+                log_probability = log_kt if child_sum is None else weighted_log_probability(log_kt, child_sum)
+            else:
+                sibling = node.children.get(1 - context[depth])
+                child_sum = log_probability if sibling is None else log_probability + sibling.log_probability
+                if node.evicted_log_probability is not None:
+                    child_sum += node.evicted_log_probability
+                log_probability = weighted_log_probability(log_kt, child_sum)
+            # end if
+        # end for
+
+        return log_probability - self.root.log_probability
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given node.
+        """
+
+        return node.children.items()
+
+    # end def
+
+    def node_labels(self, node):
+        """ Returns the context symbols linking the nodes of the tree that the given node stands for,
+            from the first to the last, whose children `node_children` returns. Only the nodes of a
+            path-compressed tree stand for more than one node. (See `PatriciaCTWContextTree`.)
+        """
+
+        return ()
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability (see `collapse_node`) of the given node.
+            (Only if the tree `supports_node_state`.)
+        """
+
+        return [node.symbol_count[0], node.symbol_count[1], node.log_kt, node.log_probability,
+                node.evicted_log_probability]
+
+    # end def
+
+    def predict_distribution(self, symbol_lists):
+        """ Returns a list of the conditional probabilities `rho(y | h)` of each of the given symbol lists
+            `y`, which must all have the same length, as `predict` would for each of them.
 
-        self.revert(len(symbol_list))
+            The symbol lists are visited depth first as a trie of their shared prefixes, so each prefix
+            is added to the tree once and reverted once, and the last symbol of each list is predicted
+            without changing the tree. The tree is left unchanged.
+
+            - `symbol_lists`: the symbol lists (e.g. the encodings of every action) to estimate the
+                              conditional probabilities of.
+        """
+
+        if not symbol_lists:
+            return []
+
+        symbol_count = len(symbol_lists[0])
+        assert all([len(symbol_list) == symbol_count for symbol_list in symbol_lists]), \
+            "The given symbol lists must all have the same length."
+
+        if symbol_count == 0 or len(self.history) + symbol_count <= self.depth:
+            return [0.5 ** symbol_count] * len(symbol_lists)
+
+        probabilities = [0.0] * len(symbol_lists)
+
+        def visit(indices, position, log_probability):
+            """ Visits the trie node reached by the first `position` symbols of the lists with the
+                given indices, which have already been added to the tree.
+            """
+
+            for symbol in (0, 1):
+                branch = [index for index in indices if symbol_lists[index][position] == symbol]
+                if not branch:
+                    continue
+
+                if position == symbol_count - 1:
+                    probability = math.exp(log_probability + self.log_predict_symbol(symbol))
+                    for index in branch:
+                        probabilities[index] = probability
+                else:
+                    rho_h = self.log_history_probability()
+                    self.update([symbol])
+                    visit(branch, position + 1, log_probability + self.log_history_probability() - rho_h)
+                    self.revert(1)
+                # end if
+            # end for
+        # end def
+
+        visit(list(range(len(symbol_lists))), 0, 0.0)
+
+        return probabilities
 
-        return math.exp(probability)
     # end def
 
     def revert(self, symbol_count=1):
         """ Restores the context tree to its state prior to a specified number of updates.
 
             - `num_symbols`: the number of updates (symbols) to revert. (Default of 1.)
+
+            Updates recorded in the undo journal (see `begin_journal`) are restored from the journal.
         """
 
         assert symbol_count >= 0, "The given symbol count should be greater than 0"
 
         for i in range(symbol_count):
-            symbol = self.history.pop(0)
-            self.history_size -= 1
+            if self.journal:
+                self.undo_journal_record()
+                continue
+            # end if
+
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
 
             self.update_context()
+            context = self.context
 
-            for node in reversed(self.context):
-                node.revert(symbol)
+            for depth in range(len(context) - 1, -1, -1):
+                deleted = context[depth].revert(symbol)
+
+                if deleted:
+                    self.tree_size -= deleted
+                    self.depth_sizes[depth + 1] -= deleted
+            # end for
+        # end for
+
+    # end def
 
     def size(self):
         """ Returns the number of nodes in the context tree.
         """
 
-        # Return the value stored and updated by the children nodes.
+        # Return the value stored and updated as nodes are created and deleted.
         return self.tree_size
 
     # end def
 
+    def size_by_depth(self):
+        """ Returns a list of the number of nodes at each depth of the context tree, from the root
+            (depth 0) to the maximum depth. The counts are kept up to date as nodes are created
+            and deleted, so this takes time proportional to the depth only.
+        """
+
+        return list(self.depth_sizes)
+
+    # end def
+
+    def snapshot(self):
+        """ Returns an independent copy of the context tree, which can be read, updated and reverted
+            without affecting this one, and is not affected by later changes to this one.
+
+            The copy takes time proportional to the size of the tree. (See `PersistentCTWContextTree`
+            for a tree whose snapshots share its nodes.)
+        """
+
+        journal, self.journal = self.journal, None
+        tree = copy.deepcopy(self)
+        self.journal = journal
+
+        return tree
+
+    # end def
+
     def update(self, symbol_list):
         """ Updates the context tree with a new (binary) symbol, or a list of symbols.
             Recalculates the log weighted probabilities and log KT estimates for each affected node.
@@ -293,13 +1081,18 @@ class CTWContextTree:
                               (The context tree is updated with symbols in the order they appear in the list.)
         """
         for symbol in symbol_list:
+            tree_size = self.tree_size
             self.update_context()
 
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
             for node in reversed(self.context):
                 node.update(symbol)
 
-            self.update_history([symbol])
-            
+            self.history.append(symbol)
+        # end for
+
     # end def
 
     def update_context(self):
@@ -311,34 +1104,34 @@ class CTWContextTree:
         """
         self.context = [self.root]
         parent = self.root
+        depth = 0
 
-        for i in range(len(self.history)):
-
-            symbol = self.history[i]
+        for symbol in self.history.recent(self.depth):
+            depth += 1
 
             if symbol not in parent.children:
                 child = CTWContextTreeNode(tree=self)
                 parent.children[symbol] = child
 
                 self.tree_size += 1
+                self.depth_sizes[depth] += 1
 
             parent = parent.children[symbol]
             self.context.append(parent)
-            
-            if i == self.depth-1:
-                break
-            # end def
+        # end for
 
     def update_history(self, symbol_list):
         """ Appends a symbol (or a list of symbols) to the tree's history without updating the tree.
+            The symbols are context for later symbols only, and `revert` removes them from the history
+            without touching any node.
             - `symbol_list`: the symbol (or list of symbols) to add to the history.
         """
 
-        # Ensure that we have a list, by making this a list if it's a single symbol.
-
         for symbol in symbol_list:
-            self.history = [symbol] + self.history
-            self.history_size += 1
+            if self.journal is not None:
+                self.journal.append((symbol, (), (), 0))
+
+            self.history.append(symbol, context_only=True)
 
     # end def
 
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a factored context tree model, with one context tree for each symbol position of a repeating cycle.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import math
+
+import ctw_context_tree
+
+
+class FactoredCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A model of a sequence made of repeating cycles of `cycle_bits` symbols, such as the percept and
+        action symbols of an agent, which predicts the symbol at each position of the cycle with its own
+        context tree, as in the factored model of the MC-AIXI-CTW paper.
+
+        The symbol at position `i` of a cycle (the `(len(history) % cycle_bits)`th symbol) is predicted
+        from, and only ever added to, the tree in `factors[i]`. Every factor reads its context from the
+        same history, which holds the symbols of all the positions, but the factors share no nodes, so
+        an update changes exactly one of them, and the factors could be updated independently of each
+        other. Each factor only models the statistics of its own bit, so it is much smaller than a
+        single tree modelling every bit, and a wide percept no longer slows down the prediction of its
+        other bits.
+
+        The model offers the same interface as `CTWContextTree`, except for the node level methods:
+        `size` and `size_by_depth` count the nodes of all the factors, and the node budget is shared
+        between them.
+    """
+
+    # Instance methods.
+
+    def __init__(self, depth, cycle_bits, engine=None, history_window=None, history_log=False, max_nodes=None):
+        """ Create a factored model of context trees of specified maximum depth, one for each symbol of a cycle.
+            - `depth`: the maximum depth of each context tree.
+            - `cycle_bits`: the number of symbols in each cycle, and so the number of context trees.
+            - `engine`: the context tree class of the factors. (Defaults to `CTWContextTree`.)
+            - `history_window`, `history_log`, `max_nodes`: as for `CTWContextTree`.
+        """
+
+        assert cycle_bits > 0, "The cycle must have at least one symbol."
+
+        # The number of symbols in each cycle.
+        self.cycle_bits = cycle_bits
+
+        # The context tree class of the factors.
+        self.engine = engine or ctw_context_tree.CTWContextTree
+
+        # The context trees predicting the symbols at each position of the cycle.
+        self.factors = []
+
+        ctw_context_tree.CTWContextTree.__init__(self, depth, history_window=history_window,
+                                                 history_log=history_log, max_nodes=max_nodes)
+
+    # end def
+
+    def begin_journal(self):
+        """ Starts (or continues) recording an undo journal in every factor.
+            (See `CTWContextTree.begin_journal`.)
+        """
+
+        return sum([factor.begin_journal() for factor in self.factors])
+
+    # end def
+
+    def clear(self):
+        """ Clears every factor, and the history they share.
+        """
+
+        # The history of symbols seen by the model, shared by all the factors.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        if not self.factors:
+            self.factors = [self.engine(self.depth, history_window=self.history_window)
+                            for position in range(self.cycle_bits)]
+
+        for factor in self.factors:
+            factor.clear()
+            factor.history = self.history
+        # end for
+
+    # end def
+
+    def end_journal(self):
+        """ Stops recording the undo journal of every factor, and discards it.
+        """
+
+        for factor in self.factors:
+            factor.end_journal()
+
+    # end def
+
+    def enforce_node_budget(self):
+        """ Lets each factor maintain itself (see `CompactCTWContextTree.enforce_node_budget`), then evicts
+            nodes from the factors if they have grown beyond their shared node budget.
+            (See `CTWContextTree.enforce_node_budget`.)
+        """
+
+        evicted = sum([factor.enforce_node_budget() for factor in self.factors])
+
+        return evicted + ctw_context_tree.CTWContextTree.enforce_node_budget(self)
+
+    # end def
+
+    def evict(self, node_count):
+        """ Collapses the least visited subtrees of the factors, until they have at most `node_count`
+            nodes in all, by evicting from each factor in proportion to its size.
+            (See `CTWContextTree.evict`.)
+
+            Returns the number of nodes evicted.
+            - `node_count`: the number of nodes to reduce the factors to.
+        """
+
+        tree_size = self.tree_size
+
+        if tree_size <= node_count:
+            return 0
+
+        evicted_subtrees = 0
+
+        for factor in self.factors:
+            factor_subtrees = factor.evicted_subtrees
+            factor.evict(max(1, factor.size() * node_count // tree_size))
+            evicted_subtrees += factor.evicted_subtrees - factor_subtrees
+        # end for
+
+        evicted = tree_size - self.tree_size
+
+        self.evictions += 1
+        self.evicted_subtrees += evicted_subtrees
+        self.evicted_nodes += evicted
+
+        return evicted
+
+    # end def
+
+    def factor(self, offset=0):
+        """ Returns the factor predicting the symbol `offset` symbols after the next one.
+        """
+
+        return self.factors[(len(self.history) + offset) % self.cycle_bits]
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols, each sampled from the factor for its position,
+            and updates the factors with them. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            symbol_list += self.factor().generate_random_symbols_and_update(1, thresholds)
+
+        return symbol_list
+
+    # end def
+
+    def log_history_probability(self):
+        """ Returns the log of the weighted probability the model assigns to its history, which is
+            the sum of those of the factors. (Only if every factor `supports_node_state`.)
+        """
+
+        assert self.supports_node_state, "The factors do not keep the probability of their history."
+
+        return sum([factor.log_history_probability() for factor in self.factors])
+
+    # end def
+
+    def log_predict(self, symbol_list):
+        """ Returns the log of `rho(symbol_list | h)`, by temporarily adding the symbols to the factors.
+            The factors are left unchanged. (See `CTWContextTree.log_predict`.)
+        """
+
+        if len(symbol_list) == 1:
+            return self.log_predict_symbol(symbol_list[0])
+
+        log_probability = 0.0
+
+        for symbol in symbol_list:
+            factor = self.factor()
+            log_probability += factor.log_predict_symbol(symbol)
+            factor.update([symbol])
+        # end for
+
+        self.revert(len(symbol_list))
+
+        return log_probability
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, from the factor for its position.
+            (See `CTWContextTree.log_predict_symbol`.)
+        """
+
+        return self.factor().log_predict_symbol(symbol)
+
+    # end def
+
+    def predict_distribution(self, symbol_lists):
+        """ Returns a list of the conditional probabilities `rho(y | h)` of each of the given symbol lists,
+            from the predictions of the factor for the position of each symbol, visiting the symbol lists
+            as a trie of their shared prefixes. (See `CTWContextTree.predict_distribution`.)
+        """
+
+        if not symbol_lists:
+            return []
+
+        symbol_count = len(symbol_lists[0])
+        assert all([len(symbol_list) == symbol_count for symbol_list in symbol_lists]), \
+            "The given symbol lists must all have the same length."
+
+        if symbol_count == 0 or len(self.history) + symbol_count <= self.depth:
+            return [0.5 ** symbol_count] * len(symbol_lists)
+
+        probabilities = [0.0] * len(symbol_lists)
+
+        def visit(indices, position, log_probability):
+            """ Visits the trie node reached by the first `position` symbols of the lists with the
+                given indices, which have already been added to the model.
+            """
+
+            for symbol in (0, 1):
+                branch = [index for index in indices if symbol_lists[index][position] == symbol]
+                if not branch:
+                    continue
+
+                branch_log_probability = log_probability + self.log_predict_symbol(symbol)
+
+                if position == symbol_count - 1:
+                    probability = math.exp(branch_log_probability)
+                    for index in branch:
+                        probabilities[index] = probability
+                else:
+                    self.update([symbol])
+                    visit(branch, position + 1, branch_log_probability)
+                    self.revert(1)
+                # end if
+            # end for
+        # end def
+
+        visit(list(range(len(symbol_lists))), 0, 0.0)
+
+        return probabilities
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the factors to their state prior to a specified number of updates.
+            (See `CTWContextTree.revert`.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        for i in range(symbol_count):
+            self.factor(-1).revert(1)
+
+    # end def
+
+    def size(self):
+        """ Returns the number of nodes in all the factors.
+        """
+
+        return self.tree_size
+
+    # end def
+
+    def size_by_depth(self):
+        """ Returns a list of the number of nodes at each depth of the factors, from the root (depth 0)
+            to the maximum depth.
+        """
+
+        return [sum(sizes) for sizes in zip(*[factor.size_by_depth() for factor in self.factors])]
+
+    # end def
+
+    @property
+    def supports_node_state(self):
+        """ Whether every factor keeps the symbol counts and probabilities of its nodes, as a factor
+            that has been frozen does not.
+        """
+
+        return all([factor.supports_node_state for factor in self.factors])
+
+    # end def
+
+    @property
+    def tree_size(self):
+        """ The number of nodes in all the factors.
+        """
+
+        return sum([factor.size() for factor in self.factors])
+
+    # end def
+
+    def snapshot(self):
+        """ Returns an independent copy of the model, with a snapshot of every factor sharing one copy
+            of the history. (See `CTWContextTree.snapshot`.)
+        """
+
+        model = copy.copy(self)
+        model.history = self.history.copy()
+        model.factors = [factor.snapshot() for factor in self.factors]
+        model.journal = None
+
+        for factor in model.factors:
+            factor.history = model.history
+
+        return model
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Updates the factor for the position of each of the given symbols with that symbol.
+            (See `CTWContextTree.update`.)
+        """
+
+        for symbol in symbol_list:
+            self.factor().update([symbol])
+
+    # end def
+
+    def update_history(self, symbol_list):
+        """ Appends a symbol (or a list of symbols) to the shared history without updating the factors.
+            (See `CTWContextTree.update_history`.)
+        """
+
+        for symbol in symbol_list:
+            self.factor().update_history([symbol])
+
+    # end def
+
+    def show(self):
+        return "\n".join(["%d: %s" % (position, factor.show()) for position, factor in enumerate(self.factors)])
+
+    # end def
+# end class
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a frozen context tree, compiled from a learned context tree into flat arrays of predictions.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import math
+import random
+from array import array
+
+import ctw_context_tree
+from ctw_numeric import log_half
+
+# The index of a missing child.
+no_node = -1
+
+
+class FrozenCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A read-only context tree, compiled (see `compile`) from a learned context tree of any engine.
+
+        The nodes are numbered breadth first, so the nodes near the root, which every prediction
+        visits, are stored together, and held in flat arrays of the indices of their children.
+        Rather than symbol counts and weighted probabilities, each node holds the conditional
+        probability of a zero that the learned tree predicted for the contexts whose path ends at
+        that node, so predicting a symbol is a walk down the arrays and a single lookup.
+
+        The tree never changes once compiled: `update` and `update_history` only add symbols to its
+        history, and `revert` only removes them, so there is nothing to journal or to recompute.
+        Each symbol of a prediction is therefore predicted from the statistics the tree was compiled
+        from, rather than from a tree that has also learned the symbols before it, as the model
+        of an agent whose learning period has expired is meant to be.
+    """
+
+    # Class attributes.
+
+    # A frozen tree keeps no symbol counts or probabilities for its nodes.
+    supports_node_state = False
+
+    # Instance methods.
+
+    def clear(self):
+        """ Clears the entire context tree, leaving only a root that predicts each symbol with
+            probability one half, and clears the history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # The index of the root node.
+        self.root = 0
+
+        # The indices of the children of each node after a zero and a one, or `no_node`.
+        self.child0 = array(str('i'), [no_node])
+        self.child1 = array(str('i'), [no_node])
+
+        # The probability of a zero for each node and each next context symbol, at index `2 * node + symbol`,
+        # where the node has no child for that symbol (or is at the maximum depth, for either symbol).
+        self.zero_probability = array(str('d'), [0.5, 0.5])
+
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # Nothing is ever journaled.
+        self.context = []
+        self.journal = None
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns the number of bytes each node of the tree takes in its arrays.
+        """
+
+        return self.child0.itemsize + self.child1.itemsize + 2 * self.zero_probability.itemsize
+
+    # end def
+
+    def compile(self, tree):
+        """ Replaces this tree with a compiled copy of the given learned context tree, and takes over its
+            history. The given tree is left unchanged, but should no longer be updated, as its history is
+            now shared with this one.
+
+            Each prediction is made by the given tree's own `log_predict_symbol`, for a context that
+            leads to the node and then leaves the tree, so the compiled tree predicts exactly as the
+            given tree did, for any context as long as its depth.
+            - `tree`: the context tree to compile, of any engine (but not a factored model).
+        """
+
+        assert tree.depth == self.depth, "The given tree must have the same depth as this one."
+
+        history = tree.history
+
+        # Number the nodes breadth first. Each node of the given tree may stand for a chain of nodes
+        # (see `CTWContextTree.node_labels`), each of which is queued with its position in the chain,
+        # its context symbols from the root, and the index of its parent.
+        child0, child1 = array(str('i')), array(str('i'))
+        zero_probability = array(str('d'))
+        depth_sizes = [0] * (self.depth + 1)
+
+        queue = collections.deque([(tree.root, 0, (), no_node)])
+
+        try:
+            while queue:
+                node, position, context, parent = queue.popleft()
+                index = len(child0)
+
+                child0.append(no_node)
+                child1.append(no_node)
+                depth_sizes[len(context)] += 1
+
+                if parent != no_node:
+                    (child1 if context[-1] else child0)[parent] = index
+
+                labels = tree.node_labels(node)
+
+                if position < len(labels):
+                    children = [(labels[position], node, position + 1)]
+                else:
+                    children = [(symbol, child, 0) for symbol, child in sorted(tree.node_children(node))]
+
+                queue.extend([(child, child_position, context + (symbol,), index)
+                              for symbol, child, child_position in children])
+
+                # Predict a zero for each context that leaves the tree below this node.
+                for symbol in (0, 1):
+                    if len(context) == self.depth or symbol not in [child[0] for child in children]:
+                        tree.history = self.context_history(context + (symbol,))
+                        zero_probability.append(math.exp(tree.log_predict_symbol(0)))
+                    else:
+                        zero_probability.append(0.5)
+                    # end if
+                # end for
+            # end while
+        finally:
+            tree.history = history
+        # end try
+
+        self.history = history
+        self.child0, self.child1 = child0, child1
+        self.zero_probability = zero_probability
+        self.tree_size = len(child0)
+        self.depth_sizes = depth_sizes
+
+    # end def
+
+    def context_history(self, context):
+        """ Returns a history whose most recent `depth` symbols are the given context symbols, most recent first,
+            followed by zeros.
+        """
+
+        history = ctw_context_tree.CTWHistory(self.depth)
+
+        for symbol in reversed((list(context) + [0] * self.depth)[:self.depth]):
+            history.append(symbol)
+
+        return history
+
+    # end def
+
+    def evict(self, node_count):
+        """ Evicts nothing, as a frozen tree never grows. Returns 0.
+        """
+
+        return 0
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to the compiled
+            predictions, and adds them to the history. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = self.zero_probability[self.prediction_index()]
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            symbol_list.append(symbol)
+            self.history.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def load_compiled_nodes(self, child0, child1, zero_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given compiled nodes, as read by `ctw_serialization`.
+            - `child0`, `child1`: the arrays of the indices of the children of the nodes after a zero
+                                  and after a one (or `no_node`), numbered breadth first from the root.
+            - `zero_probability`: the array of the probabilities of a zero of the nodes. (See `clear`.)
+            - `depth_sizes`: the number of nodes at each depth.
+        """
+
+        self.child0, self.child1 = array(str('i'), child0), array(str('i'), child1)
+        self.zero_probability = array(str('d'), zero_probability)
+
+        assert len(self.zero_probability) == 2 * len(self.child0), "The compiled nodes are inconsistent."
+
+        self.root = 0
+        self.tree_size = len(self.child0)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the tree with a compiled copy (see `compile`) of the given nodes of a learned tree,
+            which are first loaded into a `CTWContextTree` sharing this tree's history.
+            (See `CTWContextTree.load_nodes`.)
+        """
+
+        tree = ctw_context_tree.CTWContextTree(self.depth, history_window=self.history_window)
+        tree.history = self.history
+        tree.load_nodes(columns, evicted_log_probability, depth_sizes)
+
+        self.compile(tree)
+
+    # end def
+
+    def log_history_probability(self):
+        """ A frozen tree does not keep the probability of its history, as it does not `supports_node_state`.
+            Use `log_predict` instead.
+        """
+
+        raise NotImplementedError("A frozen context tree does not keep the probability of its history.")
+
+    # end def
+
+    def log_predict(self, symbol_list):
+        """ Returns the log of `rho(symbol_list | h)`, as the sum of the log of the compiled prediction
+            of each symbol after the symbols before it. The history is left unchanged.
+        """
+
+        log_probability = 0.0
+
+        for symbol in symbol_list:
+            log_probability += self.log_predict_symbol(symbol)
+            self.history.append(symbol)
+        # end for
+
+        for symbol in symbol_list:
+            self.history.pop()
+
+        return log_probability
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of the compiled prediction `rho(symbol | h)` for a single symbol.
+            Every symbol is predicted with probability one half until the history is as long as
+            the depth of the tree.
+        """
+
+        if len(self.history) < self.depth:
+            return log_half
+
+        zero_probability = self.zero_probability[self.prediction_index()]
+
+        return math.log(zero_probability if symbol == 0 else 1.0 - zero_probability)
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given node.
+        """
+
+        return [(symbol, child) for symbol, child in ((0, self.child0[node]), (1, self.child1[node]))
+                if child != no_node]
+
+    # end def
+
+    def node_state(self, node):
+        """ A frozen tree does not keep the symbol counts or probabilities of its nodes, as it does not
+            `supports_node_state`.
+        """
+
+        raise NotImplementedError("A frozen context tree does not keep the state of its nodes.")
+
+    # end def
+
+    def predict_distribution(self, symbol_lists):
+        """ Returns a list of the conditional probabilities `rho(y | h)` of each of the given symbol lists,
+            as `predict` would for each of them. (See `CTWContextTree.predict_distribution`.)
+        """
+
+        if not symbol_lists:
+            return []
+
+        symbol_count = len(symbol_lists[0])
+        assert all([len(symbol_list) == symbol_count for symbol_list in symbol_lists]), \
+            "The given symbol lists must all have the same length."
+
+        if symbol_count == 0 or len(self.history) + symbol_count <= self.depth:
+            return [0.5 ** symbol_count] * len(symbol_lists)
+
+        probabilities = [0.0] * len(symbol_lists)
+
+        def visit(indices, position, log_probability):
+            """ Visits the trie node reached by the first `position` symbols of the lists with the
+                given indices, which have already been added to the history.
+            """
+
+            for symbol in (0, 1):
+                branch = [index for index in indices if symbol_lists[index][position] == symbol]
+                if not branch:
+                    continue
+
+                branch_log_probability = log_probability + self.log_predict_symbol(symbol)
+
+                if position == symbol_count - 1:
+                    probability = math.exp(branch_log_probability)
+                    for index in branch:
+                        probabilities[index] = probability
+                else:
+                    self.history.append(symbol)
+                    visit(branch, position + 1, branch_log_probability)
+                    self.history.pop()
+                # end if
+            # end for
+        # end def
+
+        visit(list(range(len(symbol_lists))), 0, 0.0)
+
+        return probabilities
+
+    # end def
+
+    def prediction_index(self):
+        """ Returns the index in `zero_probability` of the prediction for the current context, which
+            must be at least as long as the depth of the tree.
+        """
+
+        child0, child1 = self.child0, self.child1
+        node = self.root
+
+        for symbol in self.history.recent(self.depth):
+            child = (child1 if symbol else child0)[node]
+            if child == no_node:
+                return 2 * node + symbol
+            node = child
+        # end for
+
+        return 2 * node
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Removes a specified number of symbols from the history.
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        for i in range(symbol_count):
+            self.history.pop()
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Adds a symbol (or a list of symbols) to the history. The tree itself never changes.
+        """
+
+        for symbol in symbol_list:
+            self.history.append(symbol)
+
+    # end def
+
+    def update_history(self, symbol_list):
+        """ Adds a symbol (or a list of symbols) to the history, as context only.
+            (See `CTWContextTree.update_history`.)
+        """
+
+        for symbol in symbol_list:
+            self.history.append(symbol, context_only=True)
+
+    # end def
+
+    def show(self, node=None):
+        """ Returns a string representation of the tree, giving the compiled probability of a zero
+            for each missing child of each node.
+        """
+
+        if node is None:
+            node = self.root
+
+        probabilities = '0:' + str(self.zero_probability[2 * node]) + '  1:' + str(self.zero_probability[2 * node + 1])
+        children = ""
+
+        for symbol, child in self.node_children(node):
+            children += str(symbol) + self.show(child) + ','
+
+        return '{' + probabilities + '||' + children + '}'
+
+    # end def
+# end class
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a context tree that addresses its nodes by their depth and context in a hash table.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+import sys
+
+import ctw_context_tree
+from ctw_numeric import log_half, log_kt_estimate, weighted_log_probability
+
+# Translates a string of 0 and 1 symbols into the binary digits of an integer literal.
+binary_digits = bytes.maketrans(b'\x00\x01', b'01')
+
+
+class HashedCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A context tree that keeps its nodes in a hash table keyed by depth and context, instead of
+        linking each node to its children.
+
+        The node for the context `c` at depth `d`, with `c[0]` the most recent symbol, is stored in
+        `nodes` under the key `2^d + sum(c[i] 2^i for i < d)`, as a list of its zero count, one count,
+        log KT estimate and weighted log probability. The leading one bit of a key gives the depth of
+        the node, and Python integers are unbounded, so the keys of nodes deeper than 64 simply span
+        several words. The children of the node with key `k` at depth `d` have the keys `k + 2^d`
+        (after a zero) and `k + 2^(d + 1)` (after a one).
+
+        The context path of the current history is found by packing the recent history into one
+        integer, masking it to each depth, and looking all of the resulting keys up in a single pass,
+        rather than by following a child pointer for each level of the tree.
+
+        The tree offers the same interface as `CTWContextTree`, but `context` holds node keys
+        rather than node objects, while `context_nodes` holds the corresponding node lists.
+    """
+
+    # The key of the root node.
+    root_key = 1
+
+    # Instance methods.
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # The masks selecting the context bits of the packed history for each depth, and the leading
+        # bit marking the depth, from the root (depth 0) down.
+        self.key_masks = [((1 << depth) - 1, 1 << depth) for depth in range(self.depth + 1)]
+
+        # Empty the hash table, and add a new root node.
+        self.root = self.root_key
+        self.nodes = {self.root: [0, 0, 0.0, 0.0]}
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # The evicted log probabilities of the nodes that children have been evicted from, by key.
+        # (See `CTWContextTree.collapse_node`.)
+        self.evicted_log_probability = {}
+
+        # Reset the context.
+        self.context = []
+        self.context_nodes = []
+
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def add_evicted_log_probability(self, key, child_sum):
+        """ Returns the given sum of the weighted log probabilities of the children of the node with
+            the given key (or None), plus the node's evicted log probability, if it has one.
+        """
+
+        evicted_log_probability = self.evicted_log_probability.get(key)
+
+        if evicted_log_probability is None:
+            return child_sum
+
+        return evicted_log_probability if child_sum is None else child_sum + evicted_log_probability
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns an estimate of the number of bytes each node of the tree takes: its share of the hash
+            table, its key, and its list of counts and log probabilities.
+        """
+
+        node = self.nodes[self.root]
+
+        return sys.getsizeof(self.nodes) // len(self.nodes) + sys.getsizeof(self.root) + \
+            sys.getsizeof(node) + sum([sys.getsizeof(value) for value in node])
+
+    # end def
+
+    def child_log_probability_sum(self, key, depth):
+        """ Returns the sum of the weighted log probabilities of the children of the node with the
+            given key and depth, including those evicted from it, or None if the node is a leaf.
+        """
+
+        if depth == self.depth:
+            return None
+
+        step = 1 << depth
+        zero = self.nodes.get(key + step)
+        one = self.nodes.get(key + step + step)
+
+        if zero is None:
+            child_sum = None if one is None else one[3]
+        else:
+            child_sum = zero[3] if one is None else zero[3] + one[3]
+
+        if self.evicted_log_probability:
+            return self.add_evicted_log_probability(key, child_sum)
+
+        return child_sum
+
+    # end def
+
+    def delete_children(self, node, descendants):
+        """ Removes the children of the given node from the tree, adding their weighted log probabilities
+            to the node's evicted log probability. (See `CTWContextTree.delete_children`.)
+        """
+
+        self.evicted_log_probability[node] = self.child_log_probability_sum(node, node.bit_length() - 1)
+
+        for descendant in descendants:
+            del self.nodes[descendant]
+            self.evicted_log_probability.pop(descendant, None)
+        # end for
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to
+            the context tree statistics and update the context tree with the newly
+            generated symbols. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        nodes = self.nodes
+        root = nodes[self.root]
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Find (or create) the nodes of the current context.
+            tree_size = self.tree_size
+            self.update_context()
+            context, context_nodes = self.context, self.context_nodes
+
+            # From the leaf to the root, compute the log KT estimate and weighted log probability
+            # each context node would have after seeing a zero.
+            zero_updates = []
+            child_log_probability = None
+
+            for depth in range(len(context) - 1, -1, -1):
+                node = context_nodes[depth]
+                kt = log_kt_estimate(node[0] + 1, node[1])
+
+                if child_log_probability is None:
+                    child_sum = self.child_log_probability_sum(context[depth], depth)
+                else:
+                    sibling = nodes.get(context[depth + 1] ^ (1 << depth))
+                    child_sum = child_log_probability if sibling is None else child_log_probability + sibling[3]
+                    if self.evicted_log_probability:
+                        child_sum = self.add_evicted_log_probability(context[depth], child_sum)
+                # end if
+
+                child_log_probability = kt if child_sum is None else weighted_log_probability(kt, child_sum)
+
+                zero_updates.append((kt, child_log_probability))
+            # end for
+
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(child_log_probability - root[3])
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            # Commit the chosen symbol to the context nodes.
+            if symbol == 0:
+                for node, (kt, node_log_probability) in zip(reversed(context_nodes), zero_updates):
+                    node[0] += 1
+                    node[2] = kt
+                    node[3] = node_log_probability
+                # end for
+            else:
+                self.update_context_nodes(symbol)
+            # end if
+
+            symbol_list.append(symbol)
+            self.history.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def journal_record(self, symbol, created):
+        """ Returns an undo journal record of the current context, before it is updated with the given symbol.
+            (See `CTWContextTree.journal_record`.)
+        """
+
+        return symbol, self.context, [(node[2], node[3]) for node in self.context_nodes], created
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing context path
+            once without changing or adding any node. (See `CTWContextTree.log_predict_symbol`.)
+        """
+
+        nodes = self.nodes
+
+        # Collect the existing nodes on the context path.
+        context = self.history.recent(self.depth)
+        keys = self.context_keys(context)
+        path = []
+
+        for key in keys:
+            node = nodes.get(key)
+            if node is None:
+                break
+            path.append(node)
+        # end for
+
+        # The updated weighted log probability of the child on the path below the current node.
+        # A missing child, and every node below it, is a fresh node that has seen one symbol.
+        child_log_probability = log_half if len(path) <= len(context) else None
+
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            kt = log_kt_estimate(node[0] + 1 - symbol, node[1] + symbol)
+
+            if child_log_probability is None:
+                # The deepest node of a full context path.
+                child_sum = self.child_log_probability_sum(keys[depth], depth)
+                child_log_probability = kt if child_sum is None else weighted_log_probability(kt, child_sum)
+            else:
+                sibling = nodes.get(keys[depth + 1] ^ (1 << depth))
+                child_sum = child_log_probability if sibling is None else child_log_probability + sibling[3]
+                if self.evicted_log_probability:
+                    child_sum = self.add_evicted_log_probability(keys[depth], child_sum)
+                child_log_probability = weighted_log_probability(kt, child_sum)
+            # end if
+        # end for
+
+        return child_log_probability - nodes[self.root][3]
+
+    # end def
+
+    def context_keys(self, context):
+        """ Returns the keys of the nodes on the path of the given context, a sequence of symbols
+            ordered from the most recent one, from the root to the leaf.
+        """
+
+        if not context:
+            return [self.root]
+
+        packed = int(bytes(context)[::-1].translate(binary_digits), 2)
+
+        return [(packed & mask) | bit for mask, bit in self.key_masks[:len(context) + 1]]
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, keyed by their depth and context.
+            (See `CTWContextTree.load_nodes`.)
+        """
+
+        count0, count1, log_kt, log_probability, child0, child1 = columns
+
+        # The key and depth of each node. Every node is numbered after its parent.
+        keys = [self.root_key] + [0] * (len(count0) - 1)
+        depths = bytearray(len(count0))
+
+        self.nodes = {}
+        self.evicted_log_probability = {}
+
+        for index in range(len(count0)):
+            key, depth = keys[index], depths[index]
+            self.nodes[key] = [count0[index], count1[index], log_kt[index], log_probability[index]]
+
+            if index in evicted_log_probability:
+                self.evicted_log_probability[key] = evicted_log_probability[index]
+
+            step = 1 << depth
+            for child, child_key in ((child0[index], key + step), (child1[index], key + step + step)):
+                if child >= 0:
+                    keys[child] = child_key
+                    depths[child] = depth + 1
+            # end for
+        # end for
+
+        self.tree_size = len(count0)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given node.
+        """
+
+        depth = node.bit_length() - 1
+        if depth == self.depth:
+            return []
+
+        step = 1 << depth
+        return [(symbol, node + step + symbol * step) for symbol in (0, 1)
+                if node + step + symbol * step in self.nodes]
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability of the given node.
+        """
+
+        return self.nodes[node] + [self.evicted_log_probability.get(node)]
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the context tree to its state prior to a specified number of updates.
+
+            - `symbol_count`: the number of updates (symbols) to revert. (Default of 1.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        nodes = self.nodes
+
+        for i in range(symbol_count):
+            if self.journal:
+                self.undo_journal_record()
+                continue
+            # end if
+
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
+
+            self.update_context()
+            context, context_nodes = self.context, self.context_nodes
+
+            for depth in range(len(context) - 1, -1, -1):
+                node = context_nodes[depth]
+
+                assert node[symbol] > 0, "Symbol count should be non-negative"
+                node[symbol] -= 1
+                node[2] = log_kt_estimate(node[0], node[1])
+
+                if depth + 1 < len(context):
+                    child = context_nodes[depth + 1]
+                    sibling = nodes.get(context[depth + 1] ^ (1 << depth))
+                    child_sum = None if sibling is None else sibling[3]
+
+                    # Delete the child on the path if it is no longer visited. Nodes are reverted from
+                    # the leaf up, so it has already deleted its own children, and is a leaf.
+                    if child[0] + child[1] == 0:
+                        del nodes[context[depth + 1]]
+                        self.tree_size -= 1
+                        self.depth_sizes[depth + 1] -= 1
+                    else:
+                        child_sum = child[3] if child_sum is None else child[3] + child_sum
+                    # end if
+
+                    if self.evicted_log_probability:
+                        child_sum = self.add_evicted_log_probability(context[depth], child_sum)
+                else:
+                    child_sum = self.child_log_probability_sum(context[depth], depth)
+                # end if
+
+                node[3] = node[2] if child_sum is None else weighted_log_probability(node[2], child_sum)
+            # end for
+        # end for
+
+    # end def
+
+    def undo_journal_record(self):
+        """ Restores the context tree to its state prior to the last update recorded in the journal.
+            (See `CTWContextTree.undo_journal_record`.)
+        """
+
+        symbol, context, values, created = self.journal.pop()
+
+        self.history.pop()
+
+        nodes = self.nodes
+
+        for key, (kt, log_probability) in zip(context, values):
+            node = nodes[key]
+            node[symbol] -= 1
+            node[2] = kt
+            node[3] = log_probability
+        # end for
+
+        if created:
+            # Delete the (now unvisited) nodes that were created by the update.
+            for depth in range(len(context) - created, len(context)):
+                del nodes[context[depth]]
+                self.depth_sizes[depth] -= 1
+            # end for
+
+            self.tree_size -= created
+        # end if
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Updates the context tree with a new (binary) symbol, or a list of symbols.
+            (See `CTWContextTree.update`.)
+        """
+
+        for symbol in symbol_list:
+            tree_size = self.tree_size
+            self.update_context()
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            self.update_context_nodes(symbol)
+            self.history.append(symbol)
+        # end for
+
+    # end def
+
+    def update_context_nodes(self, symbol):
+        """ Updates the nodes of the current context (see `update_context`) after having observed
+            a new symbol, from the leaf to the root.
+        """
+
+        nodes = self.nodes
+        context, context_nodes = self.context, self.context_nodes
+        child_log_probability = None
+
+        for depth in range(len(context) - 1, -1, -1):
+            node = context_nodes[depth]
+            node[symbol] += 1
+
+            kt = node[2] = log_kt_estimate(node[0], node[1])
+
+            if child_log_probability is None:
+                child_sum = self.child_log_probability_sum(context[depth], depth)
+            else:
+                sibling = nodes.get(context[depth + 1] ^ (1 << depth))
+                child_sum = child_log_probability if sibling is None else child_log_probability + sibling[3]
+                if self.evicted_log_probability:
+                    child_sum = self.add_evicted_log_probability(context[depth], child_sum)
+            # end if
+
+            child_log_probability = node[3] = kt if child_sum is None else weighted_log_probability(kt, child_sum)
+        # end for
+
+    # end def
+
+    def update_context(self):
+        """ Calculates which nodes in the context tree correspond to the current
+            context, and adds their keys to `context` (and the nodes themselves to
+            `context_nodes`) in order from root to leaf.
+            Creates the nodes if they do not exist.
+        """
+
+        nodes = self.nodes
+
+        context = self.context_keys(self.history.recent(self.depth))
+        context_nodes = list(map(nodes.get, context))
+
+        if context_nodes[-1] is None:
+            # Add the missing nodes, which are always the deepest nodes of the context.
+            for depth in range(len(context) - 1, 0, -1):
+                if context_nodes[depth] is not None:
+                    break
+
+                context_nodes[depth] = nodes[context[depth]] = [0, 0, 0.0, 0.0]
+
+                self.tree_size += 1
+                self.depth_sizes[depth] += 1
+            # end for
+        # end if
+
+        self.context = context
+        self.context_nodes = context_nodes
+
+    # end def
+
+    def show(self, node=None):
+        """ Returns a string representation of the tree, in the same format as `CTWContextTree.show`.
+        """
+
+        if node is None:
+            node = self.root
+
+        counts = self.nodes[node]
+        symbols = '0:' + str(counts[0]) + '  1:' + str(counts[1])
+        children = ""
+
+        for symbol, child in self.node_children(node):
+            children += str(symbol) + self.show(child) + ','
+
+        return '{' + symbols + '||' + children + '}'
+
+    # end def
+# end class
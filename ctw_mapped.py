@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a context tree that keeps its node pool in a memory-mapped file, so that it can grow beyond
+physical memory, and be reopened.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+import ctw_context_tree
+import ctw_node_pool
+
+# The identifier at the start of every node file, and the version of its layout.
+file_magic = b'CTWNODES'
+file_version = 2
+
+# The layout of the fixed part of the file header: the magic and version, the depth of the tree, the
+# capacity of its history, the size of the header, the capacity and number of nodes of the node columns,
+# the head of the free list, the tree size, the three eviction statistics, the number of evicted log
+# probabilities after the columns, the head, retained and total number of symbols of the history,
+# whether the node columns may have changed since the header was written (see `mark_dirty`), and the
+# age, last update and total reward of the agent whose model the tree is (see `record_agent_state`).
+header_format = str('<8sIIII') + str('q') * 14 + str('d')
+
+# The offset of the flag of a file whose node columns may have changed since its header was written.
+dirty_offset = struct.calcsize(str('<8sIIII') + str('q') * 11)
+
+# The smallest number of nodes the node columns have room for. (A power of two, so that every column
+# starts on a page boundary.)
+minimum_capacity = 1 << 12
+
+
+class MappedCTWContextTree(ctw_node_pool.PooledCTWContextTree):
+    """ A pooled context tree (see `PooledCTWContextTree`) whose node arrays are views of a memory-mapped
+        file, rather than arrays in memory.
+
+        The file starts with a page-aligned header, holding the state of the tree other than its nodes
+        (including its history), which is followed by one region per node array, each with room for
+        the same number of fixed-size entries. The regions grow, in place, by doubling when an update
+        may need more nodes than they have room for.
+
+        The operating system pages the nodes in and out of memory as they are used. The nodes near
+        the root, which every update and prediction visits, are created first, so they share the
+        first few pages of each region, which are requested up front and then stay resident, while
+        the pages of the deeper nodes are read without read-ahead.
+
+        Updates change the nodes in the file in place, while the rest of the state of the tree is only
+        written to its header when it holds real updates alone: by `flush` or `close`, or, for the model
+        of an agent, by `record_agent_state` after each real update and after each search is reverted.
+        The first update since then marks the file as dirty, so a file left part way through an update
+        or a search, by a process that died, is not reopened: the agent is recovered from its checkpoint
+        instead (see `MC_AIXI_CTW_Agent.checkpoint`). Opening a clean file reopens the tree it holds,
+        with its history, and the state of its agent.
+    """
+
+    # Instance methods.
+
+    def __init__(self, depth, history_window=None, history_log=False, max_nodes=None, path=None, hot_nodes=1 << 16):
+        """ Create (or reopen) a context tree of specified maximum depth, kept in the given file.
+            - `depth`, `history_window`, `history_log`, `max_nodes`: as for `CTWContextTree`.
+            - `path`: the file to keep the nodes in, which is reopened if it already holds a tree.
+                      (Defaults to None, for a temporary file, deleted when the tree is closed.)
+            - `hot_nodes`: the number of nodes, created first, whose pages are requested up front.
+        """
+
+        # The file holding the tree, and its memory mapping.
+        self.path = path
+        self.file = None
+        self.mapping = None
+
+        # The number of nodes whose pages are requested up front.
+        self.hot_nodes = hot_nodes
+
+        # Whether the tree was reopened from an existing file.
+        self.reopened = path is not None and os.path.exists(path) and os.path.getsize(path) > 0
+
+        # Whether the node columns may have changed since the header was written.
+        self.dirty = False
+
+        # The age, total reward and last update of the agent whose model the tree is, kept in its file.
+        self.agent_state = (0, 0.0, 0)
+
+        ctw_context_tree.CTWContextTree.__init__(self, depth, history_window=history_window,
+                                                 history_log=history_log, max_nodes=max_nodes)
+
+    # end def
+
+    def allocate_node(self):
+        """ Returns the index of a fresh node, taken from the free list if possible.
+            The node columns must have room for it. (See `reserve`.)
+        """
+
+        node = self.free_list
+
+        if node == ctw_node_pool.no_node:
+            node = self.nodes
+            self.nodes += 1
+            assert node < self.capacity, "The node columns are full."
+        else:
+            self.free_list = self.child0[node]
+        # end if
+
+        self.count0[node] = 0
+        self.count1[node] = 0
+        self.log_kt[node] = 0.0
+        self.log_probability[node] = 0.0
+        self.child0[node] = ctw_node_pool.no_node
+        self.child1[node] = ctw_node_pool.no_node
+
+        return node
+
+    # end def
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history, and empties its file.
+            (The first call, from the constructor, reopens the tree in an existing file instead.)
+        """
+
+        if self.mapping is None and self.reopened:
+            self.open()
+            return
+        # end if
+
+        self.close_mapping()
+
+        if self.file is None:
+            self.file = open(self.path, 'w+b') if self.path is not None else tempfile.TemporaryFile()
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        self.evicted_log_probability = {}
+        self.free_list = ctw_node_pool.no_node
+        self.nodes = 0
+        self.dirty = False
+
+        # Lay out an empty file, with room for the smallest number of nodes.
+        self.header_size = self.page_size(struct.calcsize(header_format) + 8 * (self.depth + 1) +
+                                          3 * self.history.capacity)
+        self.capacity = minimum_capacity
+
+        self.file.truncate(0)
+        self.file.truncate(self.columns_end())
+        self.mapping = mmap.mmap(self.file.fileno(), self.columns_end())
+        self.map_columns()
+
+        self.root = self.allocate_node()
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # Reset the context.
+        self.context = []
+
+        # Stop journaling.
+        self.journal = None
+
+        self.flush()
+
+    # end def
+
+    def close(self):
+        """ Flushes the tree to its file, and closes the file. The tree can not be used afterwards.
+        """
+
+        if self.mapping is not None:
+            self.flush()
+            self.close_mapping()
+        # end if
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        # end if
+
+    # end def
+
+    def close_mapping(self):
+        """ Releases the views of the node columns, and closes the memory mapping of the file.
+        """
+
+        if self.mapping is None:
+            return
+
+        self.release_columns()
+        self.mapping.close()
+        self.mapping = None
+
+    # end def
+
+    def column_offsets(self, capacity=None):
+        """ Returns the offset of each node column in the file, for the given (or current) capacity.
+        """
+
+        capacity = self.capacity if capacity is None else capacity
+        offsets = []
+        offset = self.header_size
+
+        for typecode in self.column_typecodes():
+            offsets.append(offset)
+            offset += array(str(typecode)).itemsize * capacity
+        # end for
+
+        return offsets
+
+    # end def
+
+    def column_typecodes(self):
+        """ Returns the array type codes of the node columns, in the order they are stored in the file:
+            `count0`, `count1`, `log_kt`, `log_probability`, `child0` and `child1`.
+        """
+
+        return [self.count_typecode, self.count_typecode, self.probability_typecode, self.probability_typecode,
+                self.index_typecode, self.index_typecode]
+
+    # end def
+
+    def columns_end(self, capacity=None):
+        """ Returns the offset of the end of the node columns in the file, for the given (or current) capacity.
+        """
+
+        capacity = self.capacity if capacity is None else capacity
+
+        return self.header_size + capacity * sum([array(str(typecode)).itemsize
+                                                  for typecode in self.column_typecodes()])
+
+    # end def
+
+    def flush(self):
+        """ Writes the state of the tree to its file, marking it clean, and flushes the file to disk.
+            The tree must hold real updates alone, not those of a search that has not been reverted.
+        """
+
+        self.dirty = False
+        self.write_header()
+        self.mapping.flush()
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Makes room for the nodes the update may create, and then samples and adds the symbols.
+            (See `PooledCTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        self.mark_dirty()
+        self.reserve(symbol_count * self.depth)
+
+        return ctw_node_pool.PooledCTWContextTree.generate_random_symbols_and_update(self, symbol_count, thresholds)
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, copied into the node columns
+            of the file. (See `CTWContextTree.load_nodes`.)
+        """
+
+        node_count = len(columns[0])
+        self.mark_dirty()
+        self.nodes = 0
+        self.reserve(node_count)
+
+        for column, values in zip((self.count0, self.count1, self.log_kt, self.log_probability,
+                                   self.child0, self.child1), columns):
+            column[:node_count] = array(str(column.format), values)
+        # end for
+
+        self.nodes = node_count
+        self.free_list = ctw_node_pool.no_node
+        self.evicted_log_probability = dict(evicted_log_probability)
+
+        self.root = 0
+        self.tree_size = node_count
+        self.depth_sizes = list(depth_sizes)
+
+        self.dirty = False
+        self.write_header()
+
+    # end def
+
+    def map_columns(self):
+        """ Creates the views of the node columns in the memory mapping, and advises the operating
+            system of how their pages are used.
+        """
+
+        self.view = memoryview(self.mapping)
+
+        columns = []
+
+        for typecode, offset in zip(self.column_typecodes(), self.column_offsets()):
+            size = array(str(typecode)).itemsize * self.capacity
+            columns.append(self.view[offset:offset + size].cast(str(typecode)))
+        # end for
+
+        self.count0, self.count1, self.log_kt, self.log_probability, self.child0, self.child1 = columns
+
+        # Read the pages of deep nodes without read-ahead, but request those of the hot nodes up front.
+        if hasattr(self.mapping, 'madvise'):
+            self.mapping.madvise(mmap.MADV_RANDOM)
+
+            for column, offset in zip(columns, self.column_offsets()):
+                self.mapping.madvise(mmap.MADV_WILLNEED, offset, column.itemsize * min(self.hot_nodes, self.capacity))
+        # end if
+
+    # end def
+
+    def mark_dirty(self):
+        """ Marks the file as dirty, before the first update since its header was written changes the
+            node columns, so that it is not reopened until the header is written again.
+        """
+
+        if not self.dirty:
+            self.dirty = True
+            struct.pack_into(str('<q'), self.mapping, dirty_offset, 1)
+        # end if
+
+    # end def
+
+    def open(self):
+        """ Reopens the tree held in the file at `path`, with its history and the state of its agent.
+            The file must be clean. (See `mark_dirty`.)
+        """
+
+        self.file = open(self.path, 'r+b')
+        self.mapping = mmap.mmap(self.file.fileno(), 0)
+
+        fields = struct.unpack_from(header_format, self.mapping, 0)
+
+        assert fields[0] == file_magic and fields[1] == file_version, \
+            "The file '%s' does not hold a context tree of this version." % self.path
+        assert fields[2] == self.depth, "The file holds a context tree of a different depth."
+
+        (history_capacity, self.header_size, self.capacity, self.nodes, self.free_list, self.tree_size,
+         self.evictions, self.evicted_subtrees, self.evicted_nodes, evicted_count,
+         head, retained, size, dirty, age, last_update, total_reward) = fields[3:]
+
+        assert not dirty, "The file '%s' was left part way through an update or a search, so its nodes do not " \
+                          "match the rest of its tree: recover the model from a checkpoint instead." % self.path
+
+        self.agent_state = (age, total_reward, last_update)
+
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+        assert history_capacity == self.history.capacity, "The file holds a history of a different capacity."
+
+        offset = struct.calcsize(header_format)
+        self.depth_sizes = list(array(str('q'), self.mapping[offset:offset + 8 * (self.depth + 1)]))
+        offset += 8 * (self.depth + 1)
+
+        self.history.buffer[:] = self.mapping[offset:offset + 2 * history_capacity]
+        offset += 2 * history_capacity
+        self.history.context_only[:] = self.mapping[offset:offset + history_capacity]
+        self.history.head, self.history.retained, self.history.size = head, retained, size
+
+        # Read the evicted log probabilities that follow the node columns.
+        offset = self.columns_end()
+        nodes = array(str('q'), self.mapping[offset:offset + 8 * evicted_count])
+        offset += 8 * evicted_count
+        self.evicted_log_probability = dict(zip(nodes, array(str('d'), self.mapping[offset:offset + 8 * evicted_count])))
+
+        self.map_columns()
+
+        self.root = 0
+        self.context = []
+        self.journal = None
+
+    # end def
+
+    def page_size(self, size):
+        """ Returns the given size, rounded up to a whole number of pages.
+        """
+
+        return -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    # end def
+
+    def record_agent_state(self, age, total_reward, last_update):
+        """ Keeps the age, total reward and last update of the agent whose model the tree is, and writes
+            them to the file with the state of the tree, marking it clean, so that both can be reopened
+            as they are now. The tree must hold real updates alone, as after a real update, or once the
+            updates of a search have been reverted.
+        """
+
+        self.agent_state = (age, total_reward, last_update)
+        self.dirty = False
+        self.write_header()
+
+    # end def
+
+    def release_columns(self):
+        """ Releases the views of the node columns, so that the memory mapping can be resized or closed.
+        """
+
+        for column in (self.count0, self.count1, self.log_kt, self.log_probability, self.child0, self.child1):
+            column.release()
+
+        self.view.release()
+
+    # end def
+
+    def reserve(self, node_count):
+        """ Makes room in the node columns for at least `node_count` more nodes than have been created,
+            doubling their capacity as often as needed.
+
+            The views of the node columns are replaced, so no method may be part way through using them.
+        """
+
+        if self.nodes + node_count <= self.capacity:
+            return
+
+        capacity = self.capacity
+
+        while self.nodes + node_count > capacity:
+            capacity *= 2
+
+        # Grow the file, and move each column to its new offset, from the last column to the first.
+        self.release_columns()
+        self.mapping.resize(self.columns_end(capacity))
+
+        for typecode, old_offset, new_offset in reversed(list(zip(self.column_typecodes(), self.column_offsets(),
+                                                                  self.column_offsets(capacity)))):
+            self.mapping.move(new_offset, old_offset, array(str(typecode)).itemsize * self.nodes)
+        # end for
+
+        self.capacity = capacity
+        self.map_columns()
+        self.write_header()
+
+    # end def
+
+    def snapshot(self):
+        """ Returns an independent copy of the context tree, held in memory, as a `PooledCTWContextTree`.
+            (See `CTWContextTree.snapshot`.)
+        """
+
+        tree = ctw_node_pool.PooledCTWContextTree(self.depth, history_window=self.history_window,
+                                                  max_nodes=self.max_nodes)
+
+        for name in ('count0', 'count1', 'log_kt', 'log_probability', 'child0', 'child1'):
+            column = getattr(self, name)
+            setattr(tree, name, array(str(column.format), column[:self.nodes]))
+        # end for
+
+        tree.history = self.history.copy()
+        tree.evicted_log_probability = dict(self.evicted_log_probability)
+        tree.free_list = self.free_list
+        tree.tree_size = self.tree_size
+        tree.depth_sizes = list(self.depth_sizes)
+        tree.evictions, tree.evicted_subtrees, tree.evicted_nodes = \
+            self.evictions, self.evicted_subtrees, self.evicted_nodes
+
+        return tree
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Makes room for the nodes the update may create, and then updates the tree with the symbols.
+            (See `PooledCTWContextTree.update`.)
+        """
+
+        self.mark_dirty()
+        self.reserve(len(symbol_list) * self.depth)
+
+        ctw_node_pool.PooledCTWContextTree.update(self, symbol_list)
+
+    # end def
+
+    def write_header(self):
+        """ Writes the state of the tree other than its nodes (its header, history, the number of nodes
+            at each depth, the evicted log probabilities, and the state of its agent) to the file, growing
+            or shrinking the file to fit the evicted log probabilities after the node columns.
+        """
+
+        evicted_count = len(self.evicted_log_probability)
+        size = self.columns_end() + 16 * evicted_count
+
+        if len(self.mapping) != size:
+            self.release_columns()
+            self.mapping.resize(size)
+            self.map_columns()
+        # end if
+
+        history = self.history
+        age, total_reward, last_update = self.agent_state
+
+        struct.pack_into(header_format, self.mapping, 0, file_magic, file_version, self.depth, history.capacity,
+                         self.header_size, self.capacity, self.nodes, self.free_list, self.tree_size,
+                         self.evictions, self.evicted_subtrees, self.evicted_nodes, evicted_count,
+                         history.head, history.retained, history.size, int(self.dirty), age, last_update,
+                         total_reward)
+
+        offset = struct.calcsize(header_format)
+        state = array(str('q'), self.depth_sizes).tobytes() + bytes(history.buffer) + bytes(history.context_only)
+        self.mapping[offset:offset + len(state)] = state
+
+        offset = self.columns_end()
+        evicted = sorted(self.evicted_log_probability.items())
+        self.mapping[offset:size] = array(str('q'), [node for node, value in evicted]).tobytes() + \
+                                    array(str('d'), [value for node, value in evicted]).tobytes()
+
+    # end def
+# end class
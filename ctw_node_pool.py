@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a context tree that keeps its nodes in a pool of parallel typed arrays.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+from array import array
+
+import ctw_context_tree
+from ctw_numeric import log_half, log_kt_estimate, weighted_log_probability
+
+# The index used to mark a missing child, or the end of the free list.
+no_node = -1
+
+
+class PooledCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A context tree that stores its nodes in a struct-of-arrays pool instead of
+        allocating a `CTWContextTreeNode` object per node.
+
+        Node `i` of the tree is described by the `i`-th entry of each of the parallel arrays:
+
+         - `count0`, `count1`: the number of zeros and ones seen in the node's context.
+         - `log_kt`: the cached KT estimate of the block log probability for the node.
+         - `log_probability`: the cached weighted log probability for the node.
+         - `child0`, `child1`: the indices of the node's children, or `no_node`.
+
+        Node 0 is always the root. Nodes released by `revert` are threaded onto a free list
+        (linked through `child0`) and reused by later updates before the arrays grow.
+        The few nodes that children have been evicted from keep their evicted log probability
+        in the `evicted_log_probability` dictionary instead of an array.
+
+        The tree offers the same interface as `CTWContextTree`, but `context` holds node
+        indices rather than node objects.
+    """
+
+    # The array type codes used for the symbol counts, log probabilities and child indices.
+    count_typecode = 'I'
+    probability_typecode = 'd'
+    index_typecode = 'i'
+
+    # Instance methods.
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # Empty the node pool, and allocate a new root node.
+        self.count0 = array(self.count_typecode)
+        self.count1 = array(self.count_typecode)
+        self.log_kt = array(self.probability_typecode)
+        self.log_probability = array(self.probability_typecode)
+        self.child0 = array(self.index_typecode)
+        self.child1 = array(self.index_typecode)
+        self.free_list = no_node
+
+        # The evicted log probabilities of the nodes that children have been evicted from, by node.
+        # (See `CTWContextTree.collapse_node`.)
+        self.evicted_log_probability = {}
+
+        self.root = self.allocate_node()
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # Reset the context.
+        self.context = []
+
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def allocate_node(self):
+        """ Returns the index of a fresh node, taken from the free list if possible.
+        """
+
+        node = self.free_list
+
+        if node == no_node:
+            # Grow each of the arrays by one entry.
+            node = len(self.count0)
+            self.count0.append(0)
+            self.count1.append(0)
+            self.log_kt.append(0.0)
+            self.log_probability.append(0.0)
+            self.child0.append(no_node)
+            self.child1.append(no_node)
+        else:
+            # Reuse a released node.
+            self.free_list = self.child0[node]
+            self.count0[node] = 0
+            self.count1[node] = 0
+            self.log_kt[node] = 0.0
+            self.log_probability[node] = 0.0
+            self.child0[node] = no_node
+            self.child1[node] = no_node
+        # end if
+
+        return node
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns the number of bytes each node takes in the arrays of the pool.
+        """
+
+        return sum([column.itemsize for column in (self.count0, self.count1, self.log_kt, self.log_probability,
+                                                   self.child0, self.child1)])
+
+    # end def
+
+    def release_node(self, node):
+        """ Returns the given node, and all of its descendants, to the free list.
+            Returns the number of nodes released.
+        """
+
+        released = 1
+
+        for children in (self.child0, self.child1):
+            child = children[node]
+            if child != no_node:
+                released += self.release_node(child)
+        # end for
+
+        self.child0[node] = self.free_list
+        self.child1[node] = no_node
+        self.free_list = node
+
+        return released
+
+    # end def
+
+    def delete_children(self, node, descendants):
+        """ Removes the children of the given node from the tree, returning its descendants to the free list.
+            (See `CTWContextTree.delete_children`.)
+        """
+
+        evicted_log_probability = self.evicted_log_probability
+        evicted_log_probability[node] = self.child_log_probability_sum(node)
+
+        self.child0[node] = self.child1[node] = no_node
+
+        for descendant in descendants:
+            self.child0[descendant] = self.free_list
+            self.child1[descendant] = no_node
+            self.free_list = descendant
+
+            evicted_log_probability.pop(descendant, None)
+        # end for
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to
+            the context tree statistics and update the context tree with the newly
+            generated symbols. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        count0, count1 = self.count0, self.count1
+        log_kt, log_probability = self.log_kt, self.log_probability
+        child0, child1 = self.child0, self.child1
+        evicted_log_probability = self.evicted_log_probability
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Find (or create) the nodes of the current context.
+            tree_size = self.tree_size
+            self.update_context()
+            context = self.context
+
+            # From the leaf to the root, compute the log KT estimate and weighted log probability
+            # each context node would have after seeing a zero.
+            zero_updates = []
+            child_log_probability = 0.0
+
+            for depth in range(len(context) - 1, -1, -1):
+                node = context[depth]
+                kt = log_kt_estimate(count0[node] + 1, count1[node])
+
+                zero, one = child0[node], child1[node]
+                evicted = evicted_log_probability.get(node) if evicted_log_probability else None
+
+                if zero == no_node and one == no_node and evicted is None:
+                    child_log_probability = kt
+                else:
+                    path_child = context[depth + 1] if depth + 1 < len(context) else no_node
+                    child_sum = 0.0
+                    for child in (zero, one):
+                        if child != no_node:
+                            child_sum += child_log_probability if child == path_child else log_probability[child]
+                    if evicted is not None:
+                        child_sum += evicted
+                    child_log_probability = weighted_log_probability(kt, child_sum)
+                # end if
+
+                zero_updates.append((kt, child_log_probability))
+            # end for
+
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(child_log_probability - log_probability[self.root])
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            # Commit the chosen symbol to the context nodes.
+            if symbol == 0:
+                for node, (kt, node_log_probability) in zip(reversed(context), zero_updates):
+                    log_kt[node] = kt
+                    log_probability[node] = node_log_probability
+                    count0[node] += 1
+                # end for
+            else:
+                self.update_context_nodes(symbol)
+            # end if
+
+            symbol_list.append(symbol)
+            self.history.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def journal_record(self, symbol, created):
+        """ Returns an undo journal record of the current context, before it is updated with the given symbol.
+            (See `CTWContextTree.journal_record`.)
+        """
+
+        log_kt, log_probability = self.log_kt, self.log_probability
+
+        return symbol, self.context, [(log_kt[node], log_probability[node]) for node in self.context], created
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, which become the arrays of
+            the pool. (See `CTWContextTree.load_nodes`.)
+        """
+
+        typecodes = [self.count_typecode, self.count_typecode, self.probability_typecode, self.probability_typecode,
+                     self.index_typecode, self.index_typecode]
+
+        (self.count0, self.count1, self.log_kt, self.log_probability, self.child0, self.child1) = \
+            [column if column.typecode == typecode else array(typecode, column)
+             for column, typecode in zip(columns, typecodes)]
+
+        self.free_list = no_node
+        self.evicted_log_probability = dict(evicted_log_probability)
+
+        self.root = 0
+        self.tree_size = len(self.count0)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing context path
+            once without changing or allocating any node. (See `CTWContextTree.log_predict_symbol`.)
+        """
+
+        count0, count1 = self.count0, self.count1
+        log_probability = self.log_probability
+        child0, child1 = self.child0, self.child1
+
+        # Collect the existing nodes on the context path.
+        context = self.history.recent(self.depth)
+        path = [self.root]
+        node = self.root
+
+        for context_symbol in context:
+            node = (child1 if context_symbol else child0)[node]
+            if node == no_node:
+                break
+            path.append(node)
+        # end for
+
+        # The updated weighted log probability of the child on the path below the current node.
+        # A missing child, and every node below it, is a fresh node that has seen one symbol.
+        child_log_probability = log_half if len(path) <= len(context) else None
+
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            kt = log_kt_estimate(count0[node] + 1 - symbol, count1[node] + symbol)
+
+            if child_log_probability is None:
+                # The deepest node of a full context path.
+                child_log_probability = self.node_log_probability(node, kt)
+            else:
+                sibling = (child0 if context[depth] else child1)[node]
+                child_sum = child_log_probability
+                if sibling != no_node:
+                    child_sum += log_probability[sibling]
+                if self.evicted_log_probability and node in self.evicted_log_probability:
+                    child_sum += self.evicted_log_probability[node]
+                child_log_probability = weighted_log_probability(kt, child_sum)
+            # end if
+        # end for
+
+        return child_log_probability - log_probability[self.root]
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given node.
+        """
+
+        return [(symbol, child) for symbol, child in ((0, self.child0[node]), (1, self.child1[node]))
+                if child != no_node]
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability of the given node.
+        """
+
+        return [self.count0[node], self.count1[node], self.log_kt[node], self.log_probability[node],
+                self.evicted_log_probability.get(node)]
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the context tree to its state prior to a specified number of updates.
+
+            - `symbol_count`: the number of updates (symbols) to revert. (Default of 1.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        count0, count1 = self.count0, self.count1
+        log_kt, log_probability = self.log_kt, self.log_probability
+        child0, child1 = self.child0, self.child1
+
+        for i in range(symbol_count):
+            if self.journal:
+                self.undo_journal_record()
+                continue
+            # end if
+
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
+
+            self.update_context()
+            context = self.context
+
+            counts = count1 if symbol else count0
+
+            for depth in range(len(context) - 1, -1, -1):
+                node = context[depth]
+
+                assert counts[node] > 0, "Symbol count should be non-negative"
+                counts[node] -= 1
+
+                log_kt[node] = log_kt_estimate(count0[node], count1[node])
+
+                # Release any children that are no longer visited. Nodes are reverted from the leaf up,
+                # so an unvisited child has already released its own children, and is a leaf.
+                for children in (child0, child1):
+                    child = children[node]
+                    if child != no_node and count0[child] + count1[child] == 0:
+                        self.tree_size -= self.release_node(child)
+                        self.depth_sizes[depth + 1] -= 1
+                        children[node] = no_node
+                # end for
+
+                log_probability[node] = self.node_log_probability(node)
+            # end for
+        # end for
+
+    # end def
+
+    def undo_journal_record(self):
+        """ Restores the context tree to its state prior to the last update recorded in the journal.
+            (See `CTWContextTree.undo_journal_record`.)
+        """
+
+        symbol, context, values, created = self.journal.pop()
+
+        self.history.pop()
+
+        counts = self.count1 if symbol else self.count0
+        log_kt, log_probability = self.log_kt, self.log_probability
+
+        for node, (kt, node_log_probability) in zip(context, values):
+            counts[node] -= 1
+            log_kt[node] = kt
+            log_probability[node] = node_log_probability
+        # end for
+
+        if created:
+            self.release_created_nodes(context, created)
+
+    # end def
+
+    def release_created_nodes(self, context, created):
+        """ Releases the (now unvisited) nodes that were created for the given context by an update
+            that has been undone.
+            - `context`: the nodes of the context, from the root down.
+            - `created`: the number of nodes created, which are always the deepest nodes of the context.
+        """
+
+        parent, child = context[-created - 1], context[-created]
+        if self.child0[parent] == child:
+            self.child0[parent] = no_node
+        else:
+            self.child1[parent] = no_node
+
+        self.tree_size -= self.release_node(child)
+        for depth in range(len(context) - created, len(context)):
+            self.depth_sizes[depth] -= 1
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Updates the context tree with a new (binary) symbol, or a list of symbols.
+            (See `CTWContextTree.update`.)
+        """
+
+        for symbol in symbol_list:
+            tree_size = self.tree_size
+            self.update_context()
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, self.tree_size - tree_size))
+
+            self.update_context_nodes(symbol)
+            self.history.append(symbol)
+        # end for
+
+    # end def
+
+    def update_context_nodes(self, symbol):
+        """ Updates the nodes of the current context (see `update_context`) after having observed
+            a new symbol, from the leaf to the root.
+        """
+
+        count0, count1 = self.count0, self.count1
+        log_kt, log_probability = self.log_kt, self.log_probability
+        child0, child1 = self.child0, self.child1
+        counts = count1 if symbol else count0
+
+        evicted_log_probability = self.evicted_log_probability
+
+        for node in reversed(self.context):
+            counts[node] += 1
+
+            kt = log_kt_estimate(count0[node], count1[node])
+            log_kt[node] = kt
+
+            zero, one = child0[node], child1[node]
+            if evicted_log_probability and node in evicted_log_probability:
+                log_probability[node] = self.node_log_probability(node, kt)
+            elif zero == no_node and one == no_node:
+                log_probability[node] = kt
+            else:
+                child_sum = (0.0 if zero == no_node else log_probability[zero]) + \
+                            (0.0 if one == no_node else log_probability[one])
+                log_probability[node] = weighted_log_probability(kt, child_sum)
+            # end if
+        # end for
+
+    # end def
+
+    def update_context(self):
+        """ Calculates which nodes in the context tree correspond to the current
+            context, and adds their indices to `context` in order from root to leaf.
+            Creates the nodes if they do not exist.
+        """
+
+        context = [self.root]
+        parent = self.root
+        child0, child1 = self.child0, self.child1
+
+        for symbol in self.history.recent(self.depth):
+            children = child1 if symbol else child0
+            child = children[parent]
+
+            if child == no_node:
+                child = self.allocate_node()
+                children[parent] = child
+
+                self.tree_size += 1
+                self.depth_sizes[len(context)] += 1
+            # end if
+
+            parent = child
+            context.append(parent)
+        # end for
+
+        self.context = context
+
+    # end def
+
+    def child_log_probability_sum(self, node):
+        """ Returns the sum of the weighted log probabilities of the children of the given node,
+            including those evicted from it, or None if the node is a leaf.
+        """
+
+        zero, one = self.child0[node], self.child1[node]
+        evicted_log_probability = self.evicted_log_probability.get(node) if self.evicted_log_probability else None
+
+        if zero == no_node and one == no_node:
+            return evicted_log_probability
+
+        child_sum = (0.0 if zero == no_node else self.log_probability[zero]) + \
+                    (0.0 if one == no_node else self.log_probability[one])
+
+        if evicted_log_probability is not None:
+            child_sum += evicted_log_probability
+
+        return child_sum
+
+    # end def
+
+    def node_log_probability(self, node, log_kt=None):
+        """ Returns the weighted log probability of the given node, computed from its KT estimate
+            (or the given `log_kt`) and the weighted probabilities of its children.
+        """
+
+        kt = self.log_kt[node] if log_kt is None else log_kt
+        child_sum = self.child_log_probability_sum(node)
+
+        return kt if child_sum is None else weighted_log_probability(kt, child_sum)
+
+    # end def
+
+    def show(self, node=None):
+        """ Returns a string representation of the tree, in the same format as `CTWContextTree.show`.
+        """
+
+        if node is None:
+            node = self.root
+
+        symbols = '0:' + str(self.count0[node]) + '  1:' + str(self.count1[node])
+        children = ""
+
+        for symbol, child in ((0, self.child0[node]), (1, self.child1[node])):
+            if child != no_node:
+                children += str(symbol) + self.show(child) + ','
+
+        return '{' + symbols + '||' + children + '}'
+
+    # end def
+# end class
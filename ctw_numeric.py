@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define the numeric kernel used by the context trees: KT estimates and log-domain addition.
+
+The KT estimate of the block probability of `a` zeros and `b` ones is
+
+  Pr_kt(0^a 1^b) = Gamma(a + 1/2) Gamma(b + 1/2) / (pi Gamma(a + b + 1))
+
+so its logarithm can be computed directly from the symbol counts of a node, rather than by
+accumulating the conditional multipliers `log((c + 1/2)/(n + 1))` over every update and revert.
+Both are tabulated for small counts, which covers the great majority of nodes in a tree, while
+the log KT estimate falls back to the log gamma function itself for larger counts.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+from array import array
+
+# Ensure xrange is defined on Python 3.
+from six.moves import xrange
+
+# The value ln(0.5).
+# This value is used often in computations and so is made a constant for efficiency reasons.
+log_half = math.log(0.5)
+
+# The value ln(pi), computed as 2 ln(Gamma(1/2)) so that the log KT estimate of no symbols is exactly zero.
+log_pi = 2 * math.lgamma(0.5)
+
+# Symbol counts below this value have their log KT estimates looked up in a precomputed table.
+table_size = 128
+
+# Symbol counts below this value have their log KT estimates assembled from precomputed log gamma values.
+log_gamma_table_size = 1 << 12
+
+# The number of visits below which the log KT multipliers are looked up in a precomputed table.
+multiplier_table_size = 256
+
+# Differences of logarithms below this value are too small to change their log-domain sum.
+log_add_cutoff = math.log(2.0 ** -64)
+
+
+def closed_form_log_kt(zeros, ones):
+    """ Returns the log KT estimate of the block probability of `zeros` zeros and `ones` ones,
+        computed from the log gamma function.
+    """
+
+    return math.lgamma(zeros + 0.5) + math.lgamma(ones + 0.5) - math.lgamma(zeros + ones + 1) - log_pi
+
+# end def
+
+
+# The log KT estimate of the block probability, indexed by the number of zeros, then of ones.
+log_kt_table = [array('d', [closed_form_log_kt(zeros, ones) for ones in xrange(table_size)])
+                for zeros in xrange(table_size)]
+
+# The values ln(Gamma(n + 1/2)) and ln(Gamma(n + 1)), indexed by `n`, from which the log KT estimate
+# of moderate symbol counts is assembled.
+log_gamma_half_table = array('d', [math.lgamma(n + 0.5) for n in xrange(log_gamma_table_size)])
+log_gamma_table = array('d', [math.lgamma(n + 1) for n in xrange(2 * log_gamma_table_size)])
+
+# The log KT estimate of the conditional probability of a symbol, `log((c + 1/2)/(n + 1))`,
+# indexed by the number of visits `n`, then the count `c` of the symbol.
+log_kt_multiplier_table = [[math.log((count + 0.5) / (visits + 1)) for count in xrange(visits + 1)]
+                           for visits in xrange(multiplier_table_size)]
+
+
+def log_kt_estimate(zeros, ones):
+    """ Returns the log KT estimate of the block probability of `zeros` zeros and `ones` ones.
+    """
+
+    if zeros < table_size and ones < table_size:
+        return log_kt_table[zeros][ones]
+
+    if zeros < log_gamma_table_size and ones < log_gamma_table_size:
+        return log_gamma_half_table[zeros] + log_gamma_half_table[ones] - log_gamma_table[zeros + ones] - log_pi
+
+    return closed_form_log_kt(zeros, ones)
+
+# end def
+
+
+def log_kt_multiplier(count, visits):
+    """ Returns the log KT estimate of the conditional probability of a symbol, given that
+        `count` of the `visits` symbols seen so far were that symbol.
+    """
+
+    if visits < multiplier_table_size:
+        return log_kt_multiplier_table[visits][count]
+
+    return math.log((count + 0.5) / (visits + 1))
+
+# end def
+
+
+def log_add(x, y):
+    """ Returns `log(exp(x) + exp(y))`, without leaving the log domain.
+    """
+
+    if x < y:
+        x, y = y, x
+
+    difference = y - x
+
+    if difference < log_add_cutoff:
+        return x
+
+    return x + math.log1p(math.exp(difference))
+
+# end def
+
+
+def weighted_log_probability(log_kt, child_sum):
+    """ Returns the log of the CTW mixture `(Pr_kt + Pr_children) / 2` of a node, given the log KT
+        estimate `log_kt` of the node and the sum `child_sum` of its children's weighted log probabilities.
+    """
+
+    if child_sum <= log_kt:
+        difference = child_sum - log_kt
+        high = log_kt
+    else:
+        difference = log_kt - child_sum
+        high = child_sum
+    # end if
+
+    if difference < log_add_cutoff:
+        return log_half + high
+
+    return log_half + high + math.log1p(math.exp(difference))
+
+# end def
+
+
+def chain_log_probability(log_kt, bottom_log_probability, length):
+    """ Returns the weighted log probability of the top node of a chain of `length` nodes, each but the
+        last having the next as its only child, that have all seen the same symbols, and so share the
+        log KT estimate `log_kt`. The bottom node of the chain has the weighted log probability
+        `bottom_log_probability`.
+
+        Each node of the chain mixes its KT estimate with that of the node below with a weight of one
+        half, so the weighted probability of the top node is
+
+          (1 - 2^-(length - 1)) Pr_kt + 2^-(length - 1) Pr_bottom
+    """
+
+    if length == 1:
+        return bottom_log_probability
+
+    steps = length - 1
+
+    return log_add(log_kt + math.log1p(-0.5 ** steps), bottom_log_probability + steps * log_half)
+
+# end def
@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a path-compressed context tree, which stores each unary chain of context tree nodes as one node.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+
+import ctw_context_tree
+from ctw_numeric import chain_log_probability, log_half, log_kt_estimate, weighted_log_probability
+
+# The index of a missing child in the columns of saved nodes. (See `CTWContextTree.load_nodes`.)
+no_node = -1
+
+
+class CTWChainNode:
+    """ A chain of context tree nodes that have all seen the same symbols, each but the last having
+        the next as its only child, stored as a single node.
+
+        The chain starts at depth `depth` of the (uncompressed) context tree, and is `length` nodes
+        long. `labels` holds the context symbols leading from each node of the chain to the next,
+        and `children` holds the children of the last node of the chain.
+    """
+
+    # The sum of the weighted log probabilities that the children evicted from the last node of a
+    # chain assigned to the symbols seen before they were evicted, or None if there are none.
+    # (See `CTWContextTree.collapse_node`.)
+    evicted_log_probability = None
+
+    def __init__(self, depth, length=1, labels=b''):
+        """ Construct a chain of `length` unvisited nodes, starting at the given depth, linked by
+            the given context symbols.
+        """
+
+        # The depth of the first node of the chain.
+        self.depth = depth
+
+        # The number of nodes in the chain.
+        self.length = length
+
+        # The context symbols linking the nodes of the chain, one fewer than there are nodes.
+        self.labels = labels
+
+        # The children of the last node of the chain.
+        self.children = {}
+
+        # The KT estimate of the block log probability shared by the nodes of the chain.
+        self.log_kt = 0.0
+
+        # The weighted log probability of the first node of the chain.
+        self.log_probability = 0.0
+
+        # The count of the symbols in the history subsequence relevant to the nodes of the chain.
+        self.symbol_count = [0, 0]
+
+    # end def
+
+    def bottom_log_probability(self, log_kt=None):
+        """ Returns the weighted log probability of the last node of the chain, computed from the
+            chain's KT estimate (or the given `log_kt`) and the weighted probabilities of its children.
+        """
+
+        kt = self.log_kt if log_kt is None else log_kt
+
+        if not self.children and self.evicted_log_probability is None:
+            return kt
+
+        child_sum = sum([child.log_probability for child in self.children.values()])
+
+        if self.evicted_log_probability is not None:
+            child_sum += self.evicted_log_probability
+
+        return weighted_log_probability(kt, child_sum)
+
+    # end def
+
+    def update_log_probability(self):
+        """ Recomputes the KT estimate and weighted log probability of the chain from its symbol counts
+            and children.
+        """
+
+        self.log_kt = log_kt_estimate(self.symbol_count[0], self.symbol_count[1])
+        self.log_probability = chain_log_probability(self.log_kt, self.bottom_log_probability(), self.length)
+
+    # end def
+
+    def visits(self):
+        """ Returns the number of times the contexts of the chain have been visited.
+        """
+
+        return self.symbol_count[0] + self.symbol_count[1]
+
+    # end def
+# end class
+
+
+class PatriciaCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A context tree that stores every unary chain of nodes with identical symbol counts as a single
+        `CTWChainNode`, in the manner of a PATRICIA trie.
+
+        The weighted probability of a chain follows in closed form from its shared KT estimate and the
+        weighted probability of its last node (see `chain_log_probability`), so a new context adds
+        one node however deep the tree is, and each update or revert touches one node per branching
+        context on the path rather than one per level. Chains are split lazily where a new context
+        diverges from them, and merged again when reverting removes the branch.
+
+        The tree offers the same interface, and the same predictions, as `CTWContextTree`, but its
+        nodes are chains: `size` and `size_by_depth` count the chains, by the depth they start at.
+        The undo journal is not supported, as splitting and merging chains would have to be undone
+        too, so simulated updates are always reverted by recomputing them.
+    """
+
+    # Instance methods.
+
+    def begin_journal(self):
+        """ Does nothing, as the tree does not keep an undo journal. (See `CTWContextTree.begin_journal`.)
+        """
+
+        return 0
+
+    # end def
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # Set a new root chain, and reset the tree size.
+        self.root = CTWChainNode(0)
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # Reset the context.
+        self.context = []
+
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def collapse_node(self, node, depth):
+        """ Deletes every descendant of the given chain. (See `CTWContextTree.collapse_node`.)
+        """
+
+        removed = 0
+        stack = list(node.children.values())
+
+        while stack:
+            descendant = stack.pop()
+            self.depth_sizes[descendant.depth] -= 1
+            removed += 1
+
+            stack.extend(descendant.children.values())
+        # end while
+
+        child_sum = sum([child.log_probability for child in node.children.values()])
+
+        if node.evicted_log_probability is not None:
+            child_sum += node.evicted_log_probability
+
+        node.evicted_log_probability = child_sum
+        node.children = {}
+        self.tree_size -= removed
+
+        return removed
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to
+            the context tree statistics and update the context tree with the newly
+            generated symbols. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(self.log_predict_symbol(0))
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            self.update([symbol])
+            symbol_list.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with chains of the given nodes, merging each node
+            with its only child if they have seen the same symbols, as `revert` merges them.
+            (See `CTWContextTree.load_nodes`.)
+        """
+
+        count0, count1, log_kt, log_probability, child0, child1 = columns
+
+        # The chain that each node was added to. The nodes are numbered breadth first, so a node's
+        # chain is known before it is visited, and the node is then the last node of the chain.
+        node_chains = [None] * len(count0)
+        node_chains[0] = self.root = CTWChainNode(0)
+        self.root.symbol_count = [count0[0], count1[0]]
+
+        chains = [self.root]
+
+        for node in range(len(count0)):
+            chain = node_chains[node]
+            bottom = chain.depth + chain.length - 1
+            children = [(symbol, child) for symbol, child in ((0, child0[node]), (1, child1[node])) if child != no_node]
+            evicted = evicted_log_probability.get(node)
+
+            if evicted is not None:
+                chain.evicted_log_probability = evicted
+
+            if len(children) == 1 and evicted is None and \
+                    (count0[children[0][1]], count1[children[0][1]]) == (count0[node], count1[node]):
+                # Extend the chain with the child.
+                symbol, child = children[0]
+                chain.labels = chain.labels + bytes(bytearray([symbol]))
+                chain.length += 1
+                node_chains[child] = chain
+                continue
+            # end if
+
+            for symbol, child in children:
+                child_chain = CTWChainNode(bottom + 1)
+                child_chain.symbol_count = [count0[child], count1[child]]
+                chain.children[symbol] = child_chain
+                node_chains[child] = child_chain
+                chains.append(child_chain)
+            # end for
+        # end for
+
+        # Compute the log probabilities of the chains from the deepest up.
+        for chain in reversed(chains):
+            chain.update_log_probability()
+
+        self.tree_size = len(chains)
+        self.depth_sizes = [0] * (self.depth + 1)
+
+        for chain in chains:
+            self.depth_sizes[chain.depth] += 1
+
+    # end def
+
+    def log_predict(self, symbol_list):
+        """ Returns the log of `rho(symbol_list | h)`, by temporarily adding the symbols to the tree.
+            The tree is left unchanged. (See `CTWContextTree.log_predict`.)
+        """
+
+        if len(symbol_list) == 1:
+            return self.log_predict_symbol(symbol_list[0])
+
+        root_log_probability = self.root.log_probability
+
+        self.update(symbol_list)
+        log_probability = self.root.log_probability - root_log_probability
+        self.revert(len(symbol_list))
+
+        return log_probability
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing chains of the
+            context path once without changing, splitting or adding any of them.
+            (See `CTWContextTree.log_predict_symbol`.)
+        """
+
+        context = self.history.recent(self.depth)
+
+        # Collect the chains on the context path, with the number of nodes of each that the context
+        # passes through, and whether the context leaves the last chain for a new branch.
+        path = []
+        node = self.root
+        branch = False
+
+        while True:
+            keep = self.matching_length(node, context)
+
+            if keep < node.length:
+                # The context ends, or diverges, part way along the chain.
+                branch = node.depth + keep - 1 < len(context)
+                path.append((node, keep))
+                break
+            # end if
+
+            path.append((node, keep))
+
+            bottom = node.depth + node.length - 1
+            if bottom == len(context):
+                break
+
+            child = node.children.get(context[bottom])
+            if child is None:
+                branch = True
+                break
+
+            node = child
+        # end while
+
+        # From the last chain up, compute the updated weighted log probability of each.
+        # A new branch is a fresh chain that has seen one symbol.
+        child_log_probability = log_half if branch else None
+
+        for index in range(len(path) - 1, -1, -1):
+            node, keep = path[index]
+            counts = node.symbol_count
+            kt = log_kt_estimate(counts[0] + 1 - symbol, counts[1] + symbol)
+
+            if keep < node.length:
+                # The unchanged lower part of a chain that would be split.
+                child_sum = chain_log_probability(node.log_kt, node.bottom_log_probability(), node.length - keep)
+            else:
+                # The children of the chain, other than the one on the path.
+                child_sum = None
+
+                for child in node.children.values():
+                    if index + 1 < len(path) and child is path[index + 1][0]:
+                        continue
+                    child_sum = child.log_probability if child_sum is None else child_sum + child.log_probability
+                # end for
+
+                if node.evicted_log_probability is not None:
+                    child_sum = node.evicted_log_probability if child_sum is None else \
+                        child_sum + node.evicted_log_probability
+            # end if
+
+            if child_log_probability is not None:
+                child_sum = child_log_probability if child_sum is None else child_sum + child_log_probability
+
+            bottom_log_probability = kt if child_sum is None else weighted_log_probability(kt, child_sum)
+            child_log_probability = chain_log_probability(kt, bottom_log_probability, keep)
+        # end for
+
+        return child_log_probability - self.root.log_probability
+
+    # end def
+
+    def matching_length(self, node, context):
+        """ Returns the number of nodes of the given chain that lie on the path of the given context.
+        """
+
+        start = node.depth
+        available = min(node.length - 1, len(context) - start)
+
+        if context[start:start + available] == node.labels[:available]:
+            return available + 1
+
+        # Find the first context symbol that differs from the chain's labels.
+        for offset in range(available):
+            if context[start + offset] != node.labels[offset]:
+                return offset + 1
+        # end for
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given chain.
+        """
+
+        return node.children.items()
+
+    # end def
+
+    def node_labels(self, node):
+        """ Returns the context symbols linking the nodes of the given chain.
+        """
+
+        return node.labels
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability of the given chain.
+        """
+
+        return [node.symbol_count[0], node.symbol_count[1], node.log_kt, node.log_probability,
+                node.evicted_log_probability]
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the context tree to its state prior to a specified number of updates.
+
+            - `symbol_count`: the number of updates (symbols) to revert. (Default of 1.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        for i in range(symbol_count):
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
+
+            self.update_context()
+            context = self.context
+
+            for index in range(len(context) - 1, -1, -1):
+                node = context[index]
+
+                assert node.symbol_count[symbol] > 0, "Symbol count should be non-negative"
+                node.symbol_count[symbol] -= 1
+
+                if index + 1 < len(context):
+                    child = context[index + 1]
+
+                    if child.visits() == 0:
+                        # Delete the unvisited chain. Chains are reverted from the leaf up, so it
+                        # has already deleted its own children, and is a leaf.
+                        for child_symbol in list(node.children.keys()):
+                            if node.children[child_symbol] is child:
+                                del node.children[child_symbol]
+
+                        self.tree_size -= 1
+                        self.depth_sizes[child.depth] -= 1
+                    # end if
+                # end if
+
+                if len(node.children) == 1:
+                    # Merge the chain with its only child, if they have again seen the same symbols.
+                    (child_symbol, child), = node.children.items()
+
+                    if child.symbol_count == node.symbol_count:
+                        node.labels = node.labels + bytes(bytearray([child_symbol])) + child.labels
+                        node.length += child.length
+                        node.children = child.children
+                        node.evicted_log_probability = child.evicted_log_probability
+
+                        self.tree_size -= 1
+                        self.depth_sizes[child.depth] -= 1
+                    # end if
+                # end if
+
+                node.update_log_probability()
+            # end for
+        # end for
+
+    # end def
+
+    def show(self, node=None, offset=0):
+        """ Returns a string representation of the tree, in the same format as `CTWContextTree.show`,
+            as if its chains were not compressed.
+        """
+
+        if node is None:
+            node = self.root
+
+        symbols = '0:' + str(node.symbol_count[0]) + '  1:' + str(node.symbol_count[1])
+
+        if offset + 1 < node.length:
+            children = str(node.labels[offset]) + self.show(node, offset + 1) + ','
+        else:
+            children = ""
+
+            for symbol, child in node.children.items():
+                children += str(symbol) + self.show(child) + ','
+        # end if
+
+        return '{' + symbols + '||' + children + '}'
+
+    # end def
+
+    def split_node(self, node, keep):
+        """ Splits the given chain after its first `keep` nodes, which stay in the chain, while the
+            rest move to a new child chain. Returns the new chain.
+        """
+
+        lower = CTWChainNode(node.depth + keep, node.length - keep, node.labels[keep:])
+        lower.children = node.children
+        lower.evicted_log_probability = node.evicted_log_probability
+        lower.symbol_count = list(node.symbol_count)
+        lower.log_kt = node.log_kt
+        lower.log_probability = chain_log_probability(node.log_kt, node.bottom_log_probability(), lower.length)
+
+        node.children = {node.labels[keep - 1]: lower}
+        node.evicted_log_probability = None
+        node.labels = node.labels[:keep - 1]
+        node.length = keep
+
+        self.tree_size += 1
+        self.depth_sizes[lower.depth] += 1
+
+        return lower
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Updates the context tree with a new (binary) symbol, or a list of symbols.
+            (See `CTWContextTree.update`.)
+        """
+
+        for symbol in symbol_list:
+            self.update_context()
+
+            for node in reversed(self.context):
+                node.symbol_count[symbol] += 1
+                node.update_log_probability()
+            # end for
+
+            self.history.append(symbol)
+        # end for
+
+    # end def
+
+    def update_context(self):
+        """ Calculates which chains in the context tree correspond to the current context, and adds
+            them to `context` in order from root to leaf. Chains are split so that the context passes
+            through each of them entirely, and a new chain is added for the rest of the context
+            wherever it leaves the tree.
+        """
+
+        context = self.history.recent(self.depth)
+        node = self.root
+        self.context = [node]
+
+        while True:
+            keep = self.matching_length(node, context)
+
+            if keep < node.length:
+                self.split_node(node, keep)
+
+            bottom = node.depth + node.length - 1
+            if bottom == len(context):
+                break
+
+            child = node.children.get(context[bottom])
+
+            if child is None:
+                # Add the rest of the context as a single new chain.
+                child = CTWChainNode(bottom + 1, len(context) - bottom, bytes(context[bottom + 1:]))
+                node.children[context[bottom]] = child
+
+                self.tree_size += 1
+                self.depth_sizes[child.depth] += 1
+            # end if
+
+            node = child
+            self.context.append(node)
+        # end while
+
+    # end def
+# end class
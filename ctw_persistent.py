@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a persistent context tree, whose updates copy the nodes they change and share the rest.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+import random
+import sys
+
+import ctw_context_tree
+from ctw_numeric import log_half, log_kt_estimate, weighted_log_probability
+
+
+class PersistentCTWContextTreeNode(object):
+    """ A node of a `PersistentCTWContextTree`. A node is never changed once it is part of a tree, so
+        that it can be shared between every version of the tree that contains it.
+    """
+
+    __slots__ = ('zeros', 'ones', 'log_kt', 'log_probability', 'child0', 'child1', 'evicted_log_probability')
+
+    def __init__(self, zeros=0, ones=0, log_kt=0.0, log_probability=0.0, child0=None, child1=None,
+                 evicted_log_probability=None):
+        """ Construct a node with the given symbol counts, log KT estimate, weighted log probability,
+            children and evicted log probability. (See `CTWContextTree.collapse_node`.)
+        """
+
+        self.zeros = zeros
+        self.ones = ones
+        self.log_kt = log_kt
+        self.log_probability = log_probability
+        self.child0 = child0
+        self.child1 = child1
+        self.evicted_log_probability = evicted_log_probability
+
+    # end def
+
+    def child_log_probability_sum(self):
+        """ Returns the sum of the weighted log probabilities of the children of this node, including
+            those evicted from it, or None if the node is a leaf.
+        """
+
+        child_sum = self.evicted_log_probability
+
+        for child in (self.child0, self.child1):
+            if child is not None:
+                child_sum = child.log_probability if child_sum is None else child_sum + child.log_probability
+        # end for
+
+        return child_sum
+
+    # end def
+
+    def updated(self, symbol, change, child_symbol=None, child=None):
+        """ Returns a new node, with `change` (1 to update, -1 to revert) more of the given symbol than
+            this one, and its probabilities recomputed. This node is unchanged.
+            - `symbol`: the symbol that was observed (or reverted).
+            - `change`: the change in the count of the symbol.
+            - `child_symbol`: the symbol of the child to replace, if any.
+            - `child`: the child replacing it, or None to remove it.
+        """
+
+        node = PersistentCTWContextTreeNode(self.zeros, self.ones, 0.0, 0.0, self.child0, self.child1,
+                                            self.evicted_log_probability)
+
+        if symbol == 0:
+            node.zeros += change
+        else:
+            node.ones += change
+        # end if
+
+        assert node.zeros >= 0 and node.ones >= 0, "Symbol count should be non-negative"
+
+        if child_symbol == 0:
+            node.child0 = child
+        elif child_symbol == 1:
+            node.child1 = child
+        # end if
+
+        node.log_kt = log_kt_estimate(node.zeros, node.ones)
+
+        child_sum = node.child_log_probability_sum()
+        node.log_probability = node.log_kt if child_sum is None else weighted_log_probability(node.log_kt, child_sum)
+
+        return node
+
+    # end def
+
+    def visits(self):
+        """ Returns the number of times this context has been visited.
+        """
+
+        return self.zeros + self.ones
+
+    # end def
+
+    def show(self):
+        symbols = '0:' + str(self.zeros) + '  1:' + str(self.ones)
+        children = ""
+
+        for symbol, child in ((0, self.child0), (1, self.child1)):
+            if child is not None:
+                children += str(symbol) + child.show() + ','
+
+        return '{' + symbols + '||' + children + '}'
+
+    # end def
+# end class
+
+
+# A node that has seen no symbols, standing in for the nodes an update creates.
+fresh_node = PersistentCTWContextTreeNode()
+
+
+class PersistentCTWContextTree(ctw_context_tree.CTWContextTree):
+    """ A context tree whose nodes are never changed. An update instead creates a new copy of each
+        node on its context path, from the leaf up to a new root, and shares every other node with
+        the previous version of the tree, so a version of the tree is fully described by its root.
+
+        `snapshot` therefore returns an independent copy of the tree in constant time (apart from
+        copying the bounded history buffer). The copy can be read while this tree keeps learning,
+        or updated as a fork of it, at a cost of one new node per context node per symbol, and
+        neither tree ever sees the other's changes.
+
+        The undo journal is simply the stack of the roots that journaled updates replaced, so
+        reverting a journaled update takes constant time.
+
+        The tree offers the same interface as `CTWContextTree`, with `PersistentCTWContextTreeNode` nodes.
+    """
+
+    # Instance methods.
+
+    def clear(self):
+        """ Clears the entire context tree including all nodes and history.
+        """
+
+        # Reset the history.
+        self.history = ctw_context_tree.CTWHistory(self.depth + self.history_window, log=self.history_log)
+
+        # Set a new root, and reset the tree size.
+        self.root = PersistentCTWContextTreeNode()
+        self.tree_size = 1
+        self.depth_sizes = [1] + [0] * self.depth
+
+        # The nodes of the current context path, from the root down, as found by `update_context`.
+        self.context = []
+
+        # Stop journaling.
+        self.journal = None
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns an estimate of the number of bytes each node of the tree takes, from the size of
+            the root node object and of the objects it holds.
+        """
+
+        fields = [self.root.zeros, self.root.ones, self.root.log_kt, self.root.log_probability]
+
+        return sys.getsizeof(self.root) + sum([sys.getsizeof(value) for value in fields])
+
+    # end def
+
+    def journal_record(self, symbol, created):
+        """ Returns an undo journal record of the tree, before it is updated with the given symbol.
+            The record holds the root of the current version of the tree, which the update leaves unchanged.
+            - `symbol`: the symbol the tree is being updated with.
+            - `created`: the number of nodes that the update creates, which are always the deepest
+                         nodes of its context.
+        """
+
+        return self.root, len(self.history.recent(self.depth)), created
+
+    # end def
+
+    def undo_journal_record(self):
+        """ Restores the context tree to its state prior to the last update recorded in the journal.
+        """
+
+        root, context_length, created = self.journal.pop()
+
+        self.history.pop()
+        self.root = root
+
+        self.tree_size -= created
+        for depth in range(context_length + 1 - created, context_length + 1):
+            self.depth_sizes[depth] -= 1
+
+    # end def
+
+    def evict(self, node_count):
+        """ Collapses the subtrees of the least visited nodes, until the tree has at most `node_count`
+            nodes (or only the root is left). The same nodes are collapsed as by `CTWContextTree.evict`,
+            but the collapsed nodes and their ancestors are copied into a new version of the tree,
+            so snapshots of the tree are unaffected.
+
+            Returns the number of nodes evicted.
+            - `node_count`: the number of nodes to reduce the tree to.
+        """
+
+        assert not self.journal, "Nodes can not be evicted while journaled updates may still be reverted."
+
+        if self.tree_size <= node_count:
+            return 0
+
+        # Number the nodes in the order `CTWContextTree.evict` visits them, which numbers the
+        # descendants of every node consecutively after it.
+        nodes, parents, depths = [], [], []
+        stack = [(self.root, -1, 0)]
+
+        while stack:
+            node, parent, depth = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            depths.append(depth)
+
+            stack.extend([(child, index, depth + 1) for child in (node.child0, node.child1) if child is not None])
+        # end while
+
+        # The number of nodes in the subtree of each node, counted from the deepest up.
+        sizes = [1] * len(nodes)
+
+        for index in range(len(nodes) - 1, 0, -1):
+            sizes[parents[index]] += sizes[index]
+
+        candidates = sorted([(node.visits(), -depths[index], index) for index, node in enumerate(nodes)
+                             if sizes[index] > 1])
+
+        # Choose the least visited subtrees to collapse. Every node is visited more often than its
+        # descendants, so each subtree is chosen before any subtree containing it.
+        tree_size = self.tree_size
+        removed = bytearray(len(nodes))
+        collapsed = []
+
+        for visits, negative_depth, index in candidates:
+            if self.tree_size <= node_count:
+                break
+
+            if removed[index]:
+                continue
+
+            deleted = 0
+
+            for descendant in range(index + 1, index + sizes[index]):
+                if not removed[descendant]:
+                    removed[descendant] = 1
+                    self.depth_sizes[depths[descendant]] -= 1
+                    deleted += 1
+                # end if
+            # end for
+
+            if deleted:
+                self.tree_size -= deleted
+                collapsed.append(index)
+            # end if
+        # end for
+
+        # Copy the collapsed nodes, without their children, and then the ancestors of the copies.
+        # Collapsing leaves every weighted log probability unchanged. (See `CTWContextTree.collapse_node`.)
+        copies = {}
+
+        for index in collapsed:
+            if not removed[index]:
+                node = nodes[index]
+                copies[index] = PersistentCTWContextTreeNode(node.zeros, node.ones, node.log_kt, node.log_probability,
+                                                             evicted_log_probability=node.child_log_probability_sum())
+            # end if
+        # end for
+
+        for index in list(copies):
+            # Link the copy into a copy of each of its ancestors, up to the first ancestor already copied.
+            while parents[index] >= 0:
+                parent = parents[index]
+                copied = parent in copies
+
+                if not copied:
+                    node = nodes[parent]
+                    copies[parent] = PersistentCTWContextTreeNode(node.zeros, node.ones, node.log_kt,
+                                                                  node.log_probability, node.child0, node.child1,
+                                                                  node.evicted_log_probability)
+                # end if
+
+                if copies[parent].child0 is nodes[index]:
+                    copies[parent].child0 = copies[index]
+                else:
+                    copies[parent].child1 = copies[index]
+
+                if copied:
+                    break
+
+                index = parent
+            # end while
+        # end for
+
+        self.root = copies.get(0, self.root)
+
+        evicted = tree_size - self.tree_size
+
+        self.evictions += 1
+        self.evicted_subtrees += len(collapsed)
+        self.evicted_nodes += evicted
+
+        return evicted
+
+    # end def
+
+    def generate_random_symbols_and_update(self, symbol_count, thresholds=None):
+        """ Returns a specified number of random symbols distributed according to
+            the context tree statistics and update the context tree with the newly
+            generated symbols. (See `CTWContextTree.generate_random_symbols_and_update`.)
+        """
+
+        symbol_list = []
+
+        for i in range(symbol_count):
+            # Sample the symbol, as `predict([0])` would. (The history may be too short to predict from.)
+            if len(self.history) + 1 <= self.depth:
+                threshold = 0.5
+            else:
+                threshold = math.exp(self.log_predict_symbol(0))
+
+            if thresholds is not None:
+                thresholds.append(threshold)
+
+            symbol = 0 if random.random() < threshold else 1
+
+            self.update([symbol])
+            symbol_list.append(symbol)
+        # end for
+
+        return symbol_list
+
+    # end def
+
+    def load_nodes(self, columns, evicted_log_probability, depth_sizes):
+        """ Replaces the nodes of the (cleared) tree with the given nodes, created from the deepest up.
+            (See `CTWContextTree.load_nodes`.)
+        """
+
+        count0, count1, log_kt, log_probability, child0, child1 = columns
+        nodes = [None] * len(count0)
+
+        for index in range(len(nodes) - 1, -1, -1):
+            nodes[index] = PersistentCTWContextTreeNode(count0[index], count1[index], log_kt[index],
+                                                        log_probability[index],
+                                                        nodes[child0[index]] if child0[index] >= 0 else None,
+                                                        nodes[child1[index]] if child1[index] >= 0 else None,
+                                                        evicted_log_probability.get(index))
+        # end for
+
+        self.root = nodes[0]
+        self.tree_size = len(nodes)
+        self.depth_sizes = list(depth_sizes)
+
+    # end def
+
+    def log_predict_symbol(self, symbol):
+        """ Returns the log of `rho(symbol | h)` for a single symbol, walking the existing context path
+            once without changing or allocating any node of the tree. (See `CTWContextTree.log_predict`.)
+
+            - `symbol`: the symbol to estimate the conditional probability of.
+        """
+
+        # Collect the existing nodes on the context path.
+        context = self.history.recent(self.depth)
+        path = self.context_path(context)
+
+        # The updated weighted log probability of the child on the path below the current node.
+        # A missing child, and every node below it, is a fresh node that has seen one symbol.
+        log_probability = log_half if len(path) <= len(context) else None
+
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            log_kt = log_kt_estimate(node.zeros + 1 - symbol, node.ones + symbol)
+
+            if log_probability is None:
+                # The deepest node of a full context path.
+                child_sum = node.child_log_probability_sum()
+                log_probability = log_kt if child_sum is None else weighted_log_probability(log_kt, child_sum)
+            else:
+                sibling = node.child0 if context[depth] else node.child1
+                child_sum = log_probability if sibling is None else log_probability + sibling.log_probability
+                if node.evicted_log_probability is not None:
+                    child_sum += node.evicted_log_probability
+                log_probability = weighted_log_probability(log_kt, child_sum)
+            # end if
+        # end for
+
+        return log_probability - self.root.log_probability
+
+    # end def
+
+    def context_path(self, context):
+        """ Returns the existing nodes on the path of the given context, from the root down.
+            - `context`: the context symbols, most recent first.
+        """
+
+        path = [self.root]
+        node = self.root
+
+        for context_symbol in context:
+            node = node.child1 if context_symbol else node.child0
+            if node is None:
+                break
+            path.append(node)
+        # end for
+
+        return path
+
+    # end def
+
+    def node_children(self, node):
+        """ Returns the (symbol, child) pairs of the given node.
+        """
+
+        return [(symbol, child) for symbol, child in ((0, node.child0), (1, node.child1)) if child is not None]
+
+    # end def
+
+    def node_state(self, node):
+        """ Returns a list of the zero count, one count, log KT estimate, weighted log probability
+            and evicted log probability (see `collapse_node`) of the given node.
+        """
+
+        return [node.zeros, node.ones, node.log_kt, node.log_probability, node.evicted_log_probability]
+
+    # end def
+
+    def revert(self, symbol_count=1):
+        """ Restores the context tree to its state prior to a specified number of updates.
+            Updates recorded in the undo journal are restored by restoring the root they replaced,
+            and others by copying their context path with the symbol removed. (See `CTWContextTree.revert`.)
+        """
+
+        assert symbol_count >= 0, "The given symbol count should be greater than 0"
+
+        for i in range(symbol_count):
+            if self.journal:
+                self.undo_journal_record()
+                continue
+            # end if
+
+            # Symbols added by `update_history` were never modelled, so only leave the history.
+            if self.history.is_context_only():
+                self.history.pop()
+                continue
+            # end if
+
+            symbol = self.history.pop()
+
+            context = self.history.recent(self.depth)
+            path = self.context_path(context)
+
+            # Copy the path from the leaf up, removing the nodes that are no longer visited.
+            node = None
+
+            for depth in range(len(path) - 1, -1, -1):
+                if depth == len(path) - 1:
+                    node = path[depth].updated(symbol, -1)
+                else:
+                    node = path[depth].updated(symbol, -1, context[depth], node)
+
+                if depth > 0 and node.visits() == 0:
+                    node = None
+                    self.tree_size -= 1
+                    self.depth_sizes[depth] -= 1
+                # end if
+            # end for
+
+            self.root = node
+        # end for
+
+    # end def
+
+    def snapshot(self):
+        """ Returns an independent copy of the context tree, which shares every node with this one.
+            (See `CTWContextTree.snapshot`.)
+
+            The copy takes constant time, apart from copying the history, whose length is bounded
+            by the depth of the tree and its history window. The copy has no undo journal, and does
+            not keep a log of its history.
+        """
+
+        tree = PersistentCTWContextTree.__new__(self.__class__)
+        tree.__dict__.update(self.__dict__)
+
+        tree.history = self.history.copy()
+        tree.history_log = False
+        tree.depth_sizes = list(self.depth_sizes)
+        tree.context = []
+        tree.journal = None
+
+        return tree
+
+    # end def
+
+    def update(self, symbol_list):
+        """ Updates the context tree with a new (binary) symbol, or a list of symbols, by creating a
+            new version of the tree in which each node of the context is replaced by an updated copy.
+            (See `CTWContextTree.update`.)
+        """
+
+        for symbol in symbol_list:
+            context = self.history.recent(self.depth)
+            path = self.context_path(context)
+            created = len(context) + 1 - len(path)
+
+            if self.journal is not None:
+                self.journal.append(self.journal_record(symbol, created))
+
+            # Copy the path from the leaf up, starting from fresh nodes for the missing part of the path.
+            node = (path[-1] if created == 0 else fresh_node).updated(symbol, 1)
+
+            for depth in range(len(context) - 1, -1, -1):
+                parent = path[depth] if depth < len(path) else fresh_node
+                node = parent.updated(symbol, 1, context[depth], node)
+            # end for
+
+            self.root = node
+
+            self.tree_size += created
+            for depth in range(len(path), len(context) + 1):
+                self.depth_sizes[depth] += 1
+
+            self.history.append(symbol)
+        # end for
+
+    # end def
+
+    def update_context(self):
+        """ Finds the existing nodes of the current context, and sets `context` to them in order from
+            root to leaf. Nodes are only created by `update`, as the nodes of a version of the tree
+            can not change.
+        """
+
+        self.context = self.context_path(self.history.recent(self.depth))
+
+    # end def
+
+    def update_history(self, symbol_list):
+        """ Appends a symbol (or a list of symbols) to the tree's history without updating the tree.
+            (See `CTWContextTree.update_history`.)
+        """
+
+        for symbol in symbol_list:
+            if self.journal is not None:
+                self.journal.append((self.root, 0, 0))
+
+            self.history.append(symbol, context_only=True)
+        # end for
+
+    # end def
+
+    def show(self):
+        return self.root.show()
+
+    # end def
+# end class
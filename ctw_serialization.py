@@ -0,0 +1,698 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a versioned binary format for saving and loading context trees, and the state of MC-AIXI-CTW agents.
+
+A saved model is a stream of
+
+ - the magic bytes `CTWMODEL`, the format version and the kind of model (a tree, or an agent),
+ - for an agent: its age, total reward, last update, learning period, history window, the
+   number of context trees of its model (more than one for a factored model), and whether it is frozen,
+ - the history: its length, the number of symbols it retains, and those symbols and their
+   context only flags, most recent first,
+ - each context tree: the format of its nodes, its depth, eviction statistics and number of nodes,
+   then its nodes, breadth first from the root, as columns: a byte of flags for each node (whether
+   it has a child after a zero, a child after a one, and an evicted log probability), the zero
+   counts of the nodes, their one counts, and the evicted log probabilities of the nodes flagged
+   as having one. A frozen tree, which keeps no counts, is saved as its depth and number of nodes,
+   the flags of its nodes, and the two compiled probabilities of a zero of each node.
+
+Integers are stored as unsigned LEB128 varints, so the counts of most nodes take one byte each,
+and doubles as little-endian IEEE 754. Each column of counts is preceded by its length in bytes.
+The children of the nodes follow each other in the order of their parents, so a node's children
+are identified by counting, rather than stored. The log KT
+estimates and weighted log probabilities of the nodes are not stored, but recomputed from the leaves
+up when the tree is loaded, which reproduces them exactly.
+
+Trees are written from their nodes, with each column encoded a chunk of nodes at a time into a
+spooled temporary file (see `write_nodes`), so a large tree is never held in memory as lists of
+counts, and read into the flat arrays that `CTWContextTree.load_nodes` adopts, a column at a time,
+without building an intermediate graph of node objects.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import re
+import struct
+import sys
+import tempfile
+from array import array
+
+from ctw_numeric import log_kt_estimate, weighted_log_probability
+
+# The identifier at the start of every saved model, and the current version of the format.
+format_magic = b'CTWMODEL'
+format_version = 1
+
+# The formats of the nodes of a saved context tree: with their symbol counts, or as the compiled
+# predictions of a frozen tree.
+counted_nodes = 0
+frozen_nodes = 1
+
+# The kinds of model that can be saved.
+tree_model = 0
+agent_model = 1
+
+# The flags describing each node.
+zero_child_flag = 1
+one_child_flag = 2
+evicted_flag = 4
+
+# The number of bytes written to, or read from, the stream at a time.
+chunk_size = 1 << 20
+
+# The number of nodes whose columns are encoded at a time.
+node_chunk_size = 1 << 16
+
+# The number of children of a node, indexed by its flags.
+child_count_table = bytes(bytearray([bool(flags & zero_child_flag) + bool(flags & one_child_flag) for flags in range(256)]))
+
+# Matches a varint of more than one byte.
+multiple_byte_varint = re.compile(b'[\\x80-\\xff]+[\\x00-\\x7f]')
+
+# The index of a missing child.
+no_node = -1
+
+double_format = struct.Struct(str('<d'))
+
+
+class ModelWriter:
+    """ Writes varints, doubles and bytes to a binary stream, through a buffer flushed in chunks.
+    """
+
+    def __init__(self, stream):
+        """ Create a writer to the given binary stream.
+        """
+
+        self.stream = stream
+        self.buffer = bytearray()
+
+    # end def
+
+    def flush(self):
+        """ Writes the buffered bytes to the stream.
+        """
+
+        self.stream.write(bytes(self.buffer))
+        del self.buffer[:]
+
+    # end def
+
+    def write_bytes(self, data):
+        self.buffer += data
+
+        if len(self.buffer) >= chunk_size:
+            self.flush()
+
+    # end def
+
+    def write_double(self, value):
+        self.buffer += double_format.pack(value)
+
+    # end def
+
+    def write_varint(self, value):
+        assert value >= 0, "Only non-negative integers can be written as varints."
+
+        buffer = self.buffer
+
+        while value >= 0x80:
+            buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+        # end while
+
+        buffer.append(value)
+
+    # end def
+# end class
+
+
+class ModelReader:
+    """ Reads varints, doubles and bytes from a binary stream, through a buffer refilled in chunks.
+    """
+
+    def __init__(self, stream):
+        """ Create a reader from the given binary stream.
+        """
+
+        self.stream = stream
+        self.buffer = b''
+        self.position = 0
+
+    # end def
+
+    def fill(self, size):
+        """ Ensures that at least `size` bytes are buffered after the current position, unless the stream ends.
+        """
+
+        if len(self.buffer) - self.position < size:
+            self.buffer = self.buffer[self.position:] + self.stream.read(max(size, chunk_size))
+            self.position = 0
+        # end if
+
+    # end def
+
+    def read_bytes(self, size):
+        self.fill(size)
+        assert len(self.buffer) - self.position >= size, "The saved model ends early."
+
+        data = self.buffer[self.position:self.position + size]
+        self.position += size
+
+        return data
+
+    # end def
+
+    def read_double(self):
+        return double_format.unpack(self.read_bytes(8))[0]
+
+    # end def
+
+    def read_varint(self):
+        self.fill(10)
+
+        buffer = self.buffer
+        position = self.position
+        value = shift = 0
+
+        while True:
+            byte = buffer[position]
+            position += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        # end while
+
+        self.position = position
+
+        return value
+
+    # end def
+# end class
+
+
+def write_header(writer, kind):
+    """ Writes the magic bytes, the format version and the kind of model.
+    """
+
+    writer.write_bytes(format_magic)
+    writer.write_varint(format_version)
+    writer.write_varint(kind)
+
+# end def
+
+
+def read_header(reader, kind):
+    """ Reads the magic bytes, format version and kind of model, which must be the given kind.
+    """
+
+    assert reader.read_bytes(len(format_magic)) == format_magic, "The stream does not hold a saved model."
+
+    version = reader.read_varint()
+    assert version == format_version, "The saved model has version %d, not %d." % (version, format_version)
+    assert reader.read_varint() == kind, "The saved model is of a different kind."
+
+# end def
+
+
+def write_history(writer, history):
+    """ Writes the length of the given history, and the symbols it retains, most recent first.
+    """
+
+    symbols = history.recent(history.retained)
+
+    writer.write_varint(len(history))
+    writer.write_varint(len(symbols))
+    writer.write_bytes(symbols)
+    writer.write_bytes(bytes(bytearray([history.context_only[(history.head + index) % history.capacity]
+                                        for index in range(len(symbols))])))
+
+# end def
+
+
+def read_history(reader, history):
+    """ Reads a history into the given (empty) history, keeping the most recent symbols that fit in it.
+    """
+
+    size = reader.read_varint()
+    retained = reader.read_varint()
+    symbols = bytearray(reader.read_bytes(retained))
+    context_only = bytearray(reader.read_bytes(retained))
+
+    for index in range(min(retained, history.capacity) - 1, -1, -1):
+        history.append(symbols[index], context_only=bool(context_only[index]))
+
+    history.size = size
+
+# end def
+
+
+def encode_varints(values):
+    """ Returns the given non-negative integers, encoded as consecutive varints.
+        Runs of integers below 128, which each take a single byte, are encoded together.
+    """
+
+    encoded = bytearray()
+
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+
+        if max(chunk) < 0x80:
+            encoded += bytearray(chunk)
+            continue
+        # end if
+
+        for value in chunk:
+            while value >= 0x80:
+                encoded.append((value & 0x7f) | 0x80)
+                value >>= 7
+            # end while
+
+            encoded.append(value)
+        # end for
+    # end for
+
+    return encoded
+
+# end def
+
+
+def decode_varints(data):
+    """ Returns an array of the integers encoded as consecutive varints in the given bytes.
+        Runs of single byte varints are decoded together.
+    """
+
+    values = array(str('I'))
+    position = 0
+
+    # Each match is a varint of more than one byte.
+    for match in multiple_byte_varint.finditer(data):
+        values.extend(data[position:match.start()])
+
+        value = shift = 0
+        for byte in bytearray(match.group()):
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        # end for
+
+        values.append(value)
+        position = match.end()
+    # end for
+
+    values.extend(data[position:])
+
+    return values
+
+# end def
+
+
+def link_nodes(flags, depth):
+    """ Returns the arrays of the indices of the children after a zero and after a one (or `no_node`)
+        of the nodes described by the given flags, numbered breadth first from the root, and a list
+        of the number of nodes at each depth of a tree of the given depth.
+    """
+
+    node_count = len(flags)
+
+    # The nodes are numbered breadth first, so the children of each node are the next nodes not yet
+    # numbered: the first child of each node follows the children of every node before it.
+    child_counts = bytearray(flags.translate(child_count_table))
+    first_children = array(str('i'), itertools.accumulate(itertools.chain([1], child_counts)))
+
+    child0 = array(str('i'), [first if node_flags & zero_child_flag else no_node
+                              for node_flags, first in zip(flags, first_children)])
+    child1 = array(str('i'), [first + (node_flags & zero_child_flag) if node_flags & one_child_flag else no_node
+                              for node_flags, first in zip(flags, first_children)])
+
+    assert sum(child_counts) == node_count - 1, "The saved context tree is inconsistent."
+
+    # Count the nodes at each depth. The nodes of each depth are numbered together.
+    depth_sizes = [0] * (depth + 1)
+    level_start, level_end, level = 0, 1, 0
+
+    while level_start < node_count:
+        depth_sizes[level] = level_end - level_start
+        level_start, level_end, level = level_end, level_end + sum(child_counts[level_start:level_end]), level + 1
+    # end while
+
+    return child0, child1, depth_sizes
+
+# end def
+
+
+def write_nodes(writer, tree):
+    """ Writes the depth, eviction statistics and nodes of the given context tree.
+        The nodes of a path-compressed tree are written as the nodes they stand for.
+        (See `CTWContextTree.node_labels`.)
+
+        The columns are encoded `node_chunk_size` nodes at a time, as the nodes are visited, into
+        spooled temporary files, which are kept in memory until they reach `chunk_size` bytes,
+        and then copied to the stream one after the other.
+    """
+
+    assert tree.supports_node_state, "Only a context tree that keeps the state of its nodes can be saved."
+
+    # The spooled flags, zero counts, one counts and evicted log probabilities of the nodes.
+    columns = [tempfile.SpooledTemporaryFile(max_size=chunk_size) for column in range(4)]
+    flag_column, zero_column, one_column, evicted_column = columns
+
+    flags = bytearray()
+    zeros, ones = [], []
+    evicted = array(str('d'))
+    node_count = 0
+
+    def spool():
+        """ Encodes the columns of the nodes visited since the last chunk, and adds them to the spooled columns.
+        """
+
+        flag_column.write(bytes(flags))
+        zero_column.write(bytes(encode_varints(zeros)))
+        one_column.write(bytes(encode_varints(ones)))
+
+        if sys.byteorder != 'little':
+            evicted.byteswap()
+
+        evicted_column.write(evicted.tobytes())
+
+        del flags[:], zeros[:], ones[:], evicted[:]
+    # end def
+
+    # Each queued node is the given position in the chain of nodes a node of the tree stands for.
+    queue = collections.deque([(tree.root, 0)])
+
+    while queue:
+        node, position = queue.popleft()
+        node_zeros, node_ones, log_kt, log_probability, evicted_log_probability = tree.node_state(node)
+
+        labels = tree.node_labels(node)
+
+        if position < len(labels):
+            children = [(labels[position], (node, position + 1))]
+            evicted_log_probability = None
+        else:
+            children = [(symbol, (child, 0)) for symbol, child in sorted(tree.node_children(node))]
+
+        node_flags = 0
+        for symbol, child in children:
+            node_flags |= one_child_flag if symbol else zero_child_flag
+        # end for
+
+        if evicted_log_probability is not None:
+            node_flags |= evicted_flag
+            evicted.append(evicted_log_probability)
+        # end if
+
+        flags.append(node_flags)
+        zeros.append(node_zeros)
+        ones.append(node_ones)
+
+        node_count += 1
+        if len(flags) == node_chunk_size:
+            spool()
+
+        queue.extend([child for symbol, child in children])
+    # end while
+
+    spool()
+
+    writer.write_varint(tree.depth)
+    writer.write_varint(tree.evictions)
+    writer.write_varint(tree.evicted_subtrees)
+    writer.write_varint(tree.evicted_nodes)
+    writer.write_varint(node_count)
+
+    # The flags and the evicted log probabilities are read by counting, and the counts by their length.
+    for column in columns:
+        if column is zero_column or column is one_column:
+            writer.write_varint(column.tell())
+
+        column.seek(0)
+
+        for data in iter(lambda: column.read(chunk_size), b''):
+            writer.write_bytes(data)
+
+        column.close()
+    # end for
+
+# end def
+
+
+def read_nodes(reader, tree):
+    """ Reads the nodes of a context tree into the given (empty) tree, which must have the same depth.
+        (See `CTWContextTree.load_nodes`.)
+    """
+
+    depth = reader.read_varint()
+    assert depth == tree.depth, "The saved context tree has depth %d, not %d." % (depth, tree.depth)
+
+    evictions = reader.read_varint()
+    evicted_subtrees = reader.read_varint()
+    evicted_nodes = reader.read_varint()
+    node_count = reader.read_varint()
+
+    flags = reader.read_bytes(node_count)
+    count0 = decode_varints(reader.read_bytes(reader.read_varint()))
+    count1 = decode_varints(reader.read_bytes(reader.read_varint()))
+
+    assert len(count0) == len(count1) == node_count, "The saved context tree is inconsistent."
+
+    flags = bytearray(flags)
+    evicted_indices = [node for node in range(node_count) if flags[node] & evicted_flag]
+    evicted = array(str('d'))
+    evicted.frombytes(reader.read_bytes(8 * len(evicted_indices)))
+
+    if sys.byteorder != 'little':
+        evicted.byteswap()
+
+    evicted_log_probability = dict(zip(evicted_indices, evicted))
+
+    child0, child1, depth_sizes = link_nodes(flags, tree.depth)
+
+    # Recompute the log KT estimates, and the weighted log probabilities, from the deepest nodes up.
+    # The weighted log probability of a leaf is its log KT estimate.
+    log_kt = array(str('d'), map(log_kt_estimate, count0, count1))
+    log_probability = array(str('d'), log_kt)
+
+    for node in reversed([node for node in range(node_count) if flags[node]]):
+        # Sum the children first, then the evicted children, as the engines do.
+        zero, one = child0[node], child1[node]
+        node_evicted = evicted_log_probability.get(node)
+
+        if zero == no_node and one == no_node:
+            child_sum = node_evicted
+        else:
+            child_sum = (0.0 if zero == no_node else log_probability[zero]) + \
+                        (0.0 if one == no_node else log_probability[one])
+            if node_evicted is not None:
+                child_sum += node_evicted
+        # end if
+
+        log_probability[node] = weighted_log_probability(log_kt[node], child_sum)
+    # end for
+
+    tree.load_nodes((count0, count1, log_kt, log_probability, child0, child1), evicted_log_probability, depth_sizes)
+
+    tree.evictions, tree.evicted_subtrees, tree.evicted_nodes = evictions, evicted_subtrees, evicted_nodes
+
+# end def
+
+
+def write_frozen_nodes(writer, tree):
+    """ Writes the depth and nodes of the given frozen context tree: a byte of flags for each node,
+        breadth first, whether it has a child after a zero and a child after a one, followed by
+        the compiled probabilities of a zero of each node. (See `FrozenCTWContextTree.compile`.)
+    """
+
+    child0, child1 = tree.child0, tree.child1
+
+    writer.write_varint(tree.depth)
+    writer.write_varint(tree.tree_size)
+
+    # Write the flags, then the probabilities, `node_chunk_size` nodes at a time.
+    for start in range(0, tree.tree_size, node_chunk_size):
+        end = start + node_chunk_size
+        writer.write_bytes(bytes(bytearray([(zero != no_node) * zero_child_flag | (one != no_node) * one_child_flag
+                                            for zero, one in zip(child0[start:end], child1[start:end])])))
+    # end for
+
+    for start in range(0, tree.tree_size, node_chunk_size):
+        zero_probability = tree.zero_probability[2 * start:2 * (start + node_chunk_size)]
+
+        if sys.byteorder != 'little':
+            zero_probability.byteswap()
+
+        writer.write_bytes(zero_probability.tobytes())
+    # end for
+
+# end def
+
+
+def read_frozen_nodes(reader, tree):
+    """ Reads the nodes of a frozen context tree into the given (empty) frozen tree, which must have
+        the same depth. (See `FrozenCTWContextTree.load_compiled_nodes`.)
+    """
+
+    assert not tree.supports_node_state, "A frozen context tree can only be loaded into a frozen tree."
+
+    depth = reader.read_varint()
+    assert depth == tree.depth, "The saved context tree has depth %d, not %d." % (depth, tree.depth)
+
+    node_count = reader.read_varint()
+
+    flags = bytearray(reader.read_bytes(node_count))
+    zero_probability = array(str('d'))
+    zero_probability.frombytes(reader.read_bytes(16 * node_count))
+
+    if sys.byteorder != 'little':
+        zero_probability.byteswap()
+
+    child0, child1, depth_sizes = link_nodes(flags, tree.depth)
+
+    tree.load_compiled_nodes(child0, child1, zero_probability, depth_sizes)
+
+# end def
+
+
+def write_tree(writer, tree):
+    """ Writes the format of the nodes of the given context tree, then its nodes.
+    """
+
+    if tree.supports_node_state:
+        writer.write_varint(counted_nodes)
+        write_nodes(writer, tree)
+    else:
+        writer.write_varint(frozen_nodes)
+        write_frozen_nodes(writer, tree)
+    # end if
+
+# end def
+
+
+def read_tree(reader, tree):
+    """ Reads the nodes of a context tree, in the node format it was saved in, into the given (empty) tree.
+    """
+
+    node_format = reader.read_varint()
+
+    if node_format == frozen_nodes:
+        read_frozen_nodes(reader, tree)
+    else:
+        read_nodes(reader, tree)
+    # end if
+
+# end def
+
+
+def save_tree(tree, stream):
+    """ Writes the given context tree, and its history, to the given binary stream.
+    """
+
+    assert not tree.journal, "A context tree can not be saved part way through journaled updates."
+
+    writer = ModelWriter(stream)
+
+    write_header(writer, tree_model)
+    write_history(writer, tree.history)
+    write_tree(writer, tree)
+
+    writer.flush()
+
+# end def
+
+
+def load_tree(stream, tree):
+    """ Replaces the given context tree, and its history, with those saved in the given binary stream.
+        The tree must have the same depth as the saved one.
+    """
+
+    reader = ModelReader(stream)
+
+    read_header(reader, tree_model)
+
+    tree.clear()
+    read_history(reader, tree.history)
+    read_tree(reader, tree)
+
+# end def
+
+
+def save_agent(agent, stream):
+    """ Writes the state of the given MC-AIXI-CTW agent, and its model, to the given binary stream.
+    """
+
+    assert not agent.simulating, "An agent can not be saved part way through a search."
+
+    trees = agent.context_tree.factors if agent.factored else [agent.context_tree]
+
+    writer = ModelWriter(stream)
+
+    write_header(writer, agent_model)
+
+    writer.write_varint(agent.age)
+    writer.write_double(agent.total_reward)
+    writer.write_varint(agent.last_update)
+    writer.write_varint(agent.learning_period)
+    writer.write_varint(agent.history_window())
+    writer.write_varint(len(trees))
+    writer.write_varint(int(agent.frozen))
+
+    write_history(writer, agent.context_tree.history)
+
+    for tree in trees:
+        assert not tree.journal, "A context tree can not be saved part way through journaled updates."
+        write_tree(writer, tree)
+    # end for
+
+    writer.flush()
+
+# end def
+
+
+def load_agent(stream, agent):
+    """ Replaces the state of the given MC-AIXI-CTW agent, and its model, with those saved in the given
+        binary stream. The agent must be configured as the saved one was, with the same depth,
+        history window and number of context trees. The agent is frozen (see `MC_AIXI_CTW_Agent.freeze`)
+        if the saved one was, and a frozen agent can only load a frozen one.
+    """
+
+    reader = ModelReader(stream)
+
+    read_header(reader, agent_model)
+
+    age = reader.read_varint()
+    total_reward = reader.read_double()
+    last_update = reader.read_varint()
+    learning_period = reader.read_varint()
+
+    assert reader.read_varint() == agent.history_window(), "The saved agent has a different history window."
+
+    trees = agent.context_tree.factors if agent.factored else [agent.context_tree]
+    assert reader.read_varint() == len(trees), "The saved agent has a different number of context trees."
+
+    frozen = bool(reader.read_varint())
+    assert frozen or not agent.frozen, "A frozen agent can not load a saved agent that was still learning."
+
+    agent.context_tree.clear()
+
+    # Freeze the cleared model, so that its trees are frozen trees to load the saved ones into.
+    if frozen:
+        agent.freeze()
+
+    trees = agent.context_tree.factors if agent.factored else [agent.context_tree]
+
+    read_history(reader, agent.context_tree.history)
+
+    for tree in trees:
+        read_tree(reader, tree)
+
+    agent.age = age
+    agent.total_reward = total_reward
+    agent.last_update = last_update
+    agent.learning_period = learning_period
+
+# end def
@@ -55,7 +55,7 @@ class Tic_Tac_Toe(environment.Environment):
 
         environment.Environment.__init__(self, options=options)
 
-        self.valid_actions = xrange(0, 16)
+        self.valid_actions = xrange(0, 9)
         # Define the acceptable observation values.
         self.valid_observations = xrange(0, 174672 + 1)
 
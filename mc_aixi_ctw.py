@@ -8,9 +8,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import copy
 import os
 import random
 import sys
+import time
 
 # Insert the package's parent directory into the system search path, so that this package can be
 # imported when the aixi.py script is run directly from a release archive.
@@ -19,17 +21,47 @@ sys.path.insert(0, PROJECT_ROOT)
 
 # Ensure xrange is defined on Python 3.
 
+import monte_carlo_search_pool
 import monte_carlo_search_tree
 import util
+import ctw_compact
 import ctw_context_tree
+import ctw_factored
+import ctw_frozen
+import ctw_hashed
+import ctw_mapped
+import ctw_node_pool
+import ctw_patricia
+import ctw_persistent
+import ctw_serialization
+import parallel_search
+import symbol_log
 import agent
 
 from agent import action_update, percept_update
 from monte_carlo_search_tree import decision_node
 
+# The context tree implementations that can be selected with the 'ctw-engine' option.
+ctw_engines = {'object': ctw_context_tree.CTWContextTree,
+               'compact': ctw_compact.CompactCTWContextTree,
+               'compact16': ctw_compact.Compact16CTWContextTree,
+               'hashed': ctw_hashed.HashedCTWContextTree,
+               'mapped': ctw_mapped.MappedCTWContextTree,
+               'patricia': ctw_patricia.PatriciaCTWContextTree,
+               'persistent': ctw_persistent.PersistentCTWContextTree,
+               'pool': ctw_node_pool.PooledCTWContextTree}
+
+
+# The clocks that the time of a search can be measured by, with the 'mc-search-clock' option.
+search_clocks = {'cpu': time.process_time,
+                 'wall': time.perf_counter}
+
 
 class MC_AIXI_CTW_Undo:
     """ A class to save details from a MC-AIXI-CTW agent to restore state later.
+
+        The context tree is restored by reverting the symbols added since the undo instance
+        was created, which replays the tree's undo journal backwards if it is journaling.
     """
 
     # Instance methods.
@@ -43,6 +75,10 @@ class MC_AIXI_CTW_Undo:
         self.total_reward = agent.total_reward
         self.history_size = agent.history_size()
         self.last_update = agent.last_update
+
+        # Journal the context tree's updates from here on, if the agent uses journaled reverts.
+        if agent.journal:
+            agent.context_tree.begin_journal()
     # end def
 
 
@@ -114,10 +150,70 @@ class MC_AIXI_CTW_Agent(agent.Agent):
              - `agent-horizon`: the agent's planning horizon.
              - `ct-depth`: the depth of the context tree for this agent, in symbols/bits.
              - `mc-simulations`: the number of simulations to run when choosing new actions.
+                                 (Not needed when each search runs for a time, with `mc-search-time-ms`.)
 
             The following options are optional:
+             - `agent-checkpoint`: the path, without an extension, of the files that the agent's real actions
+                                   and percepts are logged to (`<path>.log`, see `symbol_log.SymbolLog`),
+                                   and its snapshots saved to (`<path>.model`), so that it can be recovered
+                                   if its process dies. The agent is recovered from them (see `recover`)
+                                   if they exist. Defaults to None, for no log or snapshots.
+             - `agent-checkpoint-interval`: the number of cycles between snapshots of the agent, which each
+                                            restart its log. Defaults to '1000'.
+             - `ctw-engine`: the context tree implementation to use, one of the keys of `ctw_engines`.
+                             Defaults to 'object', a tree of `CTWContextTreeNode` objects.
+             - `ct-factored`: whether the model predicts each action and percept bit with its own context
+                              tree (see `ctw_factored.FactoredCTWContextTree`), rather than with one tree.
+                              Defaults to False.
+             - `ct-freeze`: whether the model is compiled into a read-only `ctw_frozen.FrozenCTWContextTree`
+                            (see `freeze`) once the learning period has expired, so that searches only
+                            add symbols to its history and look up its predictions. Defaults to False.
+             - `ct-history-log`: whether the context tree keeps a complete log of the symbols it has seen.
+                                 Defaults to False, which only keeps the symbols needed for its context.
+             - `ct-journal`: whether the context tree records an undo journal during searches, so that
+                             simulations are reverted exactly without recomputing probabilities.
+                             Defaults to False.
+             - `ct-path`: the file that the 'mapped' context tree engine keeps its nodes in, which is
+                          reopened, with the model it holds and the agent's age, total reward and last
+                          update, if it exists. Defaults to None, for a temporary file.
+             - `ct-max-nodes`: the number of context tree nodes beyond which the least visited subtrees
+                               are evicted, after each real (not simulated) update of the model.
+                               Defaults to '0', which is no limit.
+             - `ct-skip-actions`: whether the agent's action bits are only added to the context tree's
+                                  history, as context for the percepts, rather than modelled by it.
+                                  Actions are then generated uniformly at random rather than from
+                                  the model. Defaults to False.
              - `learning-period`: the number of cycles the agent should learn for.
                                   Defaults to '0', which is indefinite learning.
+             - `mc-percept-cache`: whether chance nodes of the search tree cache the percept
+                                   distribution of the model the first time they are visited.
+                                   Defaults to False.
+             - `mc-search-store`: how the nodes of the search tree are stored, as 'object' nodes (see
+                                  `monte_carlo_search_tree.MonteCarloSearchNode`), or in the preallocated
+                                  arrays of a 'pool' (see `monte_carlo_search_pool.MonteCarloSearchPool`),
+                                  which is kept and cleared for each search. Defaults to 'object'.
+             - `mc-search-pool-size`: the number of nodes the arrays of a search pool are first allocated for.
+                                      They are doubled whenever they are full. Defaults to '1024'.
+             - `mc-search-time-ms`: the time, in milliseconds, that each search runs simulations for, rather
+                                    than a fixed number of them, so that it can answer by a deadline.
+                                    Defaults to None, for `mc-simulations` simulations.
+             - `mc-search-clock`: whether the time of a search is measured by a 'wall' clock or in the
+                                  'cpu' time of the processes running its simulations. Defaults to 'wall'.
+             - `mc-min-simulations`: the number of simulations a search with a time runs, even if its time
+                                     runs out first. Defaults to '1'.
+             - `mc-max-simulations`: the number of simulations after which a search with a time stops, even
+                                     if it has time left. Defaults to '0', which is no limit.
+             - `mc-reuse-tree`: whether the search tree is kept from one search to the next, so that the
+                                subtree of the real action and percept since is the root of the next
+                                search, with its statistics as a warm start. Defaults to False.
+             - `mc-reuse-discount`: the factor that the visits of the statistics of a reused search tree
+                                    are scaled by, for each real cycle they are kept, so that those
+                                    sampled from older models weigh less. Defaults to '1.0', which
+                                    keeps them as they are.
+             - `mc-workers`: the number of worker processes that each search their own search tree with
+                             a share of the simulations, with a copy of the model (see
+                             `parallel_search.RootParallelSearch`), whose statistics for each action
+                             are merged. Defaults to '0', for a search in the agent's own process.
         """
 
         # Set up the base agent options, which handles getting and setting the learning period, amongst other basic
@@ -133,10 +229,11 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
         self.depth = int(options['ct-depth'])
 
-        if ctw is None:
-            self.context_tree = ctw_context_tree.CTWContextTree(self.depth)
-        else:
-            self.context_tree = ctw
+        # The context tree implementation used for the agent's model.
+        # Retrieved from the given options under 'ctw-engine'. Defaults to 'object'.
+        self.ctw_engine = options.get('ctw-engine', 'object')
+        assert self.ctw_engine in ctw_engines, \
+            "The given context tree engine '%s' is not one of %s." % (self.ctw_engine, sorted(ctw_engines))
 
         # The length of the agent's planning horizon.
         # Retrieved from the given options under 'agent-horizon'. Mandatory.
@@ -144,13 +241,204 @@ class MC_AIXI_CTW_Agent(agent.Agent):
             "The required 'agent-horizon' search horizon option is missing from the given options."
         self.horizon = int(options['agent-horizon'])
 
+        # The range of the environment's rewards, which the UCB policy of the search scales mean rewards by.
+        # (See `MonteCarloSearchNode.select_action`.)
+        self.reward_range = environment.maximum_reward() - environment.minimum_reward()
+
+        # Whether the context tree should also log every symbol it sees.
+        # Retrieved from the given options under 'ct-history-log'. Defaults to False.
+        history_log = bool(options.get('ct-history-log', False))
+
+        # The node budget of the context tree.
+        # Retrieved from the given options under 'ct-max-nodes'. Defaults to '0', which is no limit.
+        max_nodes = int(options.get('ct-max-nodes', 0))
+        assert 0 <= max_nodes, "The context tree node budget can not be negative."
+
+        # Whether action bits are only context for the model, rather than modelled by it.
+        # Retrieved from the given options under 'ct-skip-actions'. Defaults to False.
+        self.skip_actions = bool(options.get('ct-skip-actions', False))
+
+        # Whether the model has a context tree for each bit of a cycle, rather than one for every bit.
+        # Retrieved from the given options under 'ct-factored'. Defaults to False.
+        self.factored = bool(options.get('ct-factored', False))
+
+        # Whether the model is frozen once the learning period has expired.
+        # Retrieved from the given options under 'ct-freeze'. Defaults to False.
+        self.freeze_after_learning = bool(options.get('ct-freeze', False))
+
+        # Whether the model has been frozen.
+        self.frozen = False
+
+        # The file the 'mapped' context tree engine keeps its nodes in, if any.
+        # Retrieved from the given options under 'ct-path'. Defaults to None, for a temporary file.
+        engine_options = {}
+        if options.get('ct-path') is not None:
+            assert self.ctw_engine == 'mapped' and not self.factored, \
+                "Only a single tree of the 'mapped' context tree engine is kept in a given file."
+            engine_options['path'] = options['ct-path']
+        # end if
+
+        if ctw is None and self.factored:
+            cycle_bits = self.environment.options['action-bits'] + self.environment.options['percept-bits']
+            self.context_tree = ctw_factored.FactoredCTWContextTree(self.depth, cycle_bits,
+                                                                    engine=ctw_engines[self.ctw_engine],
+                                                                    history_window=self.history_window(),
+                                                                    history_log=history_log,
+                                                                    max_nodes=max_nodes or None)
+        elif ctw is None:
+            self.context_tree = ctw_engines[self.ctw_engine](self.depth, history_window=self.history_window(),
+                                                             history_log=history_log,
+                                                             max_nodes=max_nodes or None, **engine_options)
+        else:
+            self.context_tree = ctw
+
+        # The time that each search runs simulations for, in milliseconds, if any.
+        # Retrieved from the given options under 'mc-search-time-ms'. Defaults to None, for a number of simulations.
+        self.search_time = options.get('mc-search-time-ms')
+        if self.search_time is not None:
+            self.search_time = float(self.search_time)
+            assert 0.0 <= self.search_time, "The search time can not be negative."
+        # end if
+
+        # The clock that the time of a search is measured by.
+        # Retrieved from the given options under 'mc-search-clock'. Defaults to 'wall'.
+        self.search_clock = options.get('mc-search-clock', 'wall')
+        assert self.search_clock in search_clocks, \
+            "The given search clock '%s' is not one of %s." % (self.search_clock, sorted(search_clocks))
+
+        # The least and most simulations that a search with a time runs.
+        # Retrieved from the given options under 'mc-min-simulations' and 'mc-max-simulations'.
+        # Defaults to '1' and '0', which is no limit.
+        self.min_simulations = int(options.get('mc-min-simulations', 1))
+        self.max_simulations = int(options.get('mc-max-simulations', 0))
+        assert 0 <= self.min_simulations and 0 <= self.max_simulations, \
+            "The least and most simulations of a search can not be negative."
+
         # The number of simulations to conduct when choosing new actions via the UCT algorithm.
-        # Retrieved from the given options under 'mc-simulations'. Mandatory.
-        assert 'mc-simulations' in options, \
+        # Retrieved from the given options under 'mc-simulations'. Mandatory, unless searches run for a time.
+        assert 'mc-simulations' in options or self.search_time is not None, \
             "The required 'mc-simulations' Monte Carlo simulations count option is missing from the given options."
-        self.mc_simulations = int(options['mc-simulations'])
+        self.mc_simulations = int(options.get('mc-simulations', 0))
+
+        # The number of simulations the last search completed.
+        self.search_simulations = 0
+
+        # Whether simulated updates are reverted from an undo journal, rather than recomputed.
+        # Retrieved from the given options under 'ct-journal'. Defaults to False.
+        self.journal = bool(options.get('ct-journal', False))
+
+        # Whether chance nodes of the search tree cache the model's percept distribution.
+        # Retrieved from the given options under 'mc-percept-cache'. Defaults to False.
+        self.percept_cache = bool(options.get('mc-percept-cache', False))
+
+        # Whether the search tree is kept from one search to the next.
+        # Retrieved from the given options under 'mc-reuse-tree'. Defaults to False.
+        self.reuse_search_tree = bool(options.get('mc-reuse-tree', False))
+
+        # The factor that the visits of a reused search tree are scaled by for each real cycle.
+        # Retrieved from the given options under 'mc-reuse-discount'. Defaults to '1.0', for no discount.
+        self.reuse_discount = float(options.get('mc-reuse-discount', 1.0))
+        assert 0.0 <= self.reuse_discount <= 1.0, "The search tree reuse discount must be between 0 and 1."
+
+        # The search tree kept from the last search, for the real actions and percepts since, if it is reused.
+        self.search_tree = None
+
+        # How the nodes of the search tree are stored.
+        # Retrieved from the given options under 'mc-search-store'. Defaults to 'object'.
+        self.search_store = options.get('mc-search-store', 'object')
+        assert self.search_store in ('object', 'pool'), \
+            "The given search tree store '%s' is not one of ['object', 'pool']." % self.search_store
+
+        # The number of nodes the arrays of the search pool are first allocated for.
+        # Retrieved from the given options under 'mc-search-pool-size'. Defaults to '1024'.
+        self.search_pool_size = int(options.get('mc-search-pool-size', 1024))
+        assert 0 < self.search_pool_size, "The search pool needs room for at least one node."
+
+        # The search pool that is cleared for each search, allocated by the first search, if nodes are stored in one.
+        self.search_pool = None
+
+        # The number of worker processes that search in parallel, if any.
+        # Retrieved from the given options under 'mc-workers'. Defaults to '0', for a search in this process.
+        self.search_workers = int(options.get('mc-workers', 0))
+        assert 0 <= self.search_workers, "The number of search workers can not be negative."
+
+        # The pool of search workers, started by the first search.
+        self.parallel_search = None
+
+        # Whether the agent is part way through a search, so its model updates are simulated ones
+        # that will be reverted.
+        self.simulating = False
+
+        # The path of the files the agent logs its actions and percepts to, and saves its snapshots to, if any.
+        # Retrieved from the given options under 'agent-checkpoint'. Defaults to None, for no log or snapshots.
+        self.checkpoint_path = options.get('agent-checkpoint')
+
+        # The number of cycles between snapshots of the agent.
+        # Retrieved from the given options under 'agent-checkpoint-interval'. Defaults to '1000'.
+        self.checkpoint_interval = int(options.get('agent-checkpoint-interval', 1000))
+        assert 0 < self.checkpoint_interval, "The number of cycles between snapshots must be greater than zero."
+
+        # The log of the agent's real actions and percepts, if any.
+        self.symbol_log = None
+
+        # Reset the agent, but keep the model of a context tree reopened from its file, and the agent's
+        # state kept with it.
+        if getattr(self.context_tree, 'reopened', False):
+            agent.Agent.reset(self)
+            self.age, self.total_reward, self.last_update = self.context_tree.agent_state
+        else:
+            self.reset()
+        # end if
+
+        # Recover the agent from its latest snapshot and log, if any, and log from there on.
+        if self.checkpoint_path is not None:
+            self.symbol_log = symbol_log.SymbolLog(self.checkpoint_path + '.log',
+                                                   self.environment.options['action-bits'],
+                                                   self.environment.options['percept-bits'])
+            self.recover()
+        # end if
+
+    # end def
+
+    def checkpoint(self):
+        """ Saves a snapshot of the agent to `<path>.model`, where `path` is its 'agent-checkpoint' option,
+            then restarts its log of actions and percepts from the snapshot.
+
+            A frozen model (see `freeze`) is saved as its compiled predictions, so that the log is
+            restarted, and stays short, once the agent stops learning as well.
+        """
+
+        snapshot_path = self.checkpoint_path + '.model'
+        temporary_path = snapshot_path + '.new'
 
-        self.reset()
+        # Write the snapshot beside the last one, then move it over it, so that one of them is always complete.
+        self.save(temporary_path)
+        os.replace(temporary_path, snapshot_path)
+
+        self.symbol_log.restart(self.model_update_count())
+
+    # end def
+
+    def advance_search_tree(self, kind, key):
+        """ Replaces the kept search tree, if any, with its child for the given real action or percept,
+            which is the tree the next search starts from, or with None if it has no such child.
+            The statistics of the tree are discounted once for each cycle. (See `MonteCarloSearchNode.discount`.)
+
+            - `kind`: `action_update` or `percept_update`.
+            - `key`: the action, or the percept as an (observation, reward) tuple.
+        """
+
+        if self.search_tree is None:
+            return
+
+        # The children of chance nodes are keyed by the whole percept when they cache percepts.
+        if kind == percept_update and not self.percept_cache:
+            key = key[0]
+
+        self.search_tree = self.search_tree.advance(key)
+
+        if kind == percept_update and self.search_tree is not None:
+            self.search_tree.discount(self.reuse_discount)
 
     # end def
 
@@ -236,6 +524,59 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
     # end def
 
+    def fork(self):
+        """ Returns a copy of the agent, with a snapshot of its context tree, which can be updated,
+            reverted and searched with independently of this agent. (See `CTWContextTree.snapshot`.)
+
+            With the 'persistent' context tree engine the snapshot shares every node with this
+            agent's model, so a fork takes constant time, and this agent can keep learning while
+            its forks read (or search with) the model as it was when they were forked. The fork
+            shares this agent's environment and options, so it should not act in the environment.
+        """
+
+        fork = copy.copy(self)
+        fork.context_tree = self.context_tree.snapshot()
+        fork.simulating = False
+        fork.symbol_log = None
+        fork.parallel_search = None
+        fork.search_tree = None
+        fork.search_pool = None
+
+        return fork
+
+    # end def
+
+    def freeze(self):
+        """ Compiles the agent's context tree (or each tree of a factored model) into a read-only
+            `ctw_frozen.FrozenCTWContextTree`, which predicts as the tree does now, but never
+            learns again. Both actions and percepts are then only added to its history.
+        """
+
+        if self.frozen:
+            return
+
+        if self.factored:
+            factors = []
+
+            for factor in self.context_tree.factors:
+                frozen_factor = ctw_frozen.FrozenCTWContextTree(self.depth, history_window=self.history_window())
+                frozen_factor.compile(factor)
+                factors.append(frozen_factor)
+            # end for
+
+            self.context_tree.factors = factors
+        else:
+            frozen_tree = ctw_frozen.FrozenCTWContextTree(self.depth, history_window=self.history_window())
+            frozen_tree.compile(self.context_tree)
+            self.context_tree = frozen_tree
+        # end if
+
+        self.frozen = True
+
+        self.stop_search_workers()
+
+    # end def
+
     def generate_action(self):
         """ Returns an action generated according to the agent's history
             statistics by doing rejection sampling from the context tree.
@@ -243,6 +584,10 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
         assert self.last_update == percept_update, "An action after a percept"
 
+        # The model has no statistics of the actions to sample from.
+        if self.skip_actions:
+            return self.generate_random_action()
+
         t = 0
         action = None
 
@@ -253,36 +598,109 @@ class MC_AIXI_CTW_Agent(agent.Agent):
         if action in self.environment.valid_actions:
             return action
 
-        return max(self.environment.valid_actions, key=lambda x: self.get_predicted_action_probability(x))
+        action_distribution = self.get_predicted_action_distribution()
+
+        return max(self.environment.valid_actions, key=lambda x: action_distribution[x])
     # end def
 
-    def generate_percept(self):
+    def generate_percept(self, probability_cache=None):
         """ Returns a percept (an observation, reward pair) distributed according to the agent's history
             statistics by sampling from the context tree.
+
+            - `probability_cache`: an optional cache of the model's percept distribution in its
+                                   current state. (See `CTWContextTree.generate_random_symbols`.)
         """
 
         assert self.last_update == action_update, "A percept after an action"
 
-        observation, reward = self.decode_percept(self.context_tree.generate_random_symbols(self.environment.options['percept-bits']))
+        observation, reward = self.decode_percept(self.context_tree.generate_random_symbols(
+            self.environment.options['percept-bits'], probability_cache))
 
         return observation, reward
     # end def
 
-    def generate_percept_and_update(self):
+    def generate_percept_and_update(self, probability_cache=None):
+        """ Returns a percept (an observation, reward pair) distributed according to the agent's history
+            statistics, after updating the agent's model with it.
+
+            While the agent is learning, the percept symbols are sampled from and added to the context
+            tree in a single pass, rather than being sampled, reverted and then added again. The percept
+            is then a simulated one, so this is only used during a search: a real percept is logged,
+            and maintains the model and the search tree, as `model_update_percept` describes.
+
+            - `probability_cache`: an optional cache of the model's percept distribution in its
+                                   current state. When given, the percept is sampled from the cache
+                                   and only the chosen percept is added to the context tree.
+        """
+
         assert self.last_update == action_update, "Can only perform an percept update after an action update"
 
-        observation, reward = self.generate_percept()
-        self.model_update_percept(observation, reward)
+        if (self.learning_period > 0) and (self.age > self.learning_period):
+            observation, reward = self.generate_percept(probability_cache)
+            self.model_update_percept(observation, reward)
+
+            return observation, reward
+        # end if
+
+        assert self.simulating, "Only a simulated percept can be generated and added in a single pass."
+
+        percept_bits = self.environment.options['percept-bits']
+
+        if probability_cache is None:
+            percept_symbols = self.context_tree.generate_random_symbols_and_update(percept_bits)
+        else:
+            percept_symbols = self.context_tree.generate_cached_symbols(percept_bits, probability_cache)
+
+        observation, reward = self.decode_percept(percept_symbols)
+
+        # Update other properties, as `model_update_percept` does.
+        self.total_reward += reward
+        self.last_update = percept_update
 
         return observation, reward
 
     # end def
 
     def get_predicted_action_probability(self, action):
+        if self.skip_actions:
+            return 1.0 / len(self.environment.valid_actions)
+
         binary_action = self.encode_action(action)
 
         return self.context_tree.predict(binary_action)
 
+    def get_predicted_action_distribution(self):
+        """ Returns a dictionary of the predicted probability of each valid action, computed in
+            a single pass over the shared prefixes of the actions' symbols.
+        """
+
+        actions = self.environment.valid_actions
+
+        # The model has no statistics of the actions to predict from, so they are all equally likely.
+        if self.skip_actions:
+            return dict([(action, 1.0 / len(actions)) for action in actions])
+
+        probabilities = self.context_tree.predict_distribution([self.encode_action(action) for action in actions])
+
+        return dict(zip(actions, probabilities))
+
+    # end def
+
+    def get_predicted_percept_distribution(self):
+        """ Returns a dictionary of the predicted probability of each valid percept, keyed by
+            (observation, reward) pairs, computed in a single pass over the shared prefixes of
+            the percepts' symbols.
+        """
+
+        percepts = [(observation, reward) for observation in self.environment.valid_observations
+                    for reward in self.environment.valid_rewards]
+        probabilities = self.context_tree.predict_distribution(
+            [self.encode_percept(observation, reward) for observation, reward in percepts])
+
+        return dict(zip(percepts, probabilities))
+
+    # end def
+
     def get_predicted_percept_probability(self, observation, reward):
 
 
@@ -300,6 +718,33 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
     # end def
 
+    def history_window(self):
+        """ Returns the largest number of symbols the agent reverts at once, which is the
+            number of symbols in a full simulation of the planning horizon plus one more
+            action or percept.
+        """
+
+        cycle_bits = self.environment.options['action-bits'] + self.environment.options['percept-bits']
+
+        return self.horizon * cycle_bits + self.maximum_bits_needed()
+
+    # end def
+
+    def load(self, path):
+        """ Replaces the state of the agent, and its model, with those saved in the given file by `save`.
+            The agent must be configured as the saved agent was. (See `ctw_serialization.load_agent`.)
+        """
+
+        self.stop_search_workers()
+        self.search_tree = None
+
+        with open(path, 'rb') as stream:
+            ctw_serialization.load_agent(stream, self)
+
+        self.record_mapped_state()
+
+    # end def
+
     def maximum_bits_needed(self):
         """ Returns the maximum number of bits needed to represent actions or percepts.
             NOTE: this is for binary alphabets.
@@ -327,6 +772,22 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
     # end def
 
+    def model_eviction_counts(self):
+        """ Returns the number of times nodes have been evicted from the agent's context tree,
+            and the number of subtrees and nodes evicted, as a tuple.
+        """
+        tree = self.context_tree
+        return tree.evictions, tree.evicted_subtrees, tree.evicted_nodes
+
+    # end def
+
+    def model_size_by_depth(self):
+        """ Returns the number of nodes at each depth of the agent's context tree.
+        """
+        return self.context_tree.size_by_depth()
+
+    # end def
+
     def model_update_action(self, action):
         # The last update must have been a percept, else this action update is invalid.
         assert self.last_update == percept_update, "Can only perform an action update after a percept update."
@@ -336,13 +797,46 @@ class MC_AIXI_CTW_Agent(agent.Agent):
         # Get the symbols that represent this action.
         action_symbols = self.encode_action(action)
 
-        # Update the context tree.
-        self.context_tree.update(action_symbols)
+        # Log a real action before updating the model with it, and record it for the search workers.
+        if not self.simulating:
+            if self.symbol_log is not None:
+                self.symbol_log.append(action_update, action_symbols)
+            if self.parallel_search is not None:
+                self.parallel_search.record(action_update, action_symbols)
+        # end if
+
+        # Update the context tree, or only its history if actions are not modelled.
+        if self.skip_actions:
+            self.context_tree.update_history(action_symbols)
+        else:
+            self.context_tree.update(action_symbols)
+
+            if not self.simulating:
+                self.context_tree.enforce_node_budget()
+        # end if
 
         # Update other properties.
         self.age += 1
         self.last_update = action_update
 
+        # Keep the search tree of the real action, if it is reused, and the agent's state with a mapped model.
+        if not self.simulating:
+            self.advance_search_tree(action_update, action)
+            self.record_mapped_state()
+        # end if
+
+        # Take a snapshot of the agent every `checkpoint_interval` cycles.
+        if self.symbol_log is not None and not self.simulating and self.age % self.checkpoint_interval == 0:
+            self.checkpoint()
+
+    # end def
+
+    def model_update_count(self):
+        """ Returns the number of updates (of actions and of percepts) the agent's model has had.
+        """
+
+        return 2 * self.age + (1 if self.last_update == percept_update else 0)
+
     # end def
 
     def model_update_percept(self, observation, reward):
@@ -361,19 +855,39 @@ class MC_AIXI_CTW_Agent(agent.Agent):
         # Get the symbols that represent this percept from the given observation and reward.
         percept_symbols = self.encode_percept(observation, reward)
 
+        # Log a real percept before updating the model with it, and record it for the search workers.
+        if not self.simulating:
+            if self.symbol_log is not None:
+                self.symbol_log.append(percept_update, percept_symbols)
+            if self.parallel_search is not None:
+                self.parallel_search.record(percept_update, percept_symbols)
+        # end if
+
         # Are we still meant to be learning?
         if (self.learning_period > 0) and (self.age > self.learning_period):
             # No. Update, but don't learn.
             self.context_tree.update_history(percept_symbols)
+
+            if self.freeze_after_learning and not self.simulating:
+                self.freeze()
         else:
             # Yes. Update and learn.
             self.context_tree.update(percept_symbols)
+
+            if not self.simulating:
+                self.context_tree.enforce_node_budget()
         # end if
 
         # Update other properties.
         self.total_reward += reward
         self.last_update = percept_update
 
+        # Keep the search tree of the real percept, if it is reused, and the agent's state with a mapped model.
+        if not self.simulating:
+            self.advance_search_tree(percept_update, (observation, reward))
+            self.record_mapped_state()
+        # end if
+
     # end def
 
     def playout(self, horizon):
@@ -399,6 +913,113 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
     # end def
 
+    def record_mapped_state(self):
+        """ Writes the agent's age, total reward and last update to the file its model is kept in, with
+            the state of the model, if it is a 'mapped' context tree, so that both are reopened as they
+            are now. (See `ctw_mapped.MappedCTWContextTree.record_agent_state`.)
+        """
+
+        if isinstance(self.context_tree, ctw_mapped.MappedCTWContextTree):
+            self.context_tree.record_agent_state(self.age, self.total_reward, self.last_update)
+
+    # end def
+
+    def recover(self):
+        """ Recovers the agent from its checkpoint (see `checkpoint`): loads its latest snapshot, if any,
+            then replays the actions and percepts logged since it was taken.
+        """
+
+        snapshot_path = self.checkpoint_path + '.model'
+
+        if os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+        # The log may start before the snapshot, if the process died after taking the snapshot,
+        # but before restarting the log. The records before the snapshot are then skipped.
+        records = self.symbol_log.records()
+        skipped = self.model_update_count() - self.symbol_log.start
+
+        assert 0 <= skipped <= len(records), "The agent's snapshot does not match its log."
+
+        self.replay(records[skipped:])
+        self.record_mapped_state()
+
+    # end def
+
+    def replay(self, records):
+        """ Updates the agent, and its model, with the given logged actions and percepts, as
+            `model_update_action` and `model_update_percept` did when they were made.
+
+            The symbols of consecutive actions and percepts that the model learns are added with a
+            single `update` of its context tree, and those it does not with a single `update_history`,
+            unless the model maintains itself after each update (see `CTWContextTree.enforce_node_budget`),
+            by evicting nodes from a node budget or halving the counts of a compact engine. A model
+            frozen once the learning period expires is frozen after the same percept as it was.
+            - `records`: a list of the kind and symbols of each update. (See `SymbolLog.records`.)
+        """
+
+        # Search workers would not see the replayed updates, so they are started again by the next search.
+        self.stop_search_workers()
+
+        maintained = self.context_tree.max_nodes is not None or \
+            issubclass(ctw_engines[self.ctw_engine], ctw_compact.CompactCTWContextTree)
+
+        batch = []
+        batch_learned = True
+
+        def flush():
+            """ Adds the batched symbols to the model. """
+
+            if batch:
+                if batch_learned:
+                    self.context_tree.update(batch)
+                else:
+                    self.context_tree.update_history(batch)
+                del batch[:]
+            # end if
+        # end def
+
+        for kind, symbol_list in records:
+            if kind == action_update:
+                assert self.last_update == percept_update, "Can only replay an action after a percept."
+
+                learned = not self.skip_actions
+                self.age += 1
+            else:
+                assert self.last_update == action_update, "Can only replay a percept after an action."
+
+                learned = not ((self.learning_period > 0) and (self.age > self.learning_period))
+                self.total_reward += self.decode_percept(symbol_list)[1]
+            # end if
+
+            self.last_update = kind
+
+            if kind == action_update:
+                self.advance_search_tree(kind, self.decode_action(symbol_list))
+            else:
+                self.advance_search_tree(kind, self.decode_percept(symbol_list))
+            # end if
+
+            if learned != batch_learned:
+                flush()
+                batch_learned = learned
+            # end if
+
+            batch.extend(symbol_list)
+
+            if learned and maintained:
+                flush()
+                self.context_tree.enforce_node_budget()
+            elif not learned and kind == percept_update and self.freeze_after_learning and not self.frozen:
+                flush()
+                self.freeze()
+            # end if
+        # end for
+
+        flush()
+
+    # end def
+
     def reset(self):
         """ Resets the agent and clears the context tree.
         """
@@ -408,23 +1029,133 @@ class MC_AIXI_CTW_Agent(agent.Agent):
 
         # Reset the basic agent details.
         agent.Agent.reset(self)
+        self.record_mapped_state()
+
+        self.stop_search_workers()
+        self.search_tree = None
+
+        # Start the agent's log again from its reset state.
+        if self.symbol_log is not None:
+            self.checkpoint()
 
     # end def
 
-    def search(self):
-        """ Returns the best action for this agent as determined using the Monte-Carlo Tree Search
-            (predictive UCT).
+    def sample_search_tree(self, simulations, seconds=None, min_simulations=0):
+        """ Returns a Monte Carlo search tree, sampled the given number of times from the agent's
+            current state, which is restored after each simulation. The tree is the one kept from
+            the last search, if the search tree is reused (see `advance_search_tree`), or a new one,
+            which is the agent's search pool, cleared, if nodes are stored in a pool. The number of simulations completed is kept in `search_simulations`.
+
+            - `simulations`: the number of simulations to run.
+            - `seconds`: the time, measured by the agent's search clock, after which no more simulations
+                         are started, once at least `min_simulations` have been run. Defaults to None, for
+                         no time limit.
+            - `min_simulations`: the number of simulations to run, however long they take.
         """
 
-        # Use rhoUCT to search for the next action.
+        # Use rhoUCT to search for the next action, from the kept search tree if there is one.
         undo_instance = MC_AIXI_CTW_Undo(self)
-        mc_search_tree = monte_carlo_search_tree.MonteCarloSearchNode(decision_node)
 
-        for i in range(self.mc_simulations):
+        if self.search_tree is not None:
+            mc_search_tree = self.search_tree
+        elif self.search_store == 'pool':
+            if self.search_pool is None:
+                self.search_pool = monte_carlo_search_pool.MonteCarloSearchPool(self.search_pool_size)
+
+            mc_search_tree = self.search_pool
+            mc_search_tree.clear()
+        else:
+            mc_search_tree = monte_carlo_search_tree.MonteCarloSearchNode(decision_node)
+        # end if
+
+        clock = search_clocks[self.search_clock]
+        deadline = None if seconds is None else clock() + seconds
+
+        self.simulating = True
+
+        completed = 0
+
+        while completed < simulations:
+            if deadline is not None and completed >= min_simulations and clock() >= deadline:
+                break
+
             mc_search_tree.sample(self, self.horizon)
             self.model_revert(undo_instance)
+            completed += 1
+        # end while
+
+        self.simulating = False
+        self.context_tree.end_journal()
+
+        # The simulated updates have been reverted, so a mapped model's file is clean again.
+        self.record_mapped_state()
+
+        self.search_simulations = completed
+
+        if self.reuse_search_tree:
+            self.search_tree = mc_search_tree
+
+        return mc_search_tree
+
+    # end def
+
+    def save(self, path):
+        """ Saves the state of the agent (its age, total reward, last update and learning period), and its
+            model, to the given file, in the binary format of `ctw_serialization`.
+        """
+
+        with open(path, 'wb') as stream:
+            ctw_serialization.save_agent(self, stream)
+
+    # end def
+
+    def search(self):
+        """ Returns the best action for this agent as determined using the Monte-Carlo Tree Search
+            (predictive UCT), either in this process or, with the 'mc-workers' option, by merging
+            the searches of the agent's search workers.
+
+            The search runs `mc_simulations` simulations or, with the 'mc-search-time-ms' option, as
+            many as it can in that time, between `min_simulations` and `max_simulations`. The number
+            it completed is kept in `search_simulations`. An action is chosen at random if the
+            search had too few simulations to try any.
+        """
+
+        if self.search_time is not None:
+            simulations = self.max_simulations or sys.maxsize
+            seconds = self.search_time / 1000.0
+            min_simulations = self.min_simulations
+        else:
+            simulations, seconds, min_simulations = self.mc_simulations, None, 0
+        # end if
+
+        if self.search_workers > 0:
+            # Start the search workers, with a copy of the model as it is now, if they are not running.
+            if self.parallel_search is None:
+                self.parallel_search = parallel_search.RootParallelSearch(self, self.search_workers)
+
+            self.search_simulations, statistics = self.parallel_search.search(simulations, seconds, min_simulations)
+        else:
+            mc_search_tree = self.sample_search_tree(simulations, seconds, min_simulations)
+            statistics = mc_search_tree.statistics()
+        # end if
+
+        if not statistics:
+            return self.generate_random_action()
 
         #Return best action according to their expected reward. Break ties randomly
-        return max(mc_search_tree.children.keys(), key=lambda x: mc_search_tree.children[x].mean+random.random()*0.0000001)
+        return max(statistics.keys(), key=lambda x: statistics[x][1]+random.random()*0.0000001)
+    # end def
+
+    def stop_search_workers(self):
+        """ Stops the agent's search workers, if they are running, so that the next search starts them
+            again with a copy of the model as it is then. This is needed whenever the model is
+            replaced or changed other than by real actions and percepts.
+        """
+
+        if self.parallel_search is not None:
+            self.parallel_search.close()
+            self.parallel_search = None
+        # end if
+
     # end def
 # end class
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a Monte Carlo search tree that keeps its nodes in a pool of preallocated parallel arrays.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+from array import array
+
+from monte_carlo_search_tree import MonteCarloSearchNode, chance_node, decision_node, playout_hurdle, select_ucb_index
+from monte_carlo_search_tree import numpy, vectorized_action_count
+
+# The index used to mark a missing child or sibling.
+no_node = -1
+
+
+class MonteCarloSearchPool:
+    """ A Monte Carlo search tree that stores its nodes in a struct-of-arrays pool instead of
+        allocating a `MonteCarloSearchNode` object per node, and is sampled in the same way.
+
+        Node `i` of the tree is described by the `i`-th entry of each of the parallel arrays:
+
+         - `visits`, `mean`: the number of times the node has been visited, and its sampled expected reward.
+         - `node_type`: whether the node is a `chance_node` or a `decision_node`.
+         - `key`: the action or percept that leads to the node from its parent.
+         - `first_child`, `last_child`: the indices of the node's first and last children, or `no_node`.
+         - `next_sibling`: the index of the next child of the node's parent, or `no_node`.
+         - `percept_cache`: the cached percept distribution of a chance node, if the agent caches percepts.
+         - `child_map`: a dictionary of the children of a chance node by percept, once it has any.
+         - `unexplored`, `actions`, `selected`: the actions of a decision node that have not been tried,
+           with their children, if any, and once every action has, the children of the node with
+           their visits and mean rewards, as a tuple of three lists, and the index of the child last
+           selected, as `MonteCarloSearchNode.select_action` keeps them, or None (`no_node`) until then.
+
+        The children of each node are a list linked through `next_sibling`, in the order they were
+        added, and those of a chance node, of which there may be many, are also found by percept in
+        its `child_map`. Nodes are allocated from the front of the pool, whose arrays are allocated
+        once, and doubled in size when they are full, so `clear` only has to forget how many are in use.
+
+        Unlike a `MonteCarloSearchNode`, the pool is the whole tree, from the node `root`, and is
+        kept and reused by its agent from one search to the next.
+    """
+
+    # Instance methods.
+
+    def __init__(self, capacity=1024):
+        """ Creates an empty search tree, with room for the given number of nodes before its arrays grow.
+
+            - `capacity`: the number of nodes to allocate the arrays for.
+        """
+
+        assert capacity > 0, "The search pool needs room for at least one node."
+
+        self.allocate_arrays(capacity)
+
+        self.clear()
+
+    # end def
+
+    def add_child(self, node, key, nodetype):
+        """ Returns the index of a new node of the given type, added as the last child of the given
+            node for the given action or percept.
+        """
+
+        child = self.allocate_node(nodetype, key)
+
+        last = self.last_child[node]
+
+        if last == no_node:
+            self.first_child[node] = child
+        else:
+            self.next_sibling[last] = child
+        # end if
+
+        self.last_child[node] = child
+
+        if self.node_type[node] == chance_node:
+            if self.child_map[node] is None:
+                self.child_map[node] = {}
+
+            self.child_map[node][key] = child
+        # end if
+
+        return child
+
+    # end def
+
+    def advance(self, key):
+        """ Makes the child of the root for the given action or percept the root of the tree, and removes
+            every other node, moving the nodes that are kept to the front of the pool. Returns the
+            pool, or None if the root has no such child. (See `MC_AIXI_CTW_Agent.advance_search_tree`.)
+
+            The actions that the kept decision nodes cached for `select_action` refer to the old
+            indices of their children, so they are dropped, and found again as they are needed.
+
+            - `key`: the action or percept.
+        """
+
+        child = self.child(self.root, key)
+
+        if child == no_node:
+            return None
+
+        # Copy the subtree of the child, breadth first, into new arrays.
+        visits, mean, node_type, keys = self.visits, self.mean, self.node_type, self.key
+        first_child, next_sibling, percept_cache = self.first_child, self.next_sibling, self.percept_cache
+
+        self.allocate_arrays(self.capacity)
+        self.tree_size = 0
+
+        self.root = self.allocate_node(node_type[child], keys[child])
+        queue = [(child, self.root)]
+
+        for old_node, node in queue:
+            self.visits[node] = visits[old_node]
+            self.mean[node] = mean[old_node]
+            self.percept_cache[node] = percept_cache[old_node]
+
+            old_child = first_child[old_node]
+
+            while old_child != no_node:
+                queue.append((old_child, self.add_child(node, keys[old_child], node_type[old_child])))
+                old_child = next_sibling[old_child]
+            # end while
+        # end for
+
+        return self
+
+    # end def
+
+    def allocate_arrays(self, capacity):
+        """ Allocates new, empty, arrays for the given number of nodes.
+        """
+
+        self.capacity = capacity
+
+        self.visits = array('q', [0]) * capacity
+        self.mean = array('d', [0.0]) * capacity
+        self.node_type = array('b', [0]) * capacity
+        self.first_child = array('i', [no_node]) * capacity
+        self.last_child = array('i', [no_node]) * capacity
+        self.next_sibling = array('i', [no_node]) * capacity
+        self.key = [None] * capacity
+        self.percept_cache = [None] * capacity
+        self.child_map = [None] * capacity
+        self.unexplored = [None] * capacity
+        self.actions = [None] * capacity
+        self.selected = array('i', [no_node]) * capacity
+
+    # end def
+
+    def allocate_node(self, nodetype, key):
+        """ Returns the index of a fresh node of the given type, reached by the given action or percept,
+            taken from the front of the pool, which is doubled in size if it is full.
+        """
+
+        node = self.tree_size
+
+        if node == self.capacity:
+            self.grow()
+
+        self.tree_size = node + 1
+
+        self.visits[node] = 0
+        self.mean[node] = 0.0
+        self.node_type[node] = nodetype
+        self.first_child[node] = no_node
+        self.last_child[node] = no_node
+        self.next_sibling[node] = no_node
+        self.key[node] = key
+        self.percept_cache[node] = None
+        self.child_map[node] = None
+        self.unexplored[node] = None
+        self.actions[node] = None
+        self.selected[node] = no_node
+
+        return node
+
+    # end def
+
+    def bytes_per_node(self):
+        """ Returns the number of bytes each node takes in the arrays and lists of the pool, not counting
+            the keys, cached percept distributions, child maps and cached actions that its lists refer to.
+        """
+
+        return sum([column.itemsize for column in (self.visits, self.mean, self.node_type, self.first_child,
+                                                   self.last_child, self.next_sibling, self.selected)]) + \
+            5 * array('P').itemsize
+
+    # end def
+
+    def child(self, node, key):
+        """ Returns the index of the child of the given node for the given action or percept, or `no_node`.
+            The child of a chance node is found in its `child_map`, and that of a decision node by
+            walking its children.
+        """
+
+        if self.node_type[node] == chance_node:
+            child_map = self.child_map[node]
+
+            return no_node if child_map is None else child_map.get(key, no_node)
+        # end if
+
+        keys, next_sibling = self.key, self.next_sibling
+
+        child = self.first_child[node]
+
+        while child != no_node and keys[child] != key:
+            child = next_sibling[child]
+
+        return child
+
+    # end def
+
+    def children(self, node):
+        """ Returns a dictionary of the children of the given node, by their action or percept.
+        """
+
+        keys, next_sibling = self.key, self.next_sibling
+
+        children = {}
+        child = self.first_child[node]
+
+        while child != no_node:
+            children[keys[child]] = child
+            child = next_sibling[child]
+        # end while
+
+        return children
+
+    # end def
+
+    def clear(self):
+        """ Empties the tree, leaving only a new root decision node. The arrays are kept, and the
+            fields of each node are reset as it is allocated again, so this takes constant time.
+        """
+
+        self.tree_size = 0
+        self.root = self.allocate_node(decision_node, None)
+
+    # end def
+
+    def discount(self, factor):
+        """ Scales the visits of every node by the given factor, rounded down, and clears their cached
+            percept distributions and actions. (See `MonteCarloSearchNode.discount`.)
+
+            - `factor`: the factor to scale the visits by, between 0 and 1.
+        """
+
+        visits = self.visits
+
+        for node in range(self.tree_size):
+            visits[node] = int(visits[node] * factor)
+            self.percept_cache[node] = None
+
+            # Children whose visits are rounded down to zero are tried again.
+            self.unexplored[node] = None
+            self.actions[node] = None
+        # end for
+
+    # end def
+
+    def grow(self):
+        """ Doubles the number of nodes the arrays have room for.
+        """
+
+        extra = self.capacity
+
+        self.visits.extend(array('q', [0]) * extra)
+        self.mean.extend(array('d', [0.0]) * extra)
+        self.node_type.extend(array('b', [0]) * extra)
+        self.first_child.extend(array('i', [no_node]) * extra)
+        self.last_child.extend(array('i', [no_node]) * extra)
+        self.next_sibling.extend(array('i', [no_node]) * extra)
+        self.key.extend([None] * extra)
+        self.percept_cache.extend([None] * extra)
+        self.child_map.extend([None] * extra)
+        self.unexplored.extend([None] * extra)
+        self.actions.extend([None] * extra)
+        self.selected.extend(array('i', [no_node]) * extra)
+
+        self.capacity += extra
+
+    # end def
+
+    def sample(self, agent, horizon):
+        """ Returns the accumulated reward from performing a single sample on the root of the tree.
+            (See `MonteCarloSearchNode.sample`.)
+
+            - `agent`: the agent doing the sampling
+            - `horizon`: how many cycles into the future to sample
+        """
+
+        return self.sample_node(self.root, agent, horizon)
+
+    # end def
+
+    def sample_node(self, node, agent, horizon):
+        """ Returns the accumulated reward from performing a single sample on the given node.
+        """
+
+        reward = 0.0
+
+        if horizon == 0:
+            # reach the depth and return the final reward
+            return reward
+
+        if self.node_type[node] == chance_node:
+            if agent.percept_cache:
+                cache = self.percept_cache[node]
+
+                if cache is None:
+                    cache = self.percept_cache[node] = {}
+
+                observation, r = agent.generate_percept_and_update(cache)
+                percept = (observation, r)
+            else:
+                observation, r = agent.generate_percept_and_update()
+                percept = observation
+            # end if
+
+            child = self.child(node, percept)
+
+            if child == no_node:
+                child = self.add_child(node, percept, decision_node)
+
+            reward = r + self.sample_node(child, agent, horizon - 1)
+
+        elif self.visits[node] <= playout_hurdle:
+            reward = agent.playout(horizon)
+        else:
+            action, child = self.select_action(node, agent)
+            agent.model_update_action(action)
+
+            if child == no_node:
+                child = self.add_child(node, action, chance_node)
+
+            reward = self.sample_node(child, agent, horizon)
+        # end if
+
+        visits = self.visits[node]
+        self.mean[node] = (reward + 1.0 * self.mean[node] * visits) / (1.0 * visits + 1.0)
+        self.visits[node] = visits + 1
+
+        return reward
+
+    # end def
+
+    def select_action(self, node, agent):
+        """ Returns an action for the given decision node, selected according to the UCB policy,
+            in the same way as `MonteCarloSearchNode.select_action`, and the index of the node's
+            child for the action, or `no_node` if it has none yet.
+
+            The unexplored actions are kept with their children, if any, and once every action has
+            been tried, the children, visits and mean rewards of the node's actions are kept, of
+            which only the entry of the action selected last has to be refreshed.
+        """
+
+        visits, means = self.visits, self.mean
+
+        #Force to explore an unexplored action
+        unexplored = self.unexplored[node]
+
+        if unexplored is None:
+            children = self.children(node)
+            unexplored = self.unexplored[node] = [(action, children.get(action, no_node))
+                                                  for action in agent.environment.valid_actions
+                                                  if action not in children or visits[children[action]] == 0]
+        # end if
+
+        if len(unexplored) > 0:
+            choice = random.choice(unexplored)
+            unexplored.remove(choice)
+            return choice
+        # end if
+
+        if self.actions[node] is None:
+            action_children = list(self.children(node).values())
+            action_visits = [visits[child] for child in action_children]
+            action_means = [means[child] for child in action_children]
+
+            # Keep the statistics of many actions in numpy arrays, to be scored without being converted.
+            if numpy is not None and len(action_children) >= vectorized_action_count:
+                action_visits = numpy.array(action_visits, dtype=numpy.float64)
+                action_means = numpy.array(action_means, dtype=numpy.float64)
+            # end if
+
+            self.actions[node] = (action_children, action_visits, action_means)
+        else:
+            action_children, action_visits, action_means = self.actions[node]
+
+            selected = self.selected[node]
+            action_visits[selected] = visits[action_children[selected]]
+            action_means[selected] = means[action_children[selected]]
+        # end if
+
+        selected = select_ucb_index(action_visits, action_means, visits[node],
+                                    1.0 * agent.horizon * agent.reward_range, MonteCarloSearchNode.exploration_constant)
+        self.selected[node] = selected
+
+        child = action_children[selected]
+
+        return self.key[child], child
+
+    # end def
+
+    def size(self):
+        """ Returns the number of nodes in the tree.
+        """
+
+        return self.tree_size
+
+    # end def
+
+    def statistics(self):
+        """ Returns a dictionary of the visits and mean reward of each child of the root, by action.
+        """
+
+        return dict([(action, (self.visits[child], self.mean[child]))
+                     for action, child in self.children(self.root).items()])
+
+    # end def
+# end class
@@ -20,6 +20,12 @@ sys.path.insert(0, PROJECT_ROOT)
 
 import util
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# end try
+
 # An enumeration type used to specify the type of Monte Carlo search node.
 # Chance nodes represent a set of possible observation
 # (one child per observation) while decision nodes
@@ -33,6 +39,74 @@ decision_node = nodetype_enum.decision
 
 playout_hurdle = 0
 
+# The number of actions from which the UCB priorities of a node's actions are scored with numpy,
+# if it is installed, rather than one at a time.
+vectorized_action_count = 192
+
+
+def select_ucb_index(visits, means, parent_visits, scale, exploration_constant):
+    """ Returns the index of the action chosen by the UCB policy (Definition 6) from the given
+        visits and mean rewards of each action, all of which have been visited.
+
+        Each action's priority is its mean reward, divided by the given scale, plus its exploration
+        bonus. The actions are tried in order, and one replaces the best so far if its priority,
+        with a uniform random tie-break of at most 0.0005 either way, is greater than the best's
+        priority, so that close priorities are chosen between at random. A random number is drawn
+        for every action but the first, whether or not numpy is used, so the choice, and the state
+        of the `random` module afterwards, are the same either way. (With numpy, the random numbers
+        are made from the same 32 bit words of the `random` module's generator as `random.random`
+        would make them from, two to a number, taken at once with `random.getrandbits`.)
+
+        - `visits`, `means`: the visits and mean reward of each action, as lists or numpy arrays.
+        - `parent_visits`: the visits of the node the actions are chosen at.
+        - `scale`: the horizon times the range of the environment's rewards.
+        - `exploration_constant`: the weight of the exploration bonus.
+    """
+
+    log_visits = math.log(parent_visits)
+
+    if numpy is not None and len(visits) >= vectorized_action_count:
+        priorities = numpy.asarray(means) / scale + \
+                     exploration_constant * numpy.sqrt(log_visits / numpy.asarray(visits, dtype=numpy.float64))
+
+        count = len(visits) - 1
+        words = numpy.frombuffer(random.getrandbits(64 * count).to_bytes(8 * count, 'little'), dtype='<u4')
+        uniforms = ((words[0::2] >> 5) * 67108864.0 + (words[1::2] >> 6)) / 9007199254740992.0
+        noisy_priorities = priorities[1:] + (uniforms - 0.5) * 0.001
+
+        # Jump from each best action to the first later one that replaces it.
+        best = 0
+
+        while best < count:
+            replaces = noisy_priorities[best:] > priorities[best]
+            replacement = int(replaces.argmax())
+
+            if not replaces[replacement]:
+                break
+
+            best += replacement + 1
+        # end while
+
+        return best
+    # end if
+
+    best = 0
+    max_priority = means[0] / scale + exploration_constant * math.sqrt(log_visits / visits[0])
+
+    for index in range(1, len(visits)):
+        priority = means[index] / scale + exploration_constant * math.sqrt(log_visits / visits[index])
+
+        if priority + (random.random() - 0.5) * 0.001 > max_priority:
+            best = index
+            max_priority = priority
+        # end if
+    # end for
+
+    return best
+
+# end def
+
+
 class MonteCarloSearchNode:
     """ A class to represent a node in the Monte Carlo search tree.
         The nodes in the search tree represent simulated actions and percepts
@@ -60,7 +134,9 @@ class MonteCarloSearchNode:
 
           - The children of the node (`MonteCarloSearchNode.children`).
             The children are stored in a dictionary indexed by action (if
-            it is a decision node) or percept (if it is a chance node).
+            it is a decision node) or observation (if it is a chance node).
+            When the agent caches percepts, chance node children are indexed by
+            the whole (observation, reward) percept instead.
 
         The `MonteCarloSearchNode.sample` method is used to sample from the current node and
         the `MonteCarloSearchNode.selectAction` method is used to select an action according
@@ -96,6 +172,52 @@ class MonteCarloSearchNode:
 
         # The number of times this node has been visited during sampling.
         self.visits = 0
+
+        # The cached percept distribution of the agent's model at this (chance) node, if the agent
+        # caches percepts. (See `CTWContextTree.generate_random_symbols`.)
+        self.percept_cache = None
+
+        # The actions of this (decision) node that have not been tried, in the order of the environment's
+        # valid actions, or None until actions are first selected here. (See `select_action`.)
+        self.unexplored = None
+
+        # Once every action has been tried, the actions of this node's children, in the order they were
+        # added, with the visits and mean reward of each child, kept for the UCB policy, and the index of
+        # the action last selected, whose statistics are refreshed when the next action is selected.
+        self.actions = None
+        self.action_visits = None
+        self.action_means = None
+        self.selected = None
+    # end def
+
+    def advance(self, key):
+        """ Returns the child of this node for the given action or percept, or None if it has no such child.
+            (See `MC_AIXI_CTW_Agent.advance_search_tree`.)
+        """
+
+        return self.children.get(key)
+
+    # end def
+
+    def discount(self, factor):
+        """ Scales the visits of this node and of its descendants by the given factor, rounded down,
+            so that statistics sampled from an older model weigh less against new samples. Their
+            means are kept, and their cached percept distributions, which are of the older model,
+            are cleared.
+
+            - `factor`: the factor to scale the visits by, between 0 and 1.
+        """
+
+        self.visits = int(self.visits * factor)
+        self.percept_cache = None
+
+        # Children whose visits are rounded down to zero are tried again.
+        self.unexplored = None
+        self.actions = None
+
+        for child in self.children.values():
+            child.discount(factor)
+
     # end def
 
     def sample(self, agent, horizon):
@@ -114,12 +236,23 @@ class MonteCarloSearchNode:
 
         if self.type == chance_node:
             # if the node is chance node
-            observation, r = agent.generate_percept_and_update()
+            if agent.percept_cache:
+                # The model is in the same state whenever this node is reached, as long as the children
+                # are keyed by the whole percept, so its percept distribution can be cached here.
+                if self.percept_cache is None:
+                    self.percept_cache = {}
+
+                observation, r = agent.generate_percept_and_update(self.percept_cache)
+                percept = (observation, r)
+            else:
+                observation, r = agent.generate_percept_and_update()
+                percept = observation
+            # end if
 
-            if observation not in self.children.keys():
-                self.children[observation] = MonteCarloSearchNode(decision_node)
+            if percept not in self.children.keys():
+                self.children[percept] = MonteCarloSearchNode(decision_node)
 
-            reward = r + self.children[observation].sample(agent, horizon - 1)
+            reward = r + self.children[percept].sample(agent, horizon - 1)
 
         elif self.visits <= playout_hurdle:
             # if the node has not been roll out enough times,
@@ -142,49 +275,69 @@ class MonteCarloSearchNode:
 
     # end def
 
-    def select_action(self, agent):
-        """ Returns an action selected according to UCB policy.
-
-             - `agent`: the agent which is doing the sampling.
+    def size(self):
+        """ Returns the number of nodes in the tree below, and including, this node.
         """
 
-        unexplored_list = []
-
-
-        #Force to explore an unexplored action
-        for action in agent.environment.valid_actions:
+        return 1 + sum([child.size() for child in self.children.values()])
 
-            if action not in self.children or self.children[action].visits == 0:
-                # if this selected child has not been explored
-                # a new nod is added to the search tree
-
-                unexplored_list.append(action)
+    # end def
 
-        if len(unexplored_list) > 0:
-            return random.choice(unexplored_list)
+    def select_action(self, agent):
+        """ Returns an action selected according to UCB policy.
 
-        best_action = None
-        max_priority = None
+             An action that has not been tried is selected uniformly at random, if there are any.
+             The unexplored actions are kept from one selection to the next, and an action is removed
+             as it is selected, since the sample that follows visits it.
 
-        for action, node in self.children.items():
+             Once every action has been tried, the visits and mean reward of each child are kept in
+             lists (or numpy arrays, for `vectorized_action_count` actions or more), of which only the
+             entry of the action selected last has to be refreshed, and the action is chosen from them
+             by `select_ucb_index`.
 
-            # UCB policy in Definition 6
-            # m is the remaining search horizon
-            m = agent.horizon
+             - `agent`: the agent which is doing the sampling.
+        """
 
-            # each instantaneous reward is bounded in the interval [a,b]
-            interval = agent.environment.maximum_reward() - agent.environment.minimum_reward()
+        #Force to explore an unexplored action
+        if self.unexplored is None:
+            self.unexplored = [action for action in agent.environment.valid_actions
+                               if action not in self.children or self.children[action].visits == 0]
+        # end if
+
+        if len(self.unexplored) > 0:
+            action = random.choice(self.unexplored)
+            self.unexplored.remove(action)
+            return action
+        # end if
+
+        if self.actions is None:
+            self.actions = list(self.children.keys())
+            self.action_visits = [node.visits for node in self.children.values()]
+            self.action_means = [node.mean for node in self.children.values()]
+
+            # Keep the statistics of many actions in numpy arrays, to be scored without being converted.
+            if numpy is not None and len(self.actions) >= vectorized_action_count:
+                self.action_visits = numpy.array(self.action_visits, dtype=numpy.float64)
+                self.action_means = numpy.array(self.action_means, dtype=numpy.float64)
+            # end if
+        elif self.selected is not None:
+            node = self.children[self.actions[self.selected]]
+            self.action_visits[self.selected] = node.visits
+            self.action_means[self.selected] = node.mean
+        # end if
+
+        # UCB policy in Definition 6, with each instantaneous reward bounded in the interval [a,b]
+        self.selected = select_ucb_index(self.action_visits, self.action_means, self.visits,
+                                         1.0 * agent.horizon * agent.reward_range, self.exploration_constant)
+
+        return self.actions[self.selected]
+    # end def
 
-            # a_ucb(h) = argmax....(Definition 6)
-            current_priority = 1.0 * node.mean / (1.0 * m * interval) + self.exploration_constant * \
-                               math.sqrt(math.log(self.visits) / node.visits)
+    def statistics(self):
+        """ Returns a dictionary of the visits and mean reward of each child of this node, by action or percept.
+        """
 
-            #Select best action. Use random to avoid preemptive advantage
-            if best_action is None or current_priority + (random.random()-0.5)*0.001 > max_priority:
-                best_action = action
-                max_priority = current_priority
+        return dict([(key, (node.visits, node.mean)) for key, node in self.children.items()])
 
-        #select action uniformly at random in the unexplored action list.
-        return best_action
     # end def
 # end class
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a root-parallel Monte Carlo tree search, run by a pool of worker processes.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+import random
+
+
+def run_worker(connection, agent, seed):
+    """ Runs a search worker, in its own process, until it is sent None.
+
+        The worker searches with its own copy of a fork of the agent (see `MC_AIXI_CTW_Agent.fork`),
+        and seeds its random number generator with the given seed. For each request, of the real
+        actions and percepts the agent has had since the last one (see `MC_AIXI_CTW_Agent.replay`)
+        and the simulations to run (see `MC_AIXI_CTW_Agent.sample_search_tree`), it updates its fork
+        with the actions and percepts, searches its own search tree with the simulations, and sends
+        back the number of simulations it completed, and the action, visits and mean reward of each
+        child of the root.
+
+        - `connection`: the worker's end of the pipe to the agent.
+        - `agent`: the fork of the agent to search with.
+        - `seed`: the seed of the worker's random number generator.
+    """
+
+    random.seed(seed)
+
+    while True:
+        request = connection.recv()
+
+        if request is None:
+            break
+
+        records, simulations, seconds, min_simulations = request
+
+        agent.replay(records)
+        search_tree = agent.sample_search_tree(simulations, seconds, min_simulations)
+
+        connection.send((agent.search_simulations,
+                         [(action, visits, mean) for action, (visits, mean) in search_tree.statistics().items()]))
+    # end while
+
+    connection.close()
+
+# end def
+
+
+class RootParallelSearch:
+    """ A pool of persistent worker processes, each of which holds a copy of an agent's model,
+        and searches its own search tree with a share of the simulations of each search.
+
+        The workers are forked from the agent's process when the pool is created, each with its
+        own copy of a fork of the agent, so each starts with the model as it was then, without
+        it being sent to them. (The agent is forked first, so that the workers do not share a
+        memory-mapped model with it.) From then on, the agent records its real actions and
+        percepts with `record`, and they are sent to the workers with the next search, so the
+        workers' models follow the agent's. The visits and mean rewards the workers find for
+        each action at the root are merged.
+    """
+
+    # Instance methods.
+
+    def __init__(self, agent, worker_count):
+        """ Starts the given number of workers searching for the given agent.
+            Each worker's random number generator is seeded from the `random` module.
+
+            - `agent`: the agent to search for.
+            - `worker_count`: the number of worker processes.
+        """
+
+        assert worker_count > 0, "The search needs at least one worker."
+
+        # The real actions and percepts of the agent that have not been sent to the workers.
+        self.records = []
+
+        # The agent's end of the pipe to each worker, and the worker processes.
+        self.connections = []
+        self.workers = []
+
+        context = multiprocessing.get_context('fork')
+
+        fork = agent.fork()
+
+        for index in range(worker_count):
+            connection, worker_connection = context.Pipe()
+
+            worker = context.Process(target=run_worker, args=(worker_connection, fork, random.getrandbits(64)))
+            worker.daemon = True
+            worker.start()
+
+            worker_connection.close()
+
+            self.connections.append(connection)
+            self.workers.append(worker)
+        # end for
+
+    # end def
+
+    def close(self):
+        """ Stops the workers.
+        """
+
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        # end for
+
+        for worker in self.workers:
+            worker.join()
+
+        self.connections = []
+        self.workers = []
+
+    # end def
+
+    def record(self, kind, symbol_list):
+        """ Records a real action or percept of the agent, to be sent to the workers with the next search.
+
+            - `kind`: `action_update` or `percept_update`.
+            - `symbol_list`: the symbols of the action or percept.
+        """
+
+        self.records.append((kind, list(symbol_list)))
+
+    # end def
+
+    def search(self, simulations, seconds=None, min_simulations=0):
+        """ Returns the number of simulations completed, and a dictionary of the visits and mean reward of
+            each action at the root, from the given simulations, shared between the workers.
+            The visits of each action are the sum of those of the workers, and its mean the mean of
+            theirs, weighted by their visits.
+
+            - `simulations`, `min_simulations`: the most and least simulations to run, shared between the workers.
+            - `seconds`: the time after which each worker starts no more simulations, or None, for no time limit.
+              (See `MC_AIXI_CTW_Agent.sample_search_tree`.)
+        """
+
+        worker_count = len(self.workers)
+
+        for index, connection in enumerate(self.connections):
+            share = simulations // worker_count + (1 if index < simulations % worker_count else 0)
+            min_share = min_simulations // worker_count + (1 if index < min_simulations % worker_count else 0)
+            connection.send((self.records, share, seconds, min_share))
+        # end for
+
+        self.records = []
+
+        completed = 0
+        statistics = {}
+
+        for connection in self.connections:
+            worker_completed, worker_statistics = connection.recv()
+            completed += worker_completed
+
+            for action, visits, mean in worker_statistics:
+                total_visits, total_reward = statistics.get(action, (0, 0.0))
+                statistics[action] = (total_visits + visits, total_reward + visits * mean)
+            # end for
+        # end for
+
+        return completed, dict([(action, (visits, total_reward / visits if visits else 0.0))
+                                for action, (visits, total_reward) in statistics.items()])
+
+    # end def
+# end class
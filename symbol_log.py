@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Define a write-ahead log of the real (not simulated) actions and percepts of an agent.
+
+A log is a file of
+
+ - a header: the magic bytes `CTWWALOG`, the format version, the number of bits in an action
+   and in a percept, and the number of updates the agent had made when the log was started,
+ - a record for each action or percept: a byte for its kind (an action or a percept update),
+   then its symbols, packed eight to a byte.
+
+Records are only appended, and flushed to the operating system as they are, so the log survives
+the death of the process that writes it. A record that was only partly written when the process
+died is ignored, and removed when the log is next opened.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import struct
+
+from agent import action_update, percept_update
+
+# The identifier at the start of every log, and the current version of the format.
+log_magic = b'CTWWALOG'
+log_version = 1
+
+# The header of a log: its magic bytes, version, action and percept bits, and the update count it starts at.
+header_format = struct.Struct(str('<8sIIIQ'))
+
+# The byte identifying the kind of each record.
+record_kinds = {action_update: 0, percept_update: 1}
+
+
+def pack_symbols(symbol_list):
+    """ Returns the given symbols packed into bytes, eight to a byte, the first symbol in the lowest bit.
+    """
+
+    packed = bytearray((len(symbol_list) + 7) // 8)
+
+    for index, symbol in enumerate(symbol_list):
+        if symbol:
+            packed[index >> 3] |= 1 << (index & 7)
+    # end for
+
+    return packed
+
+# end def
+
+
+def unpack_symbols(packed, symbol_count):
+    """ Returns the given number of symbols unpacked from the given bytes. (See `pack_symbols`.)
+    """
+
+    return [(packed[index >> 3] >> (index & 7)) & 1 for index in range(symbol_count)]
+
+# end def
+
+
+class SymbolLog:
+    """ An append-only log of the symbols of the real actions and percepts of an agent,
+        from which its model can be recovered. (See `MC_AIXI_CTW_Agent.recover`.)
+
+        Each update is counted, from the agent's first, so that the log, and any snapshot of the
+        agent, can be matched: the log starts at the update count given to `restart`.
+    """
+
+    def __init__(self, path, action_bits, percept_bits):
+        """ Opens the log in the given file, to append records to, or starts a new log, at update
+            count 0, if the file does not exist.
+
+            - `path`: the file holding the log.
+            - `action_bits`, `percept_bits`: the number of symbols in each action and each percept.
+        """
+
+        self.path = path
+        self.action_bits = action_bits
+        self.percept_bits = percept_bits
+
+        # The number of symbols in each kind of record.
+        self.symbol_counts = {action_update: action_bits, percept_update: percept_bits}
+
+        # The update count the log starts at.
+        self.start = 0
+
+        # The open file, which records are appended to.
+        self.stream = None
+
+        if os.path.exists(path):
+            self.open()
+        else:
+            self.restart(0)
+
+    # end def
+
+    def append(self, kind, symbol_list):
+        """ Appends a record of an update of the given kind, with the given symbols, and flushes it.
+
+            - `kind`: `action_update` or `percept_update`.
+            - `symbol_list`: the symbols of the action or percept.
+        """
+
+        record = bytearray([record_kinds[kind]])
+        record += pack_symbols(symbol_list)
+
+        self.stream.write(record)
+        self.stream.flush()
+
+    # end def
+
+    def close(self):
+        """ Closes the file of the log.
+        """
+
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        # end if
+
+    # end def
+
+    def open(self):
+        """ Opens the existing log, checking its header, and removes a partly written last record.
+        """
+
+        with open(self.path, 'rb') as stream:
+            header = stream.read(header_format.size)
+            assert len(header) == header_format.size, "The symbol log '%s' has no header." % self.path
+
+            magic, version, action_bits, percept_bits, self.start = header_format.unpack(header)
+
+            assert magic == log_magic, "The file '%s' does not hold a symbol log." % self.path
+            assert version == log_version, "The symbol log has version %d, not %d." % (version, log_version)
+            assert (action_bits, percept_bits) == (self.action_bits, self.percept_bits), \
+                "The symbol log was written for actions and percepts of a different size."
+        # end with
+
+        self.stream = open(self.path, 'r+b')
+        self.stream.truncate(header_format.size + self.record_bytes())
+        self.stream.seek(0, os.SEEK_END)
+
+    # end def
+
+    def record_bytes(self):
+        """ Returns the number of bytes taken by the complete records of the log.
+        """
+
+        return sum([1 + (self.symbol_counts[kind] + 7) // 8 for kind, symbol_list in self.records()])
+
+    # end def
+
+    def records(self):
+        """ Returns a list of the kind and symbols of each complete record of the log, in the order
+            they were appended.
+        """
+
+        kinds = dict([(value, kind) for kind, value in record_kinds.items()])
+
+        with open(self.path, 'rb') as stream:
+            stream.seek(header_format.size)
+            data = bytearray(stream.read())
+        # end with
+
+        records = []
+        position = 0
+
+        while position < len(data):
+            kind = kinds.get(data[position])
+            assert kind is not None, "The symbol log '%s' is corrupt." % self.path
+
+            symbol_count = self.symbol_counts[kind]
+            end = position + 1 + (symbol_count + 7) // 8
+
+            # Stop at a record that was only partly written.
+            if end > len(data):
+                break
+
+            records.append((kind, unpack_symbols(data[position + 1:end], symbol_count)))
+            position = end
+        # end while
+
+        return records
+
+    # end def
+
+    def restart(self, start):
+        """ Replaces the log with an empty one, starting at the given update count.
+            The new log is written beside the old one, then moved over it, so that one of them is
+            always complete.
+        """
+
+        self.close()
+
+        temporary_path = self.path + '.new'
+
+        with open(temporary_path, 'wb') as stream:
+            stream.write(header_format.pack(log_magic, log_version, self.action_bits, self.percept_bits, start))
+            stream.flush()
+        # end with
+
+        os.replace(temporary_path, self.path)
+
+        self.start = start
+        self.stream = open(self.path, 'ab')
+
+    # end def
+# end class
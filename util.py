@@ -42,7 +42,7 @@ def choice(seq):
 def decode(symbol_list, bit_count):
     """ Decodes the value encoded on the end of a list of symbols.
         Each symbol is a bit in the binary representation of the value, with more significant
-        bits at the end of the list.
+        bits first, as produced by `encode`.
 
         - `symbol_list` - the list of symbols to decode from.
         - `bit_count` - the number of bits from the end of the symbol list to decode.
@@ -53,8 +53,7 @@ def decode(symbol_list, bit_count):
     # Take the last `bit_count` number of symbols from the end of the given symbol list.
     bits = symbol_list[-bit_count:]
 
-    # Reverse the list of bits, and make a string out of them.
-    bits.reverse()
+    # Make a string out of the bits.
     bit_string = ''.join(map(str, bits))
 
     # Return the bit string as an integer via the built-in int command, telling it that the number in the string is binary/base 2.